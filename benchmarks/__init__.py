@@ -0,0 +1,2 @@
+# benchmarks/__init__.py
+# Бенчмарки бота на локальной заглушке Bot API (без сети и реального Telegram)
@@ -0,0 +1,211 @@
+# benchmarks/content_router.py
+"""Микробенчмарк классификатора содержимого и проверка паритета с прежней логикой.
+
+Запуск:
+    python -m benchmarks.content_router
+
+Прежний способ (словарь из десяти лямбд и условий на каждое сообщение)
+воспроизведен здесь дословно, чтобы сравнивать с ним и по скорости, и по
+результату: для каждого поддерживаемого типа выбранный метод и аргументы
+пересылки пользователь -> группа должны совпадать.
+"""
+import os
+import timeit
+import tracemalloc
+
+# Конфигурация читается при импорте - для бенчмарка хватает заглушек
+for name, value in {
+    "TOKEN": "123456:BENCHMARK",
+    "GROUP_CHAT_ID": "-1001",
+    "POSTGRES_DB": "bench",
+    "POSTGRES_USER": "bench",
+    "POSTGRES_PASSWORD": "bench",
+    "POSTGRES_HOST": "localhost",
+}.items():
+    os.environ.setdefault(name, value)
+
+from telegram import Message  # noqa: E402
+
+from globals.config import MAX_FILE_SIZE, MAX_VOICE_SIZE  # noqa: E402
+from handlers.content import classify  # noqa: E402
+
+_FILE = {"file_id": "F", "file_unique_id": "U"}
+
+SAMPLES = {
+    "text": {"text": "Здравствуйте"},
+    "caption_only": {"caption": "Подпись без вложения"},
+    "photo": {
+        "photo": [{**_FILE, "width": 90, "height": 90}, {**_FILE, "file_id": "BIG", "width": 800, "height": 800}],
+        "caption": "фото",
+    },
+    "video": {"video": {**_FILE, "width": 1, "height": 1, "duration": 3}, "caption": "видео"},
+    "animation": {
+        "animation": {**_FILE, "width": 1, "height": 1, "duration": 1},
+        "document": {**_FILE, "file_name": "a.mp4", "file_size": 1000},
+    },
+    "voice": {"voice": {**_FILE, "duration": 2, "file_size": 1000}, "caption": "голос"},
+    "video_note": {"video_note": {**_FILE, "length": 1, "duration": 1, "file_size": 1000}},
+    "sticker": {
+        "sticker": {**_FILE, "width": 1, "height": 1, "is_animated": False, "is_video": False, "type": "regular"}
+    },
+    "audio": {
+        "audio": {**_FILE, "duration": 5, "title": "Песня", "performer": "Автор"},
+        "caption": "аудио",
+    },
+    "document": {"document": {**_FILE, "file_name": "a.pdf", "file_size": 1000}, "caption": "док"},
+    "location": {"location": {"latitude": 55.75, "longitude": 37.61, "horizontal_accuracy": 15}},
+}
+
+
+def make(fields) -> Message:
+    return Message.de_json(
+        {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, **fields}, None
+    )
+
+
+def legacy_route(message):
+    """Копия прежнего _handle_single_message (выбор метода и аргументов)."""
+    content_handlers = {
+        "animation": {
+            "method": "send_animation",
+            "args": lambda: {"animation": message.animation.file_id, "caption": message.caption},
+            "condition": bool(message.animation),
+        },
+        "voice": {
+            "method": "send_voice",
+            "args": lambda: {"voice": message.voice.file_id, "caption": message.caption},
+            "condition": bool(message.voice and message.voice.file_size <= MAX_VOICE_SIZE),
+        },
+        "sticker": {
+            "method": "send_sticker",
+            "args": lambda: {"sticker": message.sticker.file_id},
+            "condition": bool(message.sticker),
+        },
+        "video_note": {
+            "method": "send_video_note",
+            "args": lambda: {"video_note": message.video_note.file_id},
+            "condition": bool(
+                message.video_note
+                and getattr(message.video_note, "file_size", 0) <= MAX_VOICE_SIZE
+            ),
+        },
+        "location": {
+            "method": "send_location",
+            "args": lambda: {
+                "latitude": message.location.latitude,
+                "longitude": message.location.longitude,
+                **(
+                    {"horizontal_accuracy": message.location.horizontal_accuracy}
+                    if message.location.horizontal_accuracy
+                    else {}
+                ),
+                **(
+                    {"live_period": message.location.live_period}
+                    if message.location.live_period
+                    else {}
+                ),
+            },
+            "condition": bool(message.location),
+        },
+        "photo": {
+            "method": "send_photo",
+            "args": lambda: {"photo": message.photo[-1].file_id, "caption": message.caption},
+            "condition": bool(message.photo),
+        },
+        "video": {
+            "method": "send_video",
+            "args": lambda: {"video": message.video.file_id, "caption": message.caption},
+            "condition": bool(message.video),
+        },
+        "audio": {
+            "method": "send_audio",
+            "args": lambda: {
+                "audio": message.audio.file_id,
+                "caption": message.caption,
+                "title": message.audio.title,
+                "performer": message.audio.performer,
+            },
+            "condition": bool(message.audio),
+        },
+        "document": {
+            "method": "send_document",
+            "args": lambda: {"document": message.document.file_id, "caption": message.caption},
+            "condition": bool(message.document and message.document.file_size <= MAX_FILE_SIZE),
+        },
+        "text": {
+            "method": "send_message",
+            "args": lambda: {"text": message.text or message.caption},
+            "condition": bool(
+                message.text
+                or (
+                    message.caption
+                    and not any(
+                        [
+                            message.animation,
+                            message.sticker,
+                            message.photo,
+                            message.video,
+                            message.audio,
+                            message.voice,
+                            message.video_note,
+                            message.location,
+                            message.document,
+                        ]
+                    )
+                )
+            ),
+        },
+    }
+    for handler in content_handlers.values():
+        if handler["condition"]:
+            args = {k: v for k, v in handler["args"]().items() if v is not None}
+            return handler["method"], args
+    return None
+
+
+def new_route(message):
+    content = classify(message)
+    if content is None or content.too_big(message):
+        return None
+    return content.method, content.send_args(message)
+
+
+def check_parity(messages) -> None:
+    for name, message in messages.items():
+        legacy, new = legacy_route(message), new_route(message)
+        assert legacy == new, f"{name}: {legacy} != {new}"
+    print(f"Паритет с прежней логикой: {len(messages)} типов совпадают")
+
+
+def allocations(route, messages, rounds: int = 1000) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[1]
+    tracemalloc.reset_peak()
+    for _ in range(rounds):
+        for message in messages:
+            route(message)
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return peak
+
+
+def main() -> None:
+    messages = {name: make(fields) for name, fields in SAMPLES.items()}
+    check_parity(messages)
+
+    print(f"{'тип':<14} {'прежде, мкс':>12} {'теперь, мкс':>12} {'ускорение':>10}")
+    number = 20000
+    for name, message in messages.items():
+        legacy = timeit.timeit(lambda: legacy_route(message), number=number) / number
+        new = timeit.timeit(lambda: new_route(message), number=number) / number
+        print(f"{name:<14} {legacy * 1e6:>12.2f} {new * 1e6:>12.2f} {legacy / new:>9.1f}x")
+
+    sample = list(messages.values())
+    print(
+        f"Пиковая память на прогон, байт: прежде {allocations(legacy_route, sample)}, "
+        f"теперь {allocations(new_route, sample)}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# benchmarks/fake_bot_api.py
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from telegram.request import BaseRequest, RequestData
+
+BOT_ID = 777000
+BOT_USER = {
+    "id": BOT_ID,
+    "is_bot": True,
+    "first_name": "BenchBot",
+    "username": "bench_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": True,
+    "supports_inline_queries": False,
+}
+
+
+class FakeBotApi(BaseRequest):
+    """Заглушка Bot API: отвечает на запросы бота в памяти процесса.
+
+    latency - задержка одного HTTP-запроса к Bot API (имитация сети), сек.
+    Входящие обновления кладутся через feed() и отдаются через getUpdates
+    с семантикой long polling.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._updates: List[Dict[str, Any]] = []
+        self._new_updates = asyncio.Event()
+        self._message_ids = itertools.count(100000)
+        self._thread_ids = itertools.count(5000)
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def feed(self, update: Dict[str, Any]) -> None:
+        """Кладет обновление в очередь getUpdates."""
+        self._updates.append(update)
+        self._new_updates.set()
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=None,
+        write_timeout=None,
+        connect_timeout=None,
+        pool_timeout=None,
+    ) -> tuple:
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        result = await self._dispatch(endpoint, params)
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    async def _dispatch(self, endpoint: str, params: Dict[str, Any]) -> Any:
+        if endpoint == "getMe":
+            return BOT_USER
+        if endpoint == "getUpdates":
+            return await self._get_updates(params)
+        if endpoint == "getWebhookInfo":
+            return {
+                "url": "",
+                "has_custom_certificate": False,
+                "pending_update_count": len(self._updates),
+            }
+        if endpoint == "getChat":
+            return {
+                "id": params["chat_id"],
+                "type": "supergroup",
+                "is_forum": True,
+                "accent_color_id": 0,
+                "max_reaction_count": 11,
+            }
+        if endpoint == "createForumTopic":
+            return {
+                "message_thread_id": next(self._thread_ids),
+                "name": params.get("name", ""),
+                "icon_color": 7322096,
+            }
+        if endpoint == "sendMediaGroup":
+            return [self._message(params) for _ in params.get("media", [])]
+        if endpoint == "copyMessages":
+            return [
+                {"message_id": next(self._message_ids)}
+                for _ in params.get("message_ids", [])
+            ]
+        if endpoint == "copyMessage":
+            return {"message_id": next(self._message_ids)}
+        if endpoint.startswith("send"):
+            return self._message(params)
+        return True
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = params.get("offset", 0)
+        if offset:
+            # Подтверждаем все обновления до offset, как это делает Telegram
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(
+                    self._new_updates.wait(), params.get("timeout", 0) or 0.01
+                )
+            except asyncio.TimeoutError:
+                return []
+        limit = params.get("limit", 100)
+        return self._updates[:limit]
+
+    def _message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"},
+            "from": BOT_USER,
+        }
+        if params.get("message_thread_id"):
+            message["message_thread_id"] = params["message_thread_id"]
+        return message
+
+
+def make_message(
+    message_id: int,
+    user_id: int,
+    text: Optional[str] = None,
+    chat_id: Optional[int] = None,
+    **fields: Any,
+) -> Dict[str, Any]:
+    """Собирает JSON входящего сообщения Bot API."""
+    chat_id = user_id if chat_id is None else chat_id
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+        **fields,
+    }
+    if text is not None:
+        message["text"] = text
+    return message
+
+
+def make_update(update_id: int, message: Dict[str, Any]) -> Dict[str, Any]:
+    return {"update_id": update_id, "message": message}
@@ -0,0 +1,442 @@
+# benchmarks/load_test.py
+"""Нагрузочный тест бота на заглушках Telegram и PostgreSQL.
+
+Запуск:
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --scenario text --users 200 --messages 20
+    python -m benchmarks.load_test --db-latency 0.0005 --save baseline.json
+    python -m benchmarks.load_test --compare baseline.json --tolerance 0.2
+    python -m benchmarks.load_test --scenario albums --shared-albums
+
+Собирается настоящий Application из main.build_application() со всеми
+обработчиками; запросы к Bot API отвечает FakeBotApi, база - MemoryStore
+(или настоящий PostgreSQL с --postgres, параметры берутся из .env).
+Обновления кладутся прямо в update_queue, так что в замер не попадает
+транспорт getUpdates/webhook (его сравнивает benchmarks.webhook_vs_polling).
+
+Сценарии:
+    text     - поток текстовых сообщений от зарегистрированных пользователей
+    albums   - альбомы по 2-10 фото
+    replies  - ответы администраторов в топиках на сообщения бота
+    start    - шквал /start от новых пользователей (каждый второй - повторный)
+
+На каждый сценарий печатается: обновлений в секунду, p50/p99 задержки от
+постановки в очередь до окончания обработки, обменов с БД на обновление,
+запросов к Bot API на обновление и выделения памяти (отдельный прогон под
+tracemalloc, чтобы не искажать время).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmarks.fake_bot_api import BOT_USER, FakeBotApi, make_message, make_update
+from benchmarks.webhook_vs_polling import percentile
+
+# Конфигурация читается при импорте main - для бенчмарка хватает заглушек
+for name, value in {
+    "TOKEN": "123456:BENCHMARK",
+    "GROUP_CHAT_ID": "-1001",
+    "POSTGRES_DB": "bench",
+    "POSTGRES_USER": "bench",
+    "POSTGRES_PASSWORD": "bench",
+    "POSTGRES_HOST": "localhost",
+    "METRICS_PORT": "0",
+    # Короткое ожидание частей альбома, иначе сценарий albums меряет таймер
+    "MEDIA_GROUP_MIN_WAIT": "0.02",
+    "MEDIA_GROUP_MAX_WAIT": "0.1",
+}.items():
+    os.environ.setdefault(name, value)
+
+GROUP_CHAT_ID = int(os.environ["GROUP_CHAT_ID"])
+ADMIN_ID = 1
+SCENARIOS = ("text", "albums", "replies", "start")
+# Показатели, по которым --compare ищет регрессии, и их направление
+# (+1 - больше значит лучше, -1 - больше значит хуже)
+COMPARED = {"updates_per_s": 1, "p50_ms": -1, "p99_ms": -1, "db_round_trips": -1}
+
+
+def _command(message_id: int, user_id: int, command: str) -> Dict[str, Any]:
+    return make_message(
+        message_id,
+        user_id,
+        command,
+        entities=[{"type": "bot_command", "offset": 0, "length": len(command)}],
+    )
+
+
+class Stream:
+    """Синтетический поток обновлений со своим диапазоном идентификаторов.
+
+    Каждый прогон (замер и замер памяти) берет новые user_id и message_id,
+    чтобы не попадать в кеши, прогретые предыдущим прогоном.
+    """
+
+    def __init__(self, base: int):
+        self.base = base
+        self._update_id = base
+        self._message_id = base
+
+    def update(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        self._update_id += 1
+        return make_update(self._update_id, message)
+
+    def message_id(self) -> int:
+        self._message_id += 1
+        return self._message_id
+
+    def user_id(self, index: int) -> int:
+        return self.base + index
+
+    def thread_id(self, index: int) -> int:
+        return self.base + 500000 + index
+
+
+def seed_users(store, stream: Stream, users: int) -> None:
+    """Пользователи с уже созданными топиками (если база в памяти)."""
+    if store is None:
+        return
+    for index in range(users):
+        store.add_user(stream.user_id(index), f"user{index}", stream.thread_id(index))
+
+
+def text_scenario(store, stream: Stream, users: int, messages: int) -> List[dict]:
+    seed_users(store, stream, users)
+    return [
+        stream.update(make_message(stream.message_id(), stream.user_id(index), f"msg {n}"))
+        for n in range(messages)
+        for index in range(users)
+    ]
+
+
+def albums_scenario(store, stream: Stream, users: int, messages: int) -> List[dict]:
+    seed_users(store, stream, users)
+    updates = []
+    for n in range(messages):
+        for index in range(users):
+            group_id = f"{stream.base}-{index}-{n}"
+            for part in range(2 + (index + n) % 9):
+                updates.append(
+                    stream.update(
+                        make_message(
+                            stream.message_id(),
+                            stream.user_id(index),
+                            media_group_id=group_id,
+                            photo=[
+                                {
+                                    "file_id": f"{group_id}-{part}",
+                                    "file_unique_id": f"{group_id}-{part}",
+                                    "width": 800,
+                                    "height": 800,
+                                }
+                            ],
+                            caption="альбом" if part == 0 else None,
+                        )
+                    )
+                )
+    return updates
+
+
+def replies_scenario(store, stream: Stream, users: int, messages: int) -> List[dict]:
+    seed_users(store, stream, users)
+    updates = []
+    for n in range(messages):
+        for index in range(users):
+            user_id, thread_id = stream.user_id(index), stream.thread_id(index)
+            bot_message_id = stream.message_id()
+            if store is not None:
+                # Сообщение бота в топике, на которое отвечает администратор
+                store.add_bot_message(bot_message_id, user_id, thread_id)
+            updates.append(
+                stream.update(
+                    make_message(
+                        stream.message_id(),
+                        ADMIN_ID,
+                        f"ответ {n}",
+                        chat_id=GROUP_CHAT_ID,
+                        message_thread_id=thread_id,
+                        is_topic_message=True,
+                        reply_to_message={
+                            "message_id": bot_message_id,
+                            "date": int(time.time()),
+                            "chat": {"id": GROUP_CHAT_ID, "type": "supergroup"},
+                            "from": BOT_USER,
+                            "message_thread_id": thread_id,
+                            "text": "сообщение пользователя",
+                        },
+                    )
+                )
+            )
+    return updates
+
+
+def start_scenario(store, stream: Stream, users: int, messages: int) -> List[dict]:
+    updates = []
+    for n in range(messages):
+        for index in range(users):
+            # Четные пользователи повторяют /start в каждом раунде, нечетные - новые
+            user_id = stream.user_id(index + (n * users if index % 2 else 0))
+            updates.append(
+                stream.update(_command(stream.message_id(), user_id, "/start"))
+            )
+    return updates
+
+
+SCENARIO_BUILDERS: Dict[str, Callable[..., List[dict]]] = {
+    "text": text_scenario,
+    "albums": albums_scenario,
+    "replies": replies_scenario,
+    "start": start_scenario,
+}
+
+
+class Harness:
+    """Настоящий Application на заглушках, с учетом задержки каждого обновления."""
+
+    def __init__(
+        self, api_latency: float, db_latency: float, postgres: bool, topic_pool: int = 0
+    ):
+        self.api = FakeBotApi(latency=api_latency)
+        self.topic_pool = topic_pool
+        self.store = None
+        self.postgres = postgres
+        self.db_latency = db_latency
+        self.enqueued: Dict[int, float] = {}
+        self.latencies: List[float] = []
+
+    async def __aenter__(self) -> "Harness":
+        import asyncpg
+
+        import main
+        from database import db
+        from handlers.messages import media_groups
+        from services.outbox import outbox
+
+        self.db = db
+        self.media_groups = media_groups
+        self.outbox = outbox
+        if not self.postgres:
+            from benchmarks.memory_db import (
+                MemoryStore,
+                memory_connect,
+                memory_create_pool,
+            )
+
+            self.store = MemoryStore(latency=self.db_latency)
+            # Заготовленные топики для /start
+            self.store.topic_pool.extend(range(900_000_000, 900_000_000 + self.topic_pool))
+            asyncpg.create_pool = memory_create_pool(self.store)
+            asyncpg.connect = memory_connect(self.store)
+        await db.connect()
+
+        self.application = main.build_application(requests=(self.api, self.api))
+        processor = self.application.update_processor
+        process = processor.do_process_update
+
+        async def timed_process(update, coroutine):
+            try:
+                await process(update, coroutine)
+            finally:
+                self.latencies.append(
+                    time.perf_counter() - self.enqueued.pop(update.update_id)
+                )
+
+        # Замер от постановки в очередь до окончания всех обработчиков
+        processor.do_process_update = timed_process
+        await self.application.initialize()
+        await self.application.start()
+        self.outbox.start(self.application)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.outbox.stop()
+        await self.application.stop()
+        await self.application.shutdown()
+        await self.db.close()
+
+    def _idle(self) -> bool:
+        stats = self.application.update_processor.stats()
+        return (
+            not self.enqueued
+            and self.application.update_queue.empty()
+            and not (stats["running"] or stats["queued"] or stats["backlog"])
+            and not self.media_groups.groups(self.application.bot_data)
+            and self.outbox.idle()
+        )
+
+    async def replay(self, updates: List[dict]) -> float:
+        """Отдает обновления пачкой и ждет окончания всей обработки. Возвращает время, сек."""
+        from telegram import Update
+
+        self.latencies = []
+        parsed = [Update.de_json(data, self.application.bot) for data in updates]
+        started = time.perf_counter()
+        for update in parsed:
+            self.enqueued[update.update_id] = time.perf_counter()
+            self.application.update_queue.put_nowait(update)
+        while True:
+            await asyncio.sleep(0.001)
+            if not self._idle():
+                continue
+            finished = time.perf_counter()
+            # Альбом может уйти в отправку уже после разбора последней части
+            await asyncio.sleep(0.01)
+            if self._idle():
+                break
+        await self.db.flush()
+        return finished - started
+
+    def counters(self) -> Dict[str, int]:
+        return {
+            "db": self.store.total_round_trips() if self.store else 0,
+            "api": sum(self.api.calls.values()),
+        }
+
+
+async def run_scenario(harness: Harness, name: str, users: int, messages: int, base: int):
+    build = SCENARIO_BUILDERS[name]
+
+    # Замер времени
+    updates = build(harness.store, Stream(base), users, messages)
+    before = harness.counters()
+    elapsed = await harness.replay(updates)
+    after = harness.counters()
+    latencies = harness.latencies
+
+    # Замер памяти на таком же потоке с новыми идентификаторами
+    updates_alloc = build(harness.store, Stream(base + 10_000_000), users, messages)
+    tracemalloc.start()
+    snapshot = tracemalloc.take_snapshot()
+    await harness.replay(updates_alloc)
+    stats = tracemalloc.take_snapshot().compare_to(snapshot, "filename")
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    count = len(updates)
+    return {
+        "scenario": name,
+        "updates": count,
+        "updates_per_s": count / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "db_round_trips": (after["db"] - before["db"]) / count,
+        "api_calls": (after["api"] - before["api"]) / count,
+        "alloc_blocks": sum(stat.count_diff for stat in stats) / count,
+        "alloc_peak_kb": peak / 1024,
+    }
+
+
+def print_results(results: List[dict], postgres: bool) -> None:
+    header = (
+        f"{'сценарий':<9} {'обновл.':>7} {'обн/с':>9} {'p50 мс':>8} {'p99 мс':>8} "
+        f"{'БД/обн':>7} {'API/обн':>8} {'блоков/обн':>11} {'пик КБ':>9}"
+    )
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        db = "-" if postgres else f"{r['db_round_trips']:.2f}"
+        print(
+            f"{r['scenario']:<9} {r['updates']:>7} {r['updates_per_s']:>9.0f} "
+            f"{r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} {db:>7} {r['api_calls']:>8.2f} "
+            f"{r['alloc_blocks']:>11.1f} {r['alloc_peak_kb']:>9.0f}"
+        )
+
+
+def compare(results: List[dict], baseline_path: str, tolerance: float) -> List[str]:
+    """Сравнивает с сохраненным прогоном, возвращает найденные регрессии."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {r["scenario"]: r for r in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        base = baseline.get(result["scenario"])
+        if base is None:
+            continue
+        for metric, direction in COMPARED.items():
+            old, new = base[metric], result[metric]
+            if not old:
+                continue
+            change = (new - old) / old * direction
+            if change < -tolerance:
+                regressions.append(
+                    f"{result['scenario']}.{metric}: {old:.2f} -> {new:.2f} "
+                    f"({change * 100:+.0f}%)"
+                )
+    return regressions
+
+
+async def run(args: argparse.Namespace) -> List[dict]:
+    results = []
+    async with Harness(
+        args.api_latency, args.db_latency, args.postgres, args.topic_pool
+    ) as harness:
+        # Разогрев: импорты, ленивые структуры PTB, первые соединения
+        await run_scenario(harness, "text", 5, 2, base=1_000_000_000)
+        for index, name in enumerate(args.scenario or SCENARIOS):
+            base = 100_000_000 * (index + 1)
+            results.append(
+                await run_scenario(harness, name, args.users, args.messages, base)
+            )
+        if harness.store is not None and harness.store.unknown:
+            print("Запросы, неизвестные MemoryStore:", dict(harness.store.unknown))
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=10, help="сообщений на пользователя")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="сек на запрос Bot API")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="сек на обмен с БД")
+    parser.add_argument("--postgres", action="store_true", help="настоящий PostgreSQL из .env")
+    parser.add_argument(
+        "--rate-limits", action="store_true", help="оставить лимиты отправки Telegram"
+    )
+    parser.add_argument(
+        "--topic-pool", type=int, default=0, help="заготовленных топиков для /start"
+    )
+    parser.add_argument(
+        "--shared-albums",
+        action="store_true",
+        help="общая сборка альбомов в БД (MEDIA_GROUP_COORDINATION=postgres)",
+    )
+    parser.add_argument("--log", action="store_true", help="не приглушать журнал бота")
+    parser.add_argument("--save", help="сохранить результаты в JSON")
+    parser.add_argument("--compare", help="сравнить с сохраненными результатами")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if not args.rate_limits:
+        # Иначе прогон упирается в 20 сообщений в минуту на группу
+        for name in ("RATE_LIMIT_OVERALL", "RATE_LIMIT_GROUP", "RATE_LIMIT_PRIVATE"):
+            os.environ[name] = "1000000000"
+    if args.topic_pool:
+        os.environ["TOPIC_POOL_SIZE"] = str(args.topic_pool)
+    if args.shared_albums:
+        os.environ["MEDIA_GROUP_COORDINATION"] = "postgres"
+    if not args.log:
+        from loger.logger import logger
+
+        logger.setLevel(logging.WARNING)
+
+    results = asyncio.run(run(args))
+    print_results(results, args.postgres)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        for line in regressions:
+            print("РЕГРЕССИЯ", line)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+# benchmarks/memory_db.py
+"""Хранилище в памяти вместо PostgreSQL для нагрузочных тестов.
+
+MemoryPool подменяет пул asyncpg: настоящий Database (кеши, single-flight,
+буферы записи) работает без изменений, а каждый запрос к "серверу"
+учитывается как один сетевой обмен. Отвечает на запросы из database.STATEMENTS
+на служебные запросы миграций и persistence, а также имитирует NOTIFY
+для общей сборки альбомов; незнакомые запросы
+выполняются как пустые и попадают в MemoryStore.unknown.
+"""
+import asyncio
+import json
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from database import STATEMENTS
+from migrations import LATEST_VERSION
+
+
+def _normalize(query: str) -> str:
+    return " ".join(query.split())
+
+
+class MemoryStore:
+    """Таблицы бота в словарях и счетчики обращений к ним.
+
+    latency - задержка одного обмена с сервером (имитация сети), сек.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.round_trips: Counter = Counter()
+        self.unknown: Counter = Counter()
+        self.users: Dict[int, dict] = {}
+        self.users_by_thread: Dict[int, int] = {}
+        self.bot_messages: Dict[int, Tuple[int, int]] = {}
+        self.links_to_user: Dict[Tuple[int, int], int] = {}
+        self.links_to_group: Dict[Tuple[int, int], int] = {}
+        self.persistence: Dict[Tuple[str, str], bytes] = {}
+        self.topic_pool: List[int] = []
+        self.media_groups: Dict[str, dict] = {}
+        # outbox: id -> строка, ключ идемпотентности -> id, полоса -> id по порядку
+        self.outbox: Dict[int, dict] = {}
+        self.outbox_keys: Dict[str, int] = {}
+        self.outbox_lanes: Dict[str, List[int]] = {}
+        # Архив переписки (строки COPY в messages)
+        self.archive: List[dict] = []
+        # События сводной статистики в порядке записи
+        self.stats_events: List[tuple] = []
+        # Подписчики NOTIFY: (канал, callback)
+        self.listeners: List[Tuple[str, Callable[..., Any]]] = []
+        # Смещение обновлений и обработанные обновления выше него
+        self.update_offset: Optional[int] = None
+        self.processed_updates: Set[int] = set()
+        # False - сервер недоступен: каждый запрос падает с ConnectionRefusedError
+        self.available = True
+        self._queries: Dict[str, Callable[..., Any]] = {
+            _normalize(STATEMENTS["get_user"]): self._get_user,
+            _normalize(STATEMENTS["get_user_by_thread"]): self._get_user_by_thread,
+            _normalize(STATEMENTS["get_user_by_bot_message"]): self._get_user_by_bot_message,
+            _normalize(STATEMENTS["get_message_mapping"]): self._get_message_mapping,
+            _normalize(STATEMENTS["get_group_message_mapping"]): self._get_group_message_mapping,
+            _normalize(STATEMENTS["add_media_group_item"]): self._add_media_group_item,
+            _normalize(STATEMENTS["claim_media_group"]): self._claim_media_group,
+            _normalize(STATEMENTS["enqueue_outbox"]): self._enqueue_outbox,
+            _normalize(STATEMENTS["claim_outbox"]): self._claim_outbox,
+            _normalize(STATEMENTS["complete_outbox"]): self._complete_outbox,
+            _normalize(STATEMENTS["record_stats_event"]): self._record_stats_event,
+        }
+        # Запросы, которых нет в STATEMENTS, узнаются по началу текста
+        self._prefixes: List[Tuple[str, Callable[..., Any]]] = [
+            ("SELECT MAX(version) FROM schema_version", lambda: LATEST_VERSION),
+            ("SELECT ensure_month_partitions(", lambda months_ahead: 0),
+            ("INSERT INTO users", self.add_user),
+            ("SELECT kind, key, value FROM ptb_persistence", self._load_persistence),
+            ("INSERT INTO ptb_persistence", self._put_persistence),
+            ("DELETE FROM ptb_persistence", self._delete_persistence),
+            ("SELECT u.* FROM users u JOIN (", lambda limit: []),
+            ("SELECT user_id, username, thread_id FROM users", lambda: list(self.users.values())),
+            ("SELECT NOT pg_is_in_recovery()", lambda: True),
+            ("DELETE FROM topic_pool", self._claim_topic),
+            ("INSERT INTO topic_pool", self.topic_pool.append),
+            ("SELECT count(*) FROM topic_pool", lambda: len(self.topic_pool)),
+            ("WITH claimed AS ( UPDATE media_groups", lambda *args: []),
+            ("SELECT message_id, media_type, file_id, caption", self._media_group_items),
+            ("UPDATE media_groups SET sent_at", self._mark_media_group_sent),
+            ("WITH deleted AS ( DELETE FROM media_groups", self._delete_media_groups),
+            ("WITH queue AS (", self._claim_outbox_run),
+            ("UPDATE outbox SET locked_until = NULL", self._retry_outbox),
+            ("UPDATE outbox SET attempts = attempts - 1", self._release_outbox),
+            ("UPDATE outbox SET failed_at", self._fail_outbox),
+            ("DELETE FROM outbox", lambda max_age: "DELETE 0"),
+            ("SELECT value FROM bot_state", lambda: self.update_offset),
+            ("SELECT update_id FROM processed_updates", self._processed_updates),
+            ("WITH saved AS ( INSERT INTO bot_state", self._save_update_offset),
+        ]
+
+    def total_round_trips(self) -> int:
+        return sum(self.round_trips.values())
+
+    def add_user(self, user_id: int, username: str, thread_id: int) -> None:
+        if user_id not in self.users:
+            self.users[user_id] = {
+                "user_id": user_id,
+                "username": username,
+                "thread_id": thread_id,
+            }
+            self.users_by_thread[thread_id] = user_id
+
+    def add_bot_message(self, message_id: int, user_id: int, thread_id: int) -> None:
+        self._insert_bot_message(message_id, user_id, thread_id)
+
+    def resolve(self, query: str) -> Tuple[str, Optional[Callable[..., Any]]]:
+        """Имя запроса для статистики и его обработчик."""
+        text = _normalize(query)
+        handler = self._queries.get(text)
+        if handler is not None:
+            return handler.__name__.lstrip("_"), handler
+        for prefix, handler in self._prefixes:
+            if text.startswith(prefix):
+                return prefix, handler
+        self.unknown[text[:80]] += 1
+        return "unknown", None
+
+    # Обработчики запросов
+
+    def _get_user(self, user_id: int) -> Optional[dict]:
+        return self.users.get(user_id)
+
+    def _get_user_by_thread(self, thread_id: int) -> Optional[dict]:
+        return self.users.get(self.users_by_thread.get(thread_id))
+
+    def _get_user_by_bot_message(self, message_id: int) -> Optional[dict]:
+        row = self.bot_messages.get(message_id)
+        return self.users.get(row[0]) if row else None
+
+    def _insert_bot_message(self, message_id: int, user_id: int, thread_id: int) -> None:
+        self.bot_messages.setdefault(message_id, (user_id, thread_id))
+
+    def _insert_message_map(
+        self, group_message_id: int, user_message_id: int, user_id: int
+    ) -> None:
+        self.links_to_user.setdefault((group_message_id, user_id), user_message_id)
+        self.links_to_group.setdefault((user_message_id, user_id), group_message_id)
+
+    def _get_message_mapping(self, group_message_id: int, user_id: int) -> Optional[int]:
+        return self.links_to_user.get((group_message_id, user_id))
+
+    def _get_group_message_mapping(
+        self, user_message_id: int, user_id: int
+    ) -> Optional[int]:
+        return self.links_to_group.get((user_message_id, user_id))
+
+    def _claim_topic(self) -> Optional[int]:
+        return self.topic_pool.pop(0) if self.topic_pool else None
+
+    def _add_media_group_item(
+        self, key, user_id, thread_id, message_id, media_type, file_id, caption
+    ) -> dict:
+        group = self.media_groups.get(key)
+        if group is None:
+            group = self.media_groups[key] = {
+                "user_id": user_id,
+                "thread_id": thread_id,
+                "claimed_at": None,
+                "sent_at": None,
+                "items": {},
+            }
+        items = group["items"]
+        known = message_id in items
+        accepted = group["claimed_at"] is None and group["sent_at"] is None
+        if accepted:
+            group["last_seen"] = time.monotonic()
+            items.setdefault(message_id, (media_type, file_id, caption))
+        return {"accepted": accepted, "known": known, "items": len(items)}
+
+    def _claim_media_group(self, key, owner, idle, lease) -> Optional[dict]:
+        group = self.media_groups.get(key)
+        if group is None:
+            return None
+        now = time.monotonic()
+        free = group["sent_at"] is None and (
+            group["claimed_at"] is None or group["claimed_at"] < now - lease
+        )
+        claimed = free and group["last_seen"] <= now - idle
+        if claimed:
+            group["claimed_at"] = now
+            self.notify("media_groups", key)
+        return {
+            "claimed": claimed,
+            "user_id": group["user_id"] if claimed else None,
+            "thread_id": group["thread_id"] if claimed else None,
+            "wait": idle - (now - group["last_seen"]) if free else None,
+        }
+
+    def _media_group_items(self, key) -> List[dict]:
+        items = self.media_groups.get(key, {"items": {}})["items"]
+        return [
+            {"message_id": message_id, "media_type": t, "file_id": f, "caption": c}
+            for message_id, (t, f, c) in sorted(items.items())
+        ]
+
+    def _mark_media_group_sent(self, key, owner) -> None:
+        self.media_groups.get(key, {})["sent_at"] = time.monotonic()
+
+    def _delete_media_groups(self, max_age) -> dict:
+        return {"sent": 0, "expired": 0}
+
+    def _enqueue_outbox(self, key, lane, kind, method, payload, effects) -> Optional[int]:
+        if key in self.outbox_keys:
+            return None
+        outbox_id = len(self.outbox) + 1
+        self.outbox[outbox_id] = {
+            "id": outbox_id,
+            "idempotency_key": key,
+            "lane": lane,
+            "kind": kind,
+            "method": method,
+            "payload": payload,
+            "effects": effects,
+            "attempts": 0,
+            "next_attempt_at": 0.0,
+            "locked_until": None,
+        }
+        self.outbox_keys[key] = outbox_id
+        self.outbox_lanes.setdefault(lane, []).append(outbox_id)
+        return outbox_id
+
+    def _claim_outbox(self, limit, lease) -> List[dict]:
+        now = time.monotonic()
+        claimed = []
+        for queue in self.outbox_lanes.values():
+            row = self.outbox[queue[0]]
+            if row["next_attempt_at"] > now:
+                continue
+            if row["locked_until"] is not None and row["locked_until"] >= now:
+                continue
+            row["locked_until"] = now + lease
+            row["attempts"] += 1
+            claimed.append({**row, "queued": len(queue)})
+            if len(claimed) >= limit:
+                break
+        return claimed
+
+    def _claim_outbox_run(self, lane, head_id, limit, lease) -> List[dict]:
+        now = time.monotonic()
+        claimed = []
+        for outbox_id in self.outbox_lanes.get(lane, []):
+            if outbox_id <= head_id:
+                continue
+            row = self.outbox[outbox_id]
+            if (
+                len(claimed) >= limit
+                or row["method"] != "copy_message"
+                or "reply_to_message_id" in json.loads(row["payload"])
+                or row["next_attempt_at"] > now
+                or (row["locked_until"] is not None and row["locked_until"] >= now)
+            ):
+                break
+            row["locked_until"] = now + lease
+            row["attempts"] += 1
+            claimed.append(dict(row))
+        return claimed
+
+    def _finish_outbox(self, outbox_id) -> bool:
+        lane = self.outbox[outbox_id]["lane"]
+        queue = self.outbox_lanes.get(lane)
+        if not queue or queue[0] != outbox_id:
+            return False
+        queue.pop(0)
+        if not queue:
+            del self.outbox_lanes[lane]
+        return True
+
+    def _complete_outbox(
+        self, outbox_id, user_id, thread_id, message_ids, group_ids, user_ids
+    ) -> int:
+        if not self._finish_outbox(outbox_id):
+            return 0
+        for message_id in message_ids:
+            self._insert_bot_message(message_id, user_id, thread_id)
+        for group_message_id, user_message_id in zip(group_ids, user_ids):
+            self._insert_message_map(group_message_id, user_message_id, user_id)
+        return 1
+
+    def _retry_outbox(self, outbox_id, delay, error) -> None:
+        row = self.outbox[outbox_id]
+        row["locked_until"] = None
+        row["next_attempt_at"] = time.monotonic() + delay
+
+    def _release_outbox(self, outbox_ids) -> None:
+        for outbox_id in outbox_ids:
+            row = self.outbox[outbox_id]
+            row["locked_until"] = None
+            row["attempts"] -= 1
+
+    def _fail_outbox(self, outbox_id, error) -> None:
+        self._finish_outbox(outbox_id)
+
+    def _record_stats_event(self, *event) -> None:
+        self.stats_events.append(event)
+
+    def notify(self, channel: str, payload: str) -> None:
+        """Доставляет NOTIFY подписчикам после "фиксации" (следующей итерацией цикла)."""
+        loop = asyncio.get_running_loop()
+        for listen_channel, callback in self.listeners:
+            if listen_channel == channel:
+                loop.call_soon(callback, None, 0, channel, payload)
+
+    def _load_persistence(self) -> List[dict]:
+        return [
+            {"kind": kind, "key": key, "value": value}
+            for (kind, key), value in self.persistence.items()
+        ]
+
+    def _put_persistence(self, kind: str, key: str, value: bytes) -> None:
+        self.persistence[(kind, key)] = value
+
+    def _delete_persistence(self, kind: str, key: str) -> None:
+        self.persistence.pop((kind, key), None)
+
+    def _processed_updates(self) -> List[dict]:
+        return [{"update_id": update_id} for update_id in sorted(self.processed_updates)]
+
+    def _save_update_offset(self, offset: int, processed: List[int]) -> None:
+        self.update_offset = offset
+        self.processed_updates = {update_id for update_id in processed if update_id > offset}
+
+
+class MemoryConnection:
+    """Соединение с интерфейсом asyncpg.Connection поверх MemoryStore."""
+
+    def __init__(self, store: MemoryStore):
+        self.store = store
+
+    async def _run(self, query: str, rows: List[tuple]) -> List[Any]:
+        store = self.store
+        if not store.available:
+            raise ConnectionRefusedError("memory store is unavailable")
+        name, handler = store.resolve(query)
+        store.round_trips[name] += 1
+        if store.latency:
+            await asyncio.sleep(store.latency)
+        if handler is None:
+            return [None for _ in rows]
+        return [handler(*args) for args in rows]
+
+    async def prepare(self, query: str) -> None:
+        pass
+
+    async def execute(self, query: str, *args) -> str:
+        result = (await self._run(query, [args]))[0]
+        return result if isinstance(result, str) else "OK"
+
+    async def executemany(self, query: str, rows) -> None:
+        await self._run(query, list(rows))
+
+    async def copy_records_to_table(self, table: str, records, columns) -> str:
+        store = self.store
+        if not store.available:
+            raise ConnectionRefusedError("memory store is unavailable")
+        store.round_trips[f"copy_{table}"] += 1
+        if store.latency:
+            await asyncio.sleep(store.latency)
+        records = list(records)
+        store.archive.extend(dict(zip(columns, record)) for record in records)
+        return f"COPY {len(records)}"
+
+    async def fetch(self, query: str, *args) -> List[Any]:
+        return (await self._run(query, [args]))[0] or []
+
+    async def fetchrow(self, query: str, *args) -> Any:
+        return (await self._run(query, [args]))[0]
+
+    async def fetchval(self, query: str, *args) -> Any:
+        return (await self._run(query, [args]))[0]
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+    async def add_listener(self, channel: str, callback: Callable[..., Any]) -> None:
+        self.store.listeners.append((channel, callback))
+
+    def is_closed(self) -> bool:
+        return False
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryPool:
+    """Пул с интерфейсом asyncpg.Pool: не больше max_size соединений одновременно."""
+
+    def __init__(self, store: MemoryStore, max_size: int = 10):
+        self.store = store
+        self._max_size = max_size
+        self._idle = [MemoryConnection(store) for _ in range(max_size)]
+        self._available = asyncio.Semaphore(max_size)
+        self._closed = False
+
+    async def acquire(self) -> MemoryConnection:
+        await self._available.acquire()
+        return self._idle.pop()
+
+    async def release(self, conn: MemoryConnection) -> None:
+        self._idle.append(conn)
+        self._available.release()
+
+    def get_size(self) -> int:
+        return self._max_size
+
+    def get_idle_size(self) -> int:
+        return len(self._idle)
+
+    async def expire_connections(self) -> None:
+        pass
+
+    def is_closing(self) -> bool:
+        return self._closed
+
+    async def close(self) -> None:
+        self._closed = True
+
+
+def memory_create_pool(store: MemoryStore):
+    """Замена asyncpg.create_pool, отдающая MemoryPool над store."""
+
+    async def create_pool(*args, max_size: int = 10, init=None, **kwargs) -> MemoryPool:
+        pool = MemoryPool(store, max_size=max_size)
+        if init is not None:
+            for conn in pool._idle:
+                await init(conn)
+        return pool
+
+    return create_pool
+
+
+def memory_connect(store: MemoryStore):
+    """Замена asyncpg.connect (отдельные соединения, например для LISTEN)."""
+
+    async def connect(*args, **kwargs) -> MemoryConnection:
+        return MemoryConnection(store)
+
+    return connect
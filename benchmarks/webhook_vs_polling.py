@@ -0,0 +1,205 @@
+# benchmarks/webhook_vs_polling.py
+"""Сравнение задержки доставки обновлений до обработчика: polling против webhook.
+
+Запуск:
+    python -m benchmarks.webhook_vs_polling --updates 2000 --latency 0.05
+
+Оба режима работают на одной заглушке Bot API (FakeBotApi). Сетевая задержка
+задается как RTT: в polling она тратится на каждый getUpdates, в webhook -
+на доставку POST-запроса от "Telegram" до локального слушателя.
+"""
+import argparse
+import asyncio
+import json
+import socket
+import time
+from typing import Dict, List
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, TypeHandler
+
+from benchmarks.fake_bot_api import FakeBotApi, make_message, make_update
+
+TOKEN = "123456:BENCHMARK"
+SECRET = "bench-secret"
+MAX_WEBHOOK_CONNECTIONS = 40  # Значение max_connections по умолчанию у Telegram
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class _RttFakeBotApi(FakeBotApi):
+    """Делит RTT пополам: запрос до сервера и ответ обратно."""
+
+    async def _dispatch(self, endpoint, params):
+        result = await super()._dispatch(endpoint, params)
+        if self.latency:
+            await asyncio.sleep(self.latency / 2)
+        return result
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        latency, self.latency = self.latency, self.latency / 2
+        try:
+            return await super().do_request(url, method, request_data, **kwargs)
+        finally:
+            self.latency = latency
+
+
+def _updates(count: int):
+    for update_id in range(1, count + 1):
+        message = make_message(update_id, 1000 + update_id % 50, "hi")
+        yield update_id, make_update(update_id, message)
+
+
+async def _post(reader, writer, host: str, path: str, body: bytes) -> None:
+    """Один POST по keep-alive соединению (минимальный клиент HTTP/1.1)."""
+    writer.write(
+        f"POST {path} HTTP/1.1\r\nHost: {host}\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+        f"X-Telegram-Bot-Api-Secret-Token: {SECRET}\r\n\r\n".encode()
+        + body
+    )
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    length = 0
+    for line in head.split(b"\r\n"):
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":", 1)[1])
+    if length:
+        await reader.readexactly(length)
+    if status != 200:
+        raise RuntimeError(f"webhook ответил {status}")
+
+
+async def _send_webhooks(
+    port: int, count: int, rate: float, latency: float, sent_at: Dict[int, float]
+) -> None:
+    """Доставляет обновления POST-запросами по пулу соединений, как Telegram.
+
+    Используется простой клиент на asyncio-потоках: пул httpx на 40 соединений
+    сам становится узким местом и искажает результат.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def connection() -> None:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            while True:
+                body = await queue.get()
+                try:
+                    await asyncio.sleep(latency / 2)
+                    await _post(reader, writer, f"127.0.0.1:{port}", "/bench", body)
+                finally:
+                    queue.task_done()
+        finally:
+            writer.close()
+
+    workers = [
+        asyncio.ensure_future(connection()) for _ in range(MAX_WEBHOOK_CONNECTIONS)
+    ]
+    for update_id, update in _updates(count):
+        sent_at[update_id] = time.perf_counter()
+        queue.put_nowait(json.dumps(update).encode())
+        await asyncio.sleep(1 / rate if rate else 0)
+    await queue.join()
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+
+
+async def run_mode(mode: str, updates: int, rate: float, latency: float) -> Dict:
+    api = _RttFakeBotApi(latency=latency)
+    sent_at: Dict[int, float] = {}
+    latencies: List[float] = []
+    done = asyncio.Event()
+
+    async def record(update: Update, context) -> None:
+        latencies.append(time.perf_counter() - sent_at[update.update_id])
+        if len(latencies) == updates:
+            done.set()
+
+    application = (
+        ApplicationBuilder().token(TOKEN).request(api).get_updates_request(api).build()
+    )
+    application.add_handler(TypeHandler(Update, record))
+    await application.initialize()
+    await application.start()
+
+    if mode == "polling":
+        await application.updater.start_polling(timeout=10)
+        started = time.perf_counter()
+        for update_id, update in _updates(updates):
+            sent_at[update_id] = time.perf_counter()
+            api.feed(update)
+            await asyncio.sleep(1 / rate if rate else 0)
+    else:
+        port = _free_port()
+        await application.updater.start_webhook(
+            listen="127.0.0.1",
+            port=port,
+            url_path="bench",
+            secret_token=SECRET,
+            webhook_url=f"http://127.0.0.1:{port}/bench",
+        )
+        started = time.perf_counter()
+        # "Telegram" работает в отдельном потоке со своим циклом событий,
+        # чтобы HTTP-клиент не конкурировал с ботом за его цикл
+        sender = asyncio.ensure_future(
+            asyncio.to_thread(
+                asyncio.run, _send_webhooks(port, updates, rate, latency, sent_at)
+            )
+        )
+
+    await asyncio.wait_for(done.wait(), timeout=120)
+    elapsed = time.perf_counter() - started
+
+    if mode == "webhook":
+        await sender
+
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+
+    return {
+        "mode": mode,
+        "updates": updates,
+        "throughput": updates / elapsed,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies) * 1000,
+        "api_calls": sum(api.calls.values()),
+    }
+
+
+async def main(args) -> None:
+    print(
+        f"{'режим':<8} {'нагрузка':<10} {'upd/s':>9} {'p50, мс':>9} "
+        f"{'p99, мс':>9} {'max, мс':>9} {'API':>6}"
+    )
+    for rate, label in ((args.rate, f"{args.rate:g}/с"), (0, "залп")):
+        for mode in ("polling", "webhook"):
+            result = await run_mode(mode, args.updates, rate, args.latency)
+            print(
+                f"{result['mode']:<8} {label:<10} {result['throughput']:>9.0f} "
+                f"{result['p50_ms']:>9.1f} {result['p99_ms']:>9.1f} "
+                f"{result['max_ms']:>9.1f} {result['api_calls']:>6}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=200, help="обновлений в секунду")
+    parser.add_argument("--latency", type=float, default=0.05, help="RTT до Bot API, сек")
+    asyncio.run(main(parser.parse_args()))
@@ -1,223 +1,1664 @@
 import asyncpg
+import asyncio
 import os
-from typing import Optional
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from contextlib import asynccontextmanager, suppress
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from globals.config import (
+    ARCHIVE_BATCH_SIZE,
+    ARCHIVE_FLUSH_INTERVAL,
+    ARCHIVE_MAX_PENDING,
+    DB_BREAKER_THRESHOLD,
+    DB_CONFIG,
+    DB_DEFERRED_MAX,
+    DB_POOL_CONFIG,
+    DB_RECONNECT_BASE,
+    DB_RECONNECT_MAX,
+    DB_STARTUP_TIMEOUT,
+    LINK_CACHE_SIZE,
+    LINK_CACHE_TTL,
+    MESSAGE_HOT_DAYS,
+    MESSAGE_PARTITIONS_AHEAD,
+    MESSAGE_RETENTION_ACTION,
+    MESSAGE_RETENTION_MONTHS,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL,
+    WRITE_BATCH_SIZE,
+    WRITE_FLUSH_INTERVAL,
+)
 from loger.logger import logger
+from migrations import migrate as apply_migrations
+from partitions import ensure_partitions, maintain as maintain_partitions
+from services.metrics import DB_LATENCY, track_query
+
+# Маркер отсутствия записи в кеше (None - допустимое значение)
+_MISSING = object()
+
+# Реестр горячих запросов: кеш выражений asyncpg подготавливает их на
+# соединении при первом вызове
+# Граница горячего окна. Поиск по сообщениям идет одним запросом в две ветки
+# UNION ALL: сначала свежие секции, и только если там пусто - старые
+# (LIMIT 1 останавливает выполнение после первой найденной строки)
+HOT_SINCE = f"now() - interval '{MESSAGE_HOT_DAYS} days'"
+
+STATEMENTS = {
+    "get_user": "SELECT * FROM users WHERE user_id = $1",
+    "get_user_by_thread": "SELECT * FROM users WHERE thread_id = $1",
+    "get_user_by_bot_message": f"""
+        SELECT u.* FROM users u
+        WHERE u.user_id = (
+            (SELECT user_id FROM bot_messages
+             WHERE message_id = $1 AND created_at >= {HOT_SINCE})
+            UNION ALL
+            (SELECT user_id FROM bot_messages
+             WHERE message_id = $1 AND created_at < {HOT_SINCE}
+             ORDER BY created_at DESC LIMIT 1)
+            LIMIT 1
+        )
+    """,
+    "get_message_mapping": f"""
+        (SELECT user_message_id FROM message_map
+         WHERE group_message_id = $1 AND user_id = $2 AND created_at >= {HOT_SINCE})
+        UNION ALL
+        (SELECT user_message_id FROM message_map
+         WHERE group_message_id = $1 AND user_id = $2 AND created_at < {HOT_SINCE}
+         ORDER BY created_at DESC LIMIT 1)
+        LIMIT 1
+    """,
+    "get_group_message_mapping": f"""
+        (SELECT group_message_id FROM message_map
+         WHERE user_message_id = $1 AND user_id = $2 AND created_at >= {HOT_SINCE})
+        UNION ALL
+        (SELECT group_message_id FROM message_map
+         WHERE user_message_id = $1 AND user_id = $2 AND created_at < {HOT_SINCE}
+         ORDER BY created_at DESC LIMIT 1)
+        LIMIT 1
+    """,
+    # Часть альбома в общей сборке: продлевает сборку и добавляет элемент, если
+    # альбом еще не захвачен на отправку. items - элементов вместе с этим,
+    # known - элемент уже был (повторная доставка обновления)
+    "add_media_group_item": """
+        WITH grp AS (
+            INSERT INTO media_groups (media_group_id, user_id, thread_id, last_seen)
+            VALUES ($1, $2, $3, now())
+            ON CONFLICT (media_group_id) DO UPDATE SET last_seen = now()
+            WHERE media_groups.claimed_at IS NULL AND media_groups.sent_at IS NULL
+            RETURNING media_group_id
+        ), item AS (
+            INSERT INTO media_group_items
+                (media_group_id, message_id, media_type, file_id, caption)
+            SELECT media_group_id, $4::bigint, $5::text, $6::text, $7::text FROM grp
+            ON CONFLICT DO NOTHING
+            RETURNING message_id
+        )
+        SELECT
+            EXISTS (SELECT 1 FROM grp) AS accepted,
+            EXISTS (
+                SELECT 1 FROM media_group_items
+                WHERE media_group_id = $1 AND message_id = $4
+            ) AS known,
+            (SELECT count(*) FROM media_group_items WHERE media_group_id = $1)
+                + (SELECT count(*) FROM item) AS items
+    """,
+    # Захват альбома на отправку: удается одному экземпляру и только после
+    # паузы $3 сек без новых частей. Захват старше $4 сек считается брошенным.
+    # wait - сколько еще ждать паузы (NULL - альбом уже захвачен или отправлен)
+    "claim_media_group": """
+        WITH claimed AS (
+            UPDATE media_groups
+            SET claimed_by = $2, claimed_at = now()
+            WHERE media_group_id = $1
+              AND sent_at IS NULL
+              AND (claimed_at IS NULL
+                   OR claimed_at < now() - make_interval(secs => $4::float8))
+              AND last_seen <= now() - make_interval(secs => $3::float8)
+            RETURNING media_group_id, user_id, thread_id
+        ), notified AS (
+            SELECT pg_notify('media_groups', media_group_id) FROM claimed
+        )
+        SELECT
+            c.user_id,
+            c.thread_id,
+            c.media_group_id IS NOT NULL AS claimed,
+            CASE WHEN g.sent_at IS NULL
+                  AND (g.claimed_at IS NULL
+                       OR g.claimed_at < now() - make_interval(secs => $4::float8))
+                THEN $3::float8 - extract(epoch FROM now() - g.last_seen)::float8
+            END AS wait,
+            (SELECT count(*) FROM notified) AS notified
+        FROM media_groups g
+        LEFT JOIN claimed c ON true
+        WHERE g.media_group_id = $1
+    """,
+    # Постановка в outbox; повтор с тем же ключом идемпотентности ничего не делает
+    "enqueue_outbox": """
+        INSERT INTO outbox (idempotency_key, lane, kind, method, payload, effects)
+        VALUES ($1, $2, $3, $4, $5::jsonb, $6::jsonb)
+        ON CONFLICT (idempotency_key) DO NOTHING
+        RETURNING id
+    """,
+    # Выборка на отправку: только головы полос, которые сейчас никто не отправляет,
+    # поэтому в каждом диалоге в полете не больше одного сообщения
+    "claim_outbox": """
+        WITH heads AS (
+            SELECT DISTINCT ON (lane) id, next_attempt_at, locked_until,
+                   count(*) OVER (PARTITION BY lane) AS queued
+            FROM outbox
+            WHERE sent_at IS NULL AND failed_at IS NULL
+            ORDER BY lane, id
+        ), picked AS (
+            SELECT o.id, h.queued FROM outbox o
+            JOIN heads h ON h.id = o.id
+            WHERE h.next_attempt_at <= now()
+              AND (h.locked_until IS NULL OR h.locked_until < now())
+              -- Перепроверяется на свежей версии строки после блокировки
+              AND o.sent_at IS NULL AND o.failed_at IS NULL
+              AND (o.locked_until IS NULL OR o.locked_until < now())
+            ORDER BY o.id
+            LIMIT $1
+            FOR UPDATE OF o SKIP LOCKED
+        )
+        UPDATE outbox o
+        SET locked_until = now() + make_interval(secs => $2::float8),
+            attempts = o.attempts + 1
+        FROM picked
+        WHERE o.id = picked.id
+        RETURNING o.id, o.idempotency_key, o.lane, o.kind, o.method,
+                  o.payload::text AS payload, o.effects::text AS effects,
+                  o.attempts, picked.queued
+    """,
+    # Успешная отправка и ее последствия одной командой (атомарно):
+    # сообщения бота и связи пишутся, только если строка еще не отмечена
+    "complete_outbox": """
+        WITH done AS (
+            UPDATE outbox
+            SET sent_at = now(), locked_until = NULL, last_error = NULL
+            WHERE id = $1 AND sent_at IS NULL
+            RETURNING id
+        ), messages AS (
+            INSERT INTO bot_messages (message_id, user_id, thread_id)
+            SELECT message_id, $2::bigint, $3::bigint
+            FROM done, unnest($4::bigint[]) AS message_id
+            ON CONFLICT DO NOTHING
+        ), links AS (
+            INSERT INTO message_map (group_message_id, user_message_id, user_id)
+            SELECT link.group_message_id, link.user_message_id, $2::bigint
+            FROM done, unnest($5::bigint[], $6::bigint[])
+                AS link(group_message_id, user_message_id)
+            ON CONFLICT DO NOTHING
+        )
+        SELECT count(*) FROM done
+    """,
+    # Событие сводной статистики (сообщение пользователя или ответ администратора):
+    # состояние диалога и дневные сводки одной командой. previous видит строку
+    # диалога до обновления - все части запроса работают с одним снимком
+    "record_stats_event": """
+        WITH previous AS (
+            SELECT awaiting_since FROM thread_stats WHERE thread_id = $1 FOR UPDATE
+        ), thread AS (
+            INSERT INTO thread_stats AS t
+                (thread_id, user_id, awaiting_since, last_user_at, last_admin_at)
+            VALUES (
+                $1::bigint,
+                $2::bigint,
+                CASE WHEN $3::text = 'to_group' THEN $5::timestamptz END,
+                CASE WHEN $3 = 'to_group' THEN $5 END,
+                CASE WHEN $3 = 'to_user' THEN $5 END
+            )
+            ON CONFLICT (thread_id) DO UPDATE SET
+                awaiting_since = CASE
+                    WHEN $3 = 'to_group' THEN coalesce(t.awaiting_since, $5)
+                END,
+                last_user_at = greatest(t.last_user_at, excluded.last_user_at),
+                last_admin_at = greatest(t.last_admin_at, excluded.last_admin_at)
+        ), response AS (
+            -- Первый ответ после ожидания пользователя
+            SELECT extract(epoch FROM $5 - awaiting_since)::float8 AS seconds
+            FROM previous
+            WHERE $3 = 'to_user' AND awaiting_since <= $5
+        ), daily AS (
+            INSERT INTO daily_stats AS d
+                (day, thread_id, user_messages, admin_messages, responses, response_seconds)
+            SELECT ($5 AT TIME ZONE 'UTC')::date, $1,
+                   ($3 = 'to_group')::int, ($3 = 'to_user')::int,
+                   (SELECT count(*) FROM response),
+                   (SELECT coalesce(sum(seconds), 0) FROM response)
+            ON CONFLICT (day, thread_id) DO UPDATE SET
+                user_messages = d.user_messages + excluded.user_messages,
+                admin_messages = d.admin_messages + excluded.admin_messages,
+                responses = d.responses + excluded.responses,
+                response_seconds = d.response_seconds + excluded.response_seconds
+        )
+        INSERT INTO admin_daily_stats AS a
+            (day, admin_id, replies, responses, response_seconds)
+        SELECT ($5 AT TIME ZONE 'UTC')::date, $4::bigint, 1,
+               (SELECT count(*) FROM response),
+               (SELECT coalesce(sum(seconds), 0) FROM response)
+        WHERE $3 = 'to_user' AND $4 IS NOT NULL
+        ON CONFLICT (day, admin_id) DO UPDATE SET
+            replies = a.replies + 1,
+            responses = a.responses + excluded.responses,
+            response_seconds = a.response_seconds + excluded.response_seconds
+    """,
+}
+
+
+class LRUCache:
+    """LRU-кеш с ограничением по количеству записей и времени жизни"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Any:
+        """Возвращает значение или _MISSING, если записи нет или она устарела."""
+        item = self._data.get(key)
+        if item is None:
+            return _MISSING
+        value, expires_at = item
+        if expires_at < time.monotonic():
+            # Устаревшая запись остается до вытеснения: ее отдает stale()
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def stale(self, key: Hashable) -> Any:
+        """Возвращает значение без учета срока жизни (когда БД недоступна)."""
+        item = self._data.get(key)
+        return _MISSING if item is None else item[0]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Сохраняет значение, вытесняя самые давние записи при переполнении."""
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+class DatabaseUnavailable(RuntimeError):
+    """Связь с БД потеряна или размыкатель цепи разомкнут"""
+
+
+# Ошибки потери связи с БД (в отличие от ошибок самого запроса)
+CONNECTION_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.CannotConnectNowError,
+    asyncpg.AdminShutdownError,
+    # После переключения кластера бывший primary принимает только чтение
+    asyncpg.ReadOnlySQLTransactionError,
+)
+
+
+class CircuitBreaker:
+    """Размыкатель цепи: после threshold ошибок связи подряд запросы к БД
+    сразу получают DatabaseUnavailable, не дожидаясь таймаутов. Замыкает
+    цепь фоновая проверка, когда БД снова отвечает.
+    """
+
+    def __init__(self, threshold: int):
+        self.threshold = threshold
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.stats = {"opened": 0, "rejected": 0}
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def check(self) -> None:
+        if self.opened_at is not None:
+            self.stats["rejected"] += 1
+            raise DatabaseUnavailable("База данных недоступна")
+
+    def success(self) -> None:
+        self.failures = 0
+
+    def failure(self) -> bool:
+        """Учитывает ошибку связи. True - цепь только что разомкнулась."""
+        self.failures += 1
+        if self.opened_at is None and self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+            self.stats["opened"] += 1
+            return True
+        return False
+
+    def close(self) -> float:
+        """Замыкает цепь. Возвращает длительность перерыва, сек."""
+        outage = time.monotonic() - self.opened_at if self.opened_at else 0.0
+        self.opened_at = None
+        self.failures = 0
+        return outage
+
+
+class ReplayQueue:
+    """Записи, отложенные на время недоступности БД.
+
+    После восстановления связи записи выполняются по порядку. Очередь
+    ограничена: при переполнении новая запись отклоняется с
+    DatabaseUnavailable, а не вытесняет уже принятые.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: Deque[Tuple[str, Callable[[], Awaitable[Any]]]] = deque()
+        # Восстановление связи и flush() могут дописывать очередь одновременно
+        self._lock = asyncio.Lock()
+        self.stats = {"deferred": 0, "replayed": 0, "rejected": 0, "failed": 0}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def add(self, name: str, write: Callable[[], Awaitable[Any]]) -> None:
+        if len(self._items) >= self.max_size:
+            self.stats["rejected"] += 1
+            raise DatabaseUnavailable("Очередь отложенных записей переполнена")
+        self._items.append((name, write))
+        self.stats["deferred"] += 1
+
+    async def replay(self) -> int:
+        """Выполняет отложенные записи. Возвращает число выполненных.
+
+        Запись снимается с очереди только после выполнения, поэтому
+        одновременные вызовы выполняются по очереди.
+        """
+        async with self._lock:
+            replayed = 0
+            while self._items:
+                name, write = self._items[0]
+                try:
+                    await write()
+                except DatabaseUnavailable:
+                    # Связь снова потеряна - остаток дождется следующего восстановления
+                    break
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    logger.error(f"❌ Отложенная запись {name} не выполнена: {e}")
+                self._items.popleft()
+                replayed += 1
+        self.stats["replayed"] += replayed
+        return replayed
+
+
+class WriteBuffer:
+    """Буфер отложенной записи: копит строки и пишет их одной пачкой.
+
+    Пачка пишется атомарно, и одна строка, которую БД не принимает
+    (нарушение внешнего ключа, нет секции для created_at), срывала бы
+    каждую попытку. Поэтому после max_failures неудач подряд пачка пишется
+    по одной строке, а отвергнутые строки отбрасываются с записью в журнал.
+    """
+
+    # Неудачных попыток записи пачки подряд до записи по одной строке
+    max_failures = 3
+
+    def __init__(
+        self,
+        name: str,
+        query: str,
+        acquire: Callable[[], Any],
+        max_size: int = WRITE_BATCH_SIZE,
+        flush_interval: float = WRITE_FLUSH_INTERVAL,
+        max_pending: Optional[int] = None,
+    ):
+        self.name = name
+        self.query = query
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        # Предел строк в памяти (None - без предела), сверх него строки отбрасываются
+        self.max_pending = max_pending
+        self._acquire = acquire
+        # Ключ -> строка; ключ совпадает с уникальным ключом таблицы
+        self._pending: Dict[Hashable, tuple] = {}
+        # Строки, которые пишутся в БД прямо сейчас (видны для чтения)
+        self._flushing: Dict[Hashable, tuple] = {}
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._failures = 0
+        self.stats = {"rows": 0, "flushes": 0, "errors": 0, "dropped": 0, "rejected": 0}
+
+    def __len__(self) -> int:
+        return len(self._pending) + len(self._flushing)
+
+    def get(self, key: Hashable) -> Optional[tuple]:
+        """Возвращает еще не записанную строку по ключу."""
+        row = self._pending.get(key)
+        if row is None:
+            row = self._flushing.get(key)
+        return row
+
+    def add(self, key: Hashable, row: tuple) -> None:
+        """Ставит строку в очередь на запись (повторный ключ игнорируется)."""
+        if key in self._flushing:
+            return
+        if self.max_pending is not None and len(self) >= self.max_pending:
+            self.stats["dropped"] += 1
+            return
+        self._pending.setdefault(key, row)
+        if len(self._pending) >= self.max_size:
+            self._wakeup.set()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=f"flush:{self.name}")
+
+    async def stop(self) -> None:
+        """Останавливает фоновый сброс и пишет остаток буфера."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Записывает накопленные строки одной пачкой."""
+        async with self._lock:
+            if not self._pending:
+                return 0
+            self._flushing, self._pending = self._pending, {}
+            rows = list(self._flushing.values())
+            started = time.perf_counter()
+            try:
+                async with self._acquire() as conn:
+                    if self._failures >= self.max_failures:
+                        written = await self._write_each(conn)
+                    else:
+                        await self._write(conn, rows)
+                        written = len(rows)
+                DB_LATENCY.observe(time.perf_counter() - started, f"flush_{self.name}")
+            except DatabaseUnavailable:
+                # Строки дождутся восстановления связи
+                self._pending = {**self._flushing, **self._pending}
+                return 0
+            except Exception as e:
+                self.stats["errors"] += 1
+                self._failures += 1
+                logger.error(f"❌ Ошибка записи буфера {self.name}: {e}")
+                # Возвращаем строки в буфер для следующей попытки
+                self._pending = {**self._flushing, **self._pending}
+                return 0
+            finally:
+                self._flushing = {}
+            self._failures = 0
+            self.stats["rows"] += written
+            self.stats["flushes"] += 1
+            return written
+
+    async def _write_each(self, conn) -> int:
+        """Пишет строки по одной, отбрасывая отвергнутые БД. Возвращает число записанных."""
+        written = 0
+        for key, row in list(self._flushing.items()):
+            try:
+                await self._write(conn, [row])
+            except CONNECTION_ERRORS:
+                # Незаписанный остаток вернется в буфер
+                raise
+            except Exception as e:
+                self.stats["rejected"] += 1
+                logger.error(f"❌ Строка буфера {self.name} отброшена: {e}; {row!r}")
+            else:
+                written += 1
+            del self._flushing[key]
+        return written
+
+    async def _write(self, conn, rows: List[tuple]) -> None:
+        await conn.executemany(self.query, rows)
+
+
+class CopyBuffer(WriteBuffer):
+    """Буфер записи через COPY: для больших пачек вставок без ON CONFLICT.
+
+    COPY в разы быстрее executemany, но падает целиком на нарушении
+    уникальности - поэтому в таблице не должно быть уникальных ключей,
+    кроме суррогатного.
+    """
+
+    def __init__(self, name: str, table: str, columns: Sequence[str], acquire, **kwargs):
+        super().__init__(name, query="", acquire=acquire, **kwargs)
+        self.table = table
+        self.columns = list(columns)
+
+    async def _write(self, conn, rows: List[tuple]) -> None:
+        await conn.copy_records_to_table(self.table, records=rows, columns=self.columns)
 
 
 class Database:
     def __init__(self):
         self.pool = None  # Поле инициализируется позже в методе connect()
 
+        # Кеш пользователей: user_id -> запись users
+        self._users = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+        # Вторичные индексы кеша: thread_id / message_id -> user_id
+        self._users_by_thread = LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+        self._users_by_bot_message = LRUCache(USER_CACHE_SIZE * 4, USER_CACHE_TTL)
+        # Горячий слой индекса связей сообщений (в обе стороны):
+        # (group_message_id, user_id) -> user_message_id и наоборот
+        self._links_to_user = LRUCache(LINK_CACHE_SIZE, LINK_CACHE_TTL)
+        self._links_to_group = LRUCache(LINK_CACHE_SIZE, LINK_CACHE_TTL)
+        # Запросы к БД, выполняющиеся прямо сейчас (single-flight)
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._cache_stats = {"hits": 0, "misses": 0, "coalesced": 0}
+
+        # Статистика ожидания соединений пула
+        self._pool_stats = {
+            "in_use": 0,
+            "waiting": 0,
+            "acquires": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+        }
+
+        # Архив переписки для /search: пишется большими пачками через COPY
+        self._archive = CopyBuffer(
+            "messages",
+            "messages",
+            (
+                "user_id",
+                "thread_id",
+                "direction",
+                "message_id",
+                "message_type",
+                "content",
+                "file_id",
+                "admin_id",
+                "created_at",
+            ),
+            acquire=self._acquire,
+            max_size=ARCHIVE_BATCH_SIZE,
+            flush_interval=ARCHIVE_FLUSH_INTERVAL,
+            max_pending=ARCHIVE_MAX_PENDING,
+        )
+        # События сводной статистики: порядок событий сохраняется в пачке
+        self._stats_events = WriteBuffer(
+            "stats_events",
+            STATEMENTS["record_stats_event"],
+            acquire=self._acquire,
+            max_pending=ARCHIVE_MAX_PENDING,
+        )
+
+        # Устойчивость к сбоям: размыкатель цепи, фоновое восстановление связи,
+        # отложенные записи и снимок пользователей для чтения без БД
+        self._breaker = CircuitBreaker(DB_BREAKER_THRESHOLD)
+        self._recovery: Optional[asyncio.Task] = None
+        self._deferred = ReplayQueue(DB_DEFERRED_MAX)
+        self._snapshot: Optional[Dict[int, dict]] = None
+        self._snapshot_by_thread: Dict[int, int] = {}
+
+        # Отдельные соединения для LISTEN (закрываются вместе с пулом)
+        self._listeners: List[asyncpg.Connection] = []
+
+        # Готовность БД для тех, кто стартует параллельно с connect()
+        self._ready = asyncio.Event()
+        self._connect_error: Optional[BaseException] = None
+
     async def is_connected(self):
-        return self.pool is not None and not self.pool._closed
+        return self.pool is not None and not self.pool.is_closing()
+
+    @property
+    def degraded(self) -> bool:
+        """БД недоступна или еще не дописаны отложенные записи."""
+        return self._breaker.is_open or len(self._deferred) > 0
+
+    def defer(self, name: str, write: Callable[[], Awaitable[Any]]) -> None:
+        """Откладывает запись до восстановления связи с БД (с сохранением порядка).
+
+        DatabaseUnavailable - очередь отложенных записей переполнена.
+        """
+        self._deferred.add(name, write)
+        self._start_recovery()
+
+    async def _write_or_defer(
+        self, name: str, write: Callable[[], Awaitable[Any]], default: Any = None
+    ) -> Any:
+        """Выполняет запись, а без связи с БД откладывает ее и возвращает default."""
+        if not self.degraded:
+            try:
+                return await write()
+            except DatabaseUnavailable:
+                pass
+        self.defer(name, write)
+        return default
+
+    def resilience_stats(self) -> Dict[str, Any]:
+        """Состояние размыкателя и отложенных записей."""
+        return {
+            "open": self._breaker.is_open,
+            **self._breaker.stats,
+            **self._deferred.stats,
+            "pending": len(self._deferred),
+            "snapshot": len(self._snapshot) if self._snapshot is not None else None,
+        }
+
+    async def wait_ready(self) -> None:
+        """Ждет окончания connect(): пул создан, схема актуальна."""
+        await self._ready.wait()
+        if self._connect_error is not None:
+            raise DatabaseUnavailable("База данных недоступна") from self._connect_error
+
+    async def _create_database(self) -> None:
+        """Создает базу данных через одно служебное соединение."""
+        conn = await asyncpg.connect(**{**DB_CONFIG, "database": "postgres"})
+        try:
+            await conn.execute(f"CREATE DATABASE {DB_CONFIG['database']}")
+            logger.info("✅ База данных создана")
+        except asyncpg.DuplicateDatabaseError:
+            # Другой экземпляр успел создать базу раньше
+            pass
+        finally:
+            await conn.close()
 
     async def connect(self):
         """Подключение к PostgreSQL с автосозданием БД и таблиц"""
+        self._connect_error = None
+        self._ready.clear()
         try:
-            # Подключаемся к основной базе данных
-            sys_pool = await asyncpg.create_pool(
-                user=os.getenv("POSTGRES_USER"),
-                password=os.getenv("POSTGRES_PASSWORD"),
-                host=os.getenv("POSTGRES_HOST"),
-                port=os.getenv("POSTGRES_PORT"),
-                database=os.getenv("POSTGRES_DB"),
-            )
-
-            # Проверяем наличие нужной базы данных
-            async with sys_pool.acquire() as conn:
-                exists = await conn.fetchval(
-                    "SELECT 1 FROM pg_database WHERE datname = $1",
-                    os.getenv("POSTGRES_DB"),
-                )
-                if not exists:
-                    await conn.execute(f"CREATE DATABASE {os.getenv('POSTGRES_DB')}")
-                    logger.info("✅ База данных создана")
+            self.pool = await self._create_pool()
 
-            # Закрываем временный пул
-            await sys_pool.close()
-
-            # Создаем конечный пул соединений с реальной базой данных
-            self.pool = await asyncpg.create_pool(
-                user=os.getenv("POSTGRES_USER"),
-                password=os.getenv("POSTGRES_PASSWORD"),
-                host=os.getenv("POSTGRES_HOST"),
-                port=os.getenv("POSTGRES_PORT"),
-                database=os.getenv("POSTGRES_DB"),
-            )
+            # Приведение схемы к актуальной версии (без DDL, если версия совпадает)
+            await self.migrate()
+            # Бот мог простоять дольше запаса секций - без секции вставка упадет
+            async with self._acquire() as conn:
+                await ensure_partitions(conn, MESSAGE_PARTITIONS_AHEAD)
 
-            # Создание необходимых таблиц
-            await self._create_tables()
+            # Фоновый сброс буферов записи
+            self._archive.start()
+            self._stats_events.start()
 
         except Exception as e:
+            self._connect_error = e
             logger.critical(f"❌ Ошибка подключения: {e}")
             raise
+        finally:
+            self._ready.set()
 
-    async def _create_tables(self):
-        """Создание всех нужных таблиц"""
-        async with self.pool.acquire() as conn:
-            # Таблица пользователей
-            await conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id BIGINT PRIMARY KEY,
-                    username TEXT,
-                    thread_id INT UNIQUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-                """
+    async def _create_pool(self) -> asyncpg.Pool:
+        """Создает пул, пока БД не ответит или не истечет DB_STARTUP_TIMEOUT.
+
+        При запуске вместе с контейнером БД (или во время ее переключения)
+        первые попытки подключения ожидаемо неудачны.
+        """
+        deadline = time.monotonic() + DB_STARTUP_TIMEOUT
+        delay = DB_RECONNECT_BASE
+        while True:
+            try:
+                # Обычно база уже есть: сразу создаем рабочий пул без служебных соединений
+                try:
+                    return await asyncpg.create_pool(**DB_CONFIG, **DB_POOL_CONFIG)
+                except asyncpg.InvalidCatalogNameError:
+                    await self._create_database()
+                    return await asyncpg.create_pool(**DB_CONFIG, **DB_POOL_CONFIG)
+            except CONNECTION_ERRORS as e:
+                if time.monotonic() + delay > deadline:
+                    raise
+                logger.warning(f"⏳ БД недоступна ({e}), повтор через {delay:.1f} с")
+                await asyncio.sleep(delay)
+                delay = min(DB_RECONNECT_MAX, delay * 2)
+
+    @asynccontextmanager
+    async def _acquire(self):
+        """Выдает соединение из пула, учитывая время ожидания.
+
+        Ошибки связи превращаются в DatabaseUnavailable и считаются
+        размыкателем; при разомкнутой цепи ошибка возникает сразу.
+        """
+        self._breaker.check()
+        if self.pool is None:
+            raise DatabaseUnavailable("Пул соединений не создан")
+        started = time.perf_counter()
+        self._pool_stats["waiting"] += 1
+        try:
+            conn = await self.pool.acquire()
+        except CONNECTION_ERRORS as e:
+            self._connection_lost(e)
+            raise DatabaseUnavailable(str(e)) from e
+        finally:
+            self._pool_stats["waiting"] -= 1
+        waited = time.perf_counter() - started
+        self._pool_stats["acquires"] += 1
+        self._pool_stats["wait_total"] += waited
+        self._pool_stats["wait_max"] = max(self._pool_stats["wait_max"], waited)
+
+        self._pool_stats["in_use"] += 1
+        try:
+            yield conn
+        except CONNECTION_ERRORS as e:
+            self._connection_lost(e)
+            raise DatabaseUnavailable(str(e)) from e
+        finally:
+            self._pool_stats["in_use"] -= 1
+            await self.pool.release(conn)
+        self._breaker.success()
+
+    def _connection_lost(self, error: BaseException) -> None:
+        if self._breaker.failure():
+            logger.error(f"🔌 Связь с БД потеряна ({error}), работа без БД до восстановления")
+            self._start_recovery()
+
+    def _start_recovery(self) -> None:
+        if self._recovery is None or self._recovery.done():
+            self._recovery = asyncio.create_task(self._recover(), name="db_recovery")
+
+    async def _recover(self) -> None:
+        """Восстанавливает связь с БД и дописывает отложенные записи.
+
+        Проверка повторяется с растущей паузой; цепь замыкается, когда пул
+        снова выдает соединение с сервером, принимающим запись.
+        """
+        delay = DB_RECONNECT_BASE
+        while True:
+            if self._breaker.is_open:
+                # Соединения пула могли остаться у упавшего или бывшего primary
+                with suppress(Exception):
+                    await self.pool.expire_connections()
+                try:
+                    await self._probe()
+                except Exception as e:
+                    logger.warning(f"⏳ БД недоступна ({e}), повтор через {delay:.1f} с")
+                    await asyncio.sleep(delay)
+                    delay = min(DB_RECONNECT_MAX, delay * 2)
+                    continue
+                outage = self._breaker.close()
+                logger.info(f"✅ Связь с БД восстановлена через {outage:.1f} с")
+
+            replayed = await self._deferred.replay()
+            if replayed:
+                logger.info(f"♻️ Дописано отложенных записей: {replayed}")
+            if not self._deferred:
+                break
+            if not self._breaker.is_open:
+                # Ошибка связи без размыкания цепи - пробуем чуть позже
+                await asyncio.sleep(delay)
+
+    async def _probe(self) -> None:
+        """Проверочный запрос в обход размыкателя."""
+        conn = await self.pool.acquire()
+        try:
+            writable = await conn.fetchval("SELECT NOT pg_is_in_recovery()")
+        finally:
+            await self.pool.release(conn)
+        if not writable:
+            raise DatabaseUnavailable("сервер работает только на чтение (реплика)")
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Возвращает загрузку пула и статистику ожидания соединений."""
+        stats = self._pool_stats
+        max_size = DB_POOL_CONFIG["max_size"]
+        return {
+            "size": self.pool.get_size() if self.pool else 0,
+            "idle": self.pool.get_idle_size() if self.pool else 0,
+            "max_size": max_size,
+            "in_use": stats["in_use"],
+            "waiting": stats["waiting"],
+            "saturation": stats["in_use"] / max_size if max_size else 0.0,
+            "acquires": stats["acquires"],
+            "avg_wait_ms": (
+                stats["wait_total"] / stats["acquires"] * 1000
+                if stats["acquires"]
+                else 0.0
+            ),
+            "max_wait_ms": stats["wait_max"] * 1000,
+        }
+
+    async def flush(self) -> None:
+        """Принудительно записывает все буферизованные и отложенные строки в БД."""
+        if not self._breaker.is_open:
+            await self._deferred.replay()
+        await self._archive.flush()
+        await self._stats_events.flush()
+
+    def write_stats(self) -> Dict[str, Dict[str, int]]:
+        """Возвращает счетчики буферов записи."""
+        return {
+            buffer.name: {**buffer.stats, "pending": len(buffer)}
+            for buffer in (self._archive, self._stats_events)
+        }
+
+    def _remember_user(self, user) -> None:
+        """Кладет запись пользователя в кеш и обновляет вторичный индекс."""
+        if user is None:
+            return
+        self._users.set(user["user_id"], user)
+        if user["thread_id"] is not None:
+            self._users_by_thread.set(user["thread_id"], user["user_id"])
+
+    async def refresh_snapshot(self) -> int:
+        """Перечитывает снимок всех пользователей для работы без БД."""
+        async with self._acquire() as conn:
+            rows = await conn.fetch("SELECT user_id, username, thread_id FROM users")
+        self._snapshot = {row["user_id"]: dict(row) for row in rows}
+        self._snapshot_by_thread = {
+            row["thread_id"]: row["user_id"] for row in rows if row["thread_id"] is not None
+        }
+        return len(rows)
+
+    def _snapshot_user(self, user_id: Any) -> Optional[dict]:
+        """Пользователь без БД: из снимка или устаревшей записи кеша.
+
+        Если снимка нет, отсутствие пользователя ничего не доказывает -
+        тогда DatabaseUnavailable.
+        """
+        if user_id is _MISSING or user_id is None:
+            user = None
+        else:
+            user = self._users.stale(user_id)
+            if user is _MISSING:
+                user = self._snapshot.get(user_id) if self._snapshot is not None else None
+        if user is None and self._snapshot is None:
+            raise DatabaseUnavailable("База данных недоступна, снимка пользователей нет")
+        return user
+
+    def _invalidate_user(self, user_id: int, thread_id: Optional[int] = None) -> None:
+        """Удаляет пользователя из кеша."""
+        self._users.pop(user_id)
+        if thread_id is not None:
+            self._users_by_thread.pop(thread_id)
+
+    async def _single_flight(
+        self, key: Hashable, loader: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """Объединяет одновременные промахи по одному ключу в один запрос к БД."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(loader())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self._cache_stats["coalesced"] += 1
+        # shield: отмена одного ожидающего не должна отменять общий запрос
+        return await asyncio.shield(task)
+
+    def _cached_user(self, user_id: Any) -> Any:
+        """Возвращает пользователя из кеша с учетом счетчиков попаданий."""
+        user = _MISSING if user_id is _MISSING else self._users.get(user_id)
+        if user is _MISSING:
+            self._cache_stats["misses"] += 1
+        else:
+            self._cache_stats["hits"] += 1
+        return user
+
+    def cache_stats(self) -> Dict[str, int]:
+        """Возвращает счетчики кеша пользователей."""
+        return {**self._cache_stats, "size": len(self._users)}
+
+    @track_query
+    async def warm_user_cache(self, limit: int) -> int:
+        """Прогревает кеш недавно активными пользователями."""
+        async with self._acquire() as conn:
+            rows = await conn.fetch(
+                f"""
+                SELECT u.* FROM users u
+                JOIN (
+                    SELECT user_id, MAX(created_at) AS last_seen
+                    FROM bot_messages
+                    WHERE created_at >= {HOT_SINCE}
+                    GROUP BY user_id
+                    ORDER BY last_seen DESC
+                    LIMIT $1
+                ) recent ON recent.user_id = u.user_id
+                """,
+                limit,
             )
+        for row in rows:
+            self._remember_user(row)
+        return len(rows)
 
-            # Таблица связей между сообщениями
-            await conn.execute(
+    @track_query
+    async def get_user_by_bot_message(self, message_id: int) -> Optional[dict]:
+        """Возвращает пользователя по идентификатору сообщения бота."""
+        user_id = self._users_by_bot_message.get(message_id)
+        if user_id is not _MISSING:
+            return await self.get_user(user_id)
+
+        self._cache_stats["misses"] += 1
+        return await self._single_flight(
+            ("bot_message", message_id),
+            lambda: self._fetch_user_by_bot_message(message_id),
+        )
+
+    async def _fetch_user_by_bot_message(self, message_id: int) -> Optional[dict]:
+        try:
+            async with self._acquire() as conn:
+                user = await conn.fetchrow(
+                    STATEMENTS["get_user_by_bot_message"], message_id
+                )
+        except DatabaseUnavailable:
+            user_id = self._users_by_bot_message.stale(message_id)
+            if user_id is _MISSING:
+                raise
+            return self._snapshot_user(user_id)
+        if user is not None:
+            self._remember_user(user)
+            self._users_by_bot_message.set(message_id, user["user_id"])
+        return user
+
+    @track_query
+    async def get_user(self, user_id: int) -> Optional[dict]:
+        """Возвращает пользователя по его идентификатору."""
+        user = self._cached_user(user_id)
+        if user is not _MISSING:
+            return user
+        return await self._single_flight(
+            ("user", user_id), lambda: self._fetch_user(user_id)
+        )
+
+    async def _fetch_user(self, user_id: int) -> Optional[dict]:
+        try:
+            async with self._acquire() as conn:
+                user = await conn.fetchrow(STATEMENTS["get_user"], user_id)
+        except DatabaseUnavailable:
+            return self._snapshot_user(user_id)
+        self._remember_user(user)
+        return user
+
+    @track_query
+    async def get_user_by_thread(self, thread_id: int) -> Optional[dict]:
+        """Возвращает пользователя по идентификатору потока."""
+        user = self._cached_user(self._users_by_thread.get(thread_id))
+        if user is not _MISSING:
+            return user
+        return await self._single_flight(
+            ("thread", thread_id), lambda: self._fetch_user_by_thread(thread_id)
+        )
+
+    async def _fetch_user_by_thread(self, thread_id: int) -> Optional[dict]:
+        try:
+            async with self._acquire() as conn:
+                user = await conn.fetchrow(STATEMENTS["get_user_by_thread"], thread_id)
+        except DatabaseUnavailable:
+            user_id = self._users_by_thread.stale(thread_id)
+            if user_id is _MISSING:
+                user_id = self._snapshot_by_thread.get(thread_id)
+            return self._snapshot_user(user_id)
+        self._remember_user(user)
+        return user
+
+    @track_query
+    async def create_user(self, user_id: int, username: str, thread_id: int) -> None:
+        """Создает запись о новом пользователе (без БД - отложенно)."""
+
+        async def insert():
+            async with self._acquire() as conn:
+                await conn.execute(
+                    """
+                    INSERT INTO users (user_id, username, thread_id)
+                    VALUES ($1, $2, $3)
+                    ON CONFLICT (user_id) DO NOTHING
+                    """,
+                    user_id,
+                    username,
+                    thread_id,
+                )
+            return True
+
+        if await self._write_or_defer(f"create_user:{user_id}", insert, default=False):
+            # Сбрасываем кеш, чтобы следующий get_user прочитал свежую запись
+            self._invalidate_user(user_id, thread_id)
+            return
+        # Запись отложена: пользователь должен находиться и без БД
+        user = {"user_id": user_id, "username": username, "thread_id": thread_id}
+        self._remember_user(user)
+        if self._snapshot is not None:
+            self._snapshot[user_id] = user
+            self._snapshot_by_thread[thread_id] = user_id
+
+    @track_query
+    async def claim_pooled_topic(self) -> Optional[int]:
+        """Забирает самый старый заготовленный топик (безопасно для нескольких процессов)."""
+        async with self._acquire() as conn:
+            return await conn.fetchval(
                 """
-                CREATE TABLE IF NOT EXISTS message_map (
-                    group_message_id INT,
-                    user_message_id INT,
-                    user_id BIGINT REFERENCES users(user_id),
-                    PRIMARY KEY (group_message_id, user_id)
-                );
+                DELETE FROM topic_pool
+                WHERE thread_id = (
+                    SELECT thread_id FROM topic_pool
+                    ORDER BY created_at
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING thread_id
                 """
             )
 
-            # Таблица сообщений бота
+    @track_query
+    async def add_pooled_topic(self, thread_id: int) -> None:
+        """Добавляет созданный топик в запас."""
+        async with self._acquire() as conn:
             await conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS bot_messages (
-                    message_id INT PRIMARY KEY,
-                    user_id BIGINT REFERENCES users(user_id),
-                    thread_id INT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-                """
+                "INSERT INTO topic_pool (thread_id) VALUES ($1) ON CONFLICT DO NOTHING",
+                thread_id,
             )
 
-            # Таблица медиагрупп
-            await conn.execute(
+    @track_query
+    async def count_pooled_topics(self) -> int:
+        """Количество топиков в запасе."""
+        async with self._acquire() as conn:
+            return await conn.fetchval("SELECT count(*) FROM topic_pool")
+
+    @track_query
+    async def check_media_group(self, media_group_id: str) -> Optional[int]:
+        """Проверяет существование медиагруппы."""
+        async with self._acquire() as conn:
+            return await conn.fetchval(
+                "SELECT 1 FROM media_groups WHERE media_group_id = $1", media_group_id
+            )
+
+    @track_query
+    async def add_media_group_item(
+        self,
+        media_group_id: str,
+        user_id: int,
+        thread_id: int,
+        message_id: int,
+        media_type: str,
+        file_id: str,
+        caption: Optional[str],
+    ) -> asyncpg.Record:
+        """Добавляет часть альбома в общую сборку (accepted, known, items)."""
+        async with self._acquire() as conn:
+            return await conn.fetchrow(
+                STATEMENTS["add_media_group_item"],
+                media_group_id,
+                user_id,
+                thread_id,
+                message_id,
+                media_type,
+                file_id,
+                caption,
+            )
+
+    @track_query
+    async def claim_media_group(
+        self, media_group_id: str, owner: str, idle: float, lease: float
+    ) -> Optional[asyncpg.Record]:
+        """Пытается захватить альбом на отправку (claimed, user_id, thread_id, wait).
+
+        None - альбома нет (уже удален очисткой).
+        """
+        async with self._acquire() as conn:
+            return await conn.fetchrow(
+                STATEMENTS["claim_media_group"], media_group_id, owner, idle, lease
+            )
+
+    @track_query
+    async def claim_stale_media_groups(
+        self, owner: str, idle: float, lease: float, limit: int
+    ) -> List[asyncpg.Record]:
+        """Захватывает альбомы, которые никто не отправил (их экземпляр остановился)."""
+        async with self._acquire() as conn:
+            return await conn.fetch(
                 """
-                CREATE TABLE IF NOT EXISTS media_groups (
-                    media_group_id TEXT PRIMARY KEY,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
+                WITH claimed AS (
+                    UPDATE media_groups
+                    SET claimed_by = $1, claimed_at = now()
+                    WHERE media_group_id IN (
+                        SELECT media_group_id FROM media_groups
+                        WHERE sent_at IS NULL
+                          AND last_seen <= now() - make_interval(secs => $2::float8)
+                          AND (claimed_at IS NULL
+                               OR claimed_at < now() - make_interval(secs => $3::float8))
+                        ORDER BY last_seen
+                        LIMIT $4
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING media_group_id, user_id, thread_id
+                )
+                SELECT claimed.*, pg_notify('media_groups', media_group_id)
+                FROM claimed
+                """,
+                owner,
+                idle,
+                lease,
+                limit,
+            )
+
+    @track_query
+    async def get_media_group_items(self, media_group_id: str) -> List[asyncpg.Record]:
+        """Элементы альбома в порядке сообщений."""
+        async with self._acquire() as conn:
+            return await conn.fetch(
                 """
+                SELECT message_id, media_type, file_id, caption
+                FROM media_group_items
+                WHERE media_group_id = $1
+                ORDER BY message_id
+                """,
+                media_group_id,
             )
 
-    async def save_bot_message(self, message_id: int, user_id: int, thread_id: int):
-        """Сохраняет сообщение бота в базу данных."""
-        async with self.pool.acquire() as conn:
+    @track_query
+    async def mark_media_group_sent(self, media_group_id: str, owner: str) -> None:
+        """Отмечает альбом отправленным: поздние части пойдут отдельно."""
+        async with self._acquire() as conn:
             await conn.execute(
                 """
-                INSERT INTO bot_messages (message_id, user_id, thread_id)
-                VALUES ($1, $2, $3)
-                ON CONFLICT (message_id) DO NOTHING
+                UPDATE media_groups SET sent_at = now()
+                WHERE media_group_id = $1 AND claimed_by = $2
                 """,
-                message_id,
-                user_id,
-                thread_id,
+                media_group_id,
+                owner,
             )
 
-    async def get_user_by_bot_message(self, message_id: int) -> Optional[dict]:
-        """Возвращает пользователя по идентификатору сообщения бота."""
-        async with self.pool.acquire() as conn:
-            return await conn.fetchrow(
+    @track_query
+    async def delete_old_media_groups(self, max_age: float) -> Tuple[int, int]:
+        """Удаляет альбомы старше max_age сек. Возвращает (отправленных, брошенных)."""
+        async with self._acquire() as conn:
+            row = await conn.fetchrow(
                 """
-                SELECT u.* FROM users u
-                JOIN bot_messages bm ON u.user_id = bm.user_id
-                WHERE bm.message_id = $1
+                WITH deleted AS (
+                    DELETE FROM media_groups
+                    WHERE COALESCE(sent_at, created_at)
+                          < now() - make_interval(secs => $1::float8)
+                    RETURNING sent_at
+                )
+                SELECT count(sent_at) AS sent, count(*) - count(sent_at) AS expired
+                FROM deleted
                 """,
-                message_id,
+                max_age,
             )
+        return row["sent"], row["expired"]
 
-    async def get_user(self, user_id: int) -> Optional[dict]:
-        """Возвращает пользователя по его идентификатору."""
-        async with self.pool.acquire() as conn:
-            return await conn.fetchrow(
-                "SELECT * FROM users WHERE user_id = $1", user_id
+    @track_query
+    async def enqueue_outbox(
+        self, key: str, lane: str, kind: str, method: str, payload: str, effects: str
+    ) -> bool:
+        """Ставит отправку в outbox. False - с этим ключом уже поставлена."""
+        async with self._acquire() as conn:
+            return (
+                await conn.fetchval(
+                    STATEMENTS["enqueue_outbox"], key, lane, kind, method, payload, effects
+                )
+                is not None
             )
 
-    async def get_user_by_thread(self, thread_id: int) -> Optional[dict]:
-        """Возвращает пользователя по идентификатору потока."""
-        async with self.pool.acquire() as conn:
-            return await conn.fetchrow(
-                "SELECT * FROM users WHERE thread_id = $1", thread_id
+    @track_query
+    async def claim_outbox(self, limit: int, lease: float) -> List[asyncpg.Record]:
+        """Забирает до limit сообщений на отправку на lease секунд."""
+        async with self._acquire() as conn:
+            return await conn.fetch(STATEMENTS["claim_outbox"], limit, lease)
+
+    @track_query
+    async def claim_outbox_run(
+        self, lane: str, head_id: int, limit: int, lease: float
+    ) -> List[asyncpg.Record]:
+        """Забирает идущие за головой полосы копии без ответа (для copy_messages).
+
+        Берется только непрерывная серия: первое сообщение другого вида
+        (с reply_to_message_id, отложенное или захваченное) и все за ним
+        остаются в очереди.
+        """
+        async with self._acquire() as conn:
+            return await conn.fetch(
+                """
+                WITH queue AS (
+                    SELECT id,
+                           bool_and(
+                               method = 'copy_message'
+                               AND NOT payload ? 'reply_to_message_id'
+                               AND next_attempt_at <= now()
+                               AND (locked_until IS NULL OR locked_until < now())
+                           ) OVER (ORDER BY id) AS in_run
+                    FROM outbox
+                    WHERE lane = $1 AND id > $2
+                      AND sent_at IS NULL AND failed_at IS NULL
+                    ORDER BY id
+                    LIMIT $3
+                ), picked AS (
+                    SELECT o.id FROM outbox o
+                    JOIN queue q ON q.id = o.id
+                    WHERE q.in_run
+                    FOR UPDATE OF o SKIP LOCKED
+                )
+                UPDATE outbox o
+                SET locked_until = now() + make_interval(secs => $4::float8),
+                    attempts = o.attempts + 1
+                FROM picked
+                WHERE o.id = picked.id
+                RETURNING o.id, o.idempotency_key, o.lane, o.kind, o.method,
+                          o.payload::text AS payload, o.effects::text AS effects,
+                          o.attempts
+                """,
+                lane,
+                head_id,
+                limit,
+                lease,
             )
 
-    async def create_user(self, user_id: int, username: str, thread_id: int) -> None:
-        """Создает запись о новом пользователе."""
-        async with self.pool.acquire() as conn:
-            await conn.execute(
+    @track_query
+    async def complete_outbox(
+        self,
+        outbox_id: int,
+        user_id: int,
+        thread_id: int,
+        message_ids: List[int],
+        links: List[Tuple[int, int]],
+    ) -> bool:
+        """Отмечает отправку выполненной вместе с записью сообщений бота и связей.
+
+        message_ids - сообщения бота в группе (по ним ответ администратора
+        находит пользователя), links - пары (group_message_id, user_message_id). False - строка уже была
+        отмечена (отправка повторилась после истечения захвата). Без БД отметка
+        откладывается, а связи сразу доступны из кеша.
+        """
+
+        async def complete():
+            async with self._acquire() as conn:
+                return await conn.fetchval(
+                    STATEMENTS["complete_outbox"],
+                    outbox_id,
+                    user_id,
+                    thread_id,
+                    message_ids,
+                    [group_message_id for group_message_id, _ in links],
+                    [user_message_id for _, user_message_id in links],
+                )
+
+        done = await self._write_or_defer(f"complete_outbox:{outbox_id}", complete, 1)
+        for message_id in message_ids:
+            self._users_by_bot_message.set(message_id, user_id)
+        for group_message_id, user_message_id in links:
+            self._links_to_user.set((group_message_id, user_id), user_message_id)
+            self._links_to_group.set((user_message_id, user_id), group_message_id)
+        return bool(done)
+
+    @track_query
+    async def release_outbox(self, outbox_ids: Sequence[int]) -> None:
+        """Возвращает захваченные, но не отправленные строки в очередь.
+
+        Захват засчитал попытку отправки - она снимается, а last_error
+        остается от последней настоящей попытки.
+        """
+        if not outbox_ids:
+            return
+
+        async def release():
+            async with self._acquire() as conn:
+                await conn.execute(
+                    """
+                    UPDATE outbox
+                    SET attempts = attempts - 1, locked_until = NULL
+                    WHERE id = ANY($1::bigint[]) AND sent_at IS NULL
+                    """,
+                    list(outbox_ids),
+                )
+
+        await self._write_or_defer(f"release_outbox:{outbox_ids[0]}", release)
+
+    @track_query
+    async def retry_outbox(self, outbox_id: int, delay: float, error: str) -> None:
+        """Откладывает повторную отправку на delay секунд."""
+
+        async def retry():
+            async with self._acquire() as conn:
+                await conn.execute(
+                    """
+                    UPDATE outbox
+                    SET locked_until = NULL,
+                        next_attempt_at = now() + make_interval(secs => $2::float8),
+                        last_error = $3
+                    WHERE id = $1 AND sent_at IS NULL
+                    """,
+                    outbox_id,
+                    delay,
+                    error,
+                )
+
+        await self._write_or_defer(f"retry_outbox:{outbox_id}", retry)
+
+    @track_query
+    async def fail_outbox(self, outbox_id: int, error: str) -> None:
+        """Отмечает отправку окончательно неудавшейся."""
+
+        async def fail():
+            async with self._acquire() as conn:
+                await conn.execute(
+                    """
+                    UPDATE outbox
+                    SET failed_at = now(), locked_until = NULL, last_error = $2
+                    WHERE id = $1 AND sent_at IS NULL
+                    """,
+                    outbox_id,
+                    error,
+                )
+
+        await self._write_or_defer(f"fail_outbox:{outbox_id}", fail)
+
+    @track_query
+    async def delete_old_outbox(self, max_age: float) -> int:
+        """Удаляет завершенные строки outbox старше max_age сек."""
+        async with self._acquire() as conn:
+            status = await conn.execute(
                 """
-                INSERT INTO users (user_id, username, thread_id)
-                VALUES ($1, $2, $3)
-                ON CONFLICT (user_id) DO NOTHING
+                DELETE FROM outbox
+                WHERE created_at < now() - make_interval(secs => $1::float8)
+                  AND (sent_at IS NOT NULL OR failed_at IS NOT NULL)
                 """,
-                user_id,
-                username,
-                thread_id,
+                max_age,
             )
+        return int(status.split()[-1])
 
-    async def add_message_mapping(
-        self, group_message_id: int, user_message_id: int, user_id: int
-    ) -> None:
-        """Добавляет связь между групповым и личным сообщением."""
-        async with self.pool.acquire() as conn:
+    @track_query
+    async def load_update_offset(self) -> Tuple[Optional[int], List[int]]:
+        """Сохраненное смещение обновлений и обработанные обновления выше него."""
+        async with self._acquire() as conn:
+            offset = await conn.fetchval(
+                "SELECT value FROM bot_state WHERE key = 'update_offset'"
+            )
+            rows = await conn.fetch("SELECT update_id FROM processed_updates")
+        return offset, [row["update_id"] for row in rows]
+
+    @track_query
+    async def save_update_offset(self, offset: int, processed: Sequence[int]) -> None:
+        """Сохраняет смещение и заменяет список обработанных обновлений выше него."""
+        async with self._acquire() as conn:
             await conn.execute(
                 """
-                INSERT INTO message_map 
-                (group_message_id, user_message_id, user_id)
-                VALUES ($1, $2, $3)
+                WITH saved AS (
+                    INSERT INTO bot_state (key, value) VALUES ('update_offset', $1)
+                    ON CONFLICT (key) DO UPDATE
+                        SET value = excluded.value, updated_at = now()
+                ), pruned AS (
+                    DELETE FROM processed_updates
+                    WHERE update_id <= $1 OR NOT update_id = ANY($2::bigint[])
+                )
+                INSERT INTO processed_updates (update_id)
+                SELECT unnest($2::bigint[])
                 ON CONFLICT DO NOTHING
                 """,
-                group_message_id,
-                user_message_id,
+                offset,
+                list(processed),
+            )
+
+    @track_query
+    async def load_persistence(self) -> List[asyncpg.Record]:
+        """Все строки сохраненного состояния PTB (kind, key, value)."""
+        async with self._acquire() as conn:
+            return await conn.fetch("SELECT kind, key, value FROM ptb_persistence")
+
+    @track_query
+    async def save_persistence(
+        self,
+        upserts: Sequence[Tuple[str, str, bytes]],
+        deletes: Sequence[Tuple[str, str]],
+    ) -> None:
+        """Записывает измененные и удаляет убранные строки состояния PTB одной транзакцией."""
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                if upserts:
+                    await conn.executemany(
+                        """
+                        INSERT INTO ptb_persistence (kind, key, value)
+                        VALUES ($1, $2, $3)
+                        ON CONFLICT (kind, key)
+                        DO UPDATE SET value = EXCLUDED.value, updated_at = now()
+                        """,
+                        upserts,
+                    )
+                if deletes:
+                    await conn.executemany(
+                        "DELETE FROM ptb_persistence WHERE kind = $1 AND key = $2",
+                        deletes,
+                    )
+
+    async def listen(
+        self, channel: str, callback: Callable[..., Any]
+    ) -> asyncpg.Connection:
+        """Подписывается на NOTIFY канала через отдельное соединение вне пула.
+
+        Соединение с LISTEN нельзя возвращать в пул, поэтому оно свое;
+        закрывается в close().
+        """
+        conn = await asyncpg.connect(**DB_CONFIG)
+        await conn.add_listener(channel, callback)
+        self._listeners = [c for c in self._listeners if not c.is_closed()]
+        self._listeners.append(conn)
+        return conn
+
+    def archive_message(
+        self,
+        user_id: int,
+        thread_id: Optional[int],
+        direction: str,
+        message_id: int,
+        message_type: str,
+        content: Optional[str],
+        file_id: Optional[str],
+        created_at: datetime,
+        admin_id: Optional[int] = None,
+    ) -> None:
+        """Ставит сообщение в архив переписки и в сводную статистику.
+
+        Запись идет пачками в фоне; статистика считается по тем же событиям,
+        что лежат в архиве, поэтому ее можно пересчитать (rollups.py).
+        """
+        key = (direction, user_id, message_id)
+        self._archive.add(
+            key,
+            (
                 user_id,
+                thread_id,
+                direction,
+                message_id,
+                message_type,
+                content,
+                file_id,
+                admin_id,
+                created_at,
+            ),
+        )
+        if thread_id is not None:
+            self._stats_events.add(key, (thread_id, user_id, direction, admin_id, created_at))
+
+    @track_query
+    async def support_stats(self, days: int) -> Dict[str, Any]:
+        """Сводка для /stats: только готовые сводные таблицы, без сканирования истории."""
+        async with self._acquire() as conn:
+            waiting = await conn.fetchrow(
+                """
+                SELECT count(*) AS threads, min(awaiting_since) AS oldest
+                FROM thread_stats WHERE awaiting_since IS NOT NULL
+                """
+            )
+            totals = await conn.fetch(
+                """
+                SELECT day = (now() AT TIME ZONE 'UTC')::date AS today,
+                       sum(user_messages) AS user_messages,
+                       sum(admin_messages) AS admin_messages,
+                       count(DISTINCT thread_id) AS threads,
+                       sum(responses) AS responses,
+                       sum(response_seconds) AS response_seconds
+                FROM daily_stats
+                WHERE day > (now() AT TIME ZONE 'UTC')::date - $1::int
+                GROUP BY ROLLUP (day = (now() AT TIME ZONE 'UTC')::date)
+                """,
+                days,
+            )
+            admins = await conn.fetch(
+                """
+                SELECT admin_id, sum(replies) AS replies, sum(responses) AS responses,
+                       sum(response_seconds) AS response_seconds
+                FROM admin_daily_stats
+                WHERE day > (now() AT TIME ZONE 'UTC')::date - $1::int
+                GROUP BY admin_id
+                ORDER BY replies DESC
+                LIMIT 10
+                """,
+                days,
             )
+        return {"waiting": waiting, "totals": totals, "admins": admins}
 
-    async def check_media_group(self, media_group_id: str) -> Optional[int]:
-        """Проверяет существование медиагруппы."""
-        async with self.pool.acquire() as conn:
-            return await conn.fetchval(
-                "SELECT 1 FROM media_groups WHERE media_group_id = $1", media_group_id
+    @track_query
+    async def search_messages(
+        self,
+        query: str,
+        user_id: Optional[int] = None,
+        thread_id: Optional[int] = None,
+        limit: int = 10,
+        after: Optional[Tuple[float, int]] = None,
+    ) -> List[asyncpg.Record]:
+        """Полнотекстовый поиск по архиву, лучшие совпадения первыми.
+
+        Страницы листаются по ключу (rank, id) последнего результата (after),
+        поэтому дальние страницы не дороже первой.
+        """
+        after_rank, after_id = after if after else (None, None)
+        async with self._acquire() as conn:
+            return await conn.fetch(
+                """
+                WITH page AS (
+                    SELECT m.id, m.user_id, m.thread_id, m.direction, m.message_type,
+                           m.content, m.created_at, ts_rank_cd(m.search, q) AS rank, q
+                    FROM messages m, websearch_to_tsquery('russian', $1) q
+                    WHERE m.search @@ q
+                      AND ($2::bigint IS NULL OR m.user_id = $2)
+                      AND ($3::bigint IS NULL OR m.thread_id = $3)
+                      AND ($4::real IS NULL
+                           OR (ts_rank_cd(m.search, q), m.id) < ($4::real, $5::bigint))
+                    ORDER BY rank DESC, m.id DESC
+                    LIMIT $6
+                )
+                -- Фрагменты с подсветкой строятся только для страницы
+                SELECT id, user_id, thread_id, direction, message_type, created_at, rank,
+                       ts_headline('russian', content, q,
+                                   'MaxWords=25, MinWords=8, StartSel=«, StopSel=»')
+                           AS snippet
+                FROM page
+                ORDER BY rank DESC, id DESC
+                """,
+                query,
+                user_id,
+                thread_id,
+                after_rank,
+                after_id,
+                limit,
             )
 
     async def close(self) -> None:
         """Закрывает соединение с базой данных."""
+        if self._recovery is not None and not self._recovery.done():
+            self._recovery.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._recovery
+        if self._deferred:
+            logger.warning(f"⚠️ Не дописано отложенных записей: {len(self._deferred)}")
+        for conn in self._listeners:
+            if not conn.is_closed():
+                await conn.close()
+        self._listeners.clear()
         if self.pool:
+            await self._archive.stop()
+            await self._stats_events.stop()
             await self.pool.close()
             logger.info("🔌 Соединение с базой данных закрыто")
 
+    @track_query
     async def get_message_mapping(
         self, group_message_id: int, user_id: int
     ) -> Optional[int]:
         """Получает связанное личное сообщение по идентификатору группы и пользователя."""
-        async with self.pool.acquire() as conn:
-            return await conn.fetchval(
-                "SELECT user_message_id FROM message_map "
-                "WHERE group_message_id = $1 AND user_id = $2",
-                group_message_id,
-                user_id,
-            )
+        user_message_id = self._links_to_user.get((group_message_id, user_id))
+        if user_message_id is not _MISSING:
+            return user_message_id
+        try:
+            async with self._acquire() as conn:
+                user_message_id = await conn.fetchval(
+                    STATEMENTS["get_message_mapping"], group_message_id, user_id
+                )
+        except DatabaseUnavailable:
+            # Без БД - только то, что осталось в кеше (ответ уйдет и без цитаты)
+            user_message_id = self._links_to_user.stale((group_message_id, user_id))
+            return None if user_message_id is _MISSING else user_message_id
+        if user_message_id is not None:
+            self._links_to_user.set((group_message_id, user_id), user_message_id)
+        return user_message_id
+
+    @track_query
+    async def get_group_message_mapping(
+        self, user_message_id: int, user_id: int
+    ) -> Optional[int]:
+        """Получает связанное сообщение в группе по личному сообщению пользователя."""
+        group_message_id = self._links_to_group.get((user_message_id, user_id))
+        if group_message_id is not _MISSING:
+            return group_message_id
+        try:
+            async with self._acquire() as conn:
+                group_message_id = await conn.fetchval(
+                    STATEMENTS["get_group_message_mapping"], user_message_id, user_id
+                )
+        except DatabaseUnavailable:
+            group_message_id = self._links_to_group.stale((user_message_id, user_id))
+            return None if group_message_id is _MISSING else group_message_id
+        if group_message_id is not None:
+            self._links_to_group.set((user_message_id, user_id), group_message_id)
+        return group_message_id
 
+    @track_query
     async def execute(self, query: str, *args):
         """Выполняет SQL-запрос."""
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             return await conn.execute(query, *args)
 
-    async def create_tables(self):
-        """Создание необходимых таблиц"""
-        async with self.pool.acquire() as conn:
-            await conn.execute(
-                """
-                CREATE TABLE IF NOT EXISTS messages (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT NOT NULL,
-                    message_type VARCHAR(50) NOT NULL,
-                    content TEXT,
-                    file_id VARCHAR(255),
-                    created_at TIMESTAMP DEFAULT NOW()
-                )
-            """
+    async def migrate(self) -> int:
+        """Применяет недостающие миграции схемы."""
+        async with self._acquire() as conn:
+            applied = await apply_migrations(conn)
+        if applied:
+            # Подготовленные до миграции выражения могли устареть
+            await self.pool.expire_connections()
+        return applied
+
+    @track_query
+    async def maintain_partitions(self) -> Dict[str, List[str]]:
+        """Создает будущие секции таблиц сообщений и убирает старше срока хранения."""
+        async with self._acquire() as conn:
+            return await maintain_partitions(
+                conn,
+                MESSAGE_PARTITIONS_AHEAD,
+                MESSAGE_RETENTION_MONTHS,
+                MESSAGE_RETENTION_ACTION,
             )
 
+    async def create_tables(self):
+        """Создание необходимых таблиц (оставлено для совместимости, см. migrate)"""
+        await self.migrate()
+
 
 # Глобальная инстансация экземпляра базы данных
 db = Database()
@@ -1,5 +1,6 @@
 # config.py
 import os
+import socket
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -12,11 +13,133 @@ DB_CONFIG = {
     "port": os.getenv("POSTGRES_PORT", 5432),  # Значение по умолчанию для порта
 }
 
+# Параметры пула соединений asyncpg
+DB_POOL_CONFIG = {
+    "min_size": int(os.getenv("DB_POOL_MIN_SIZE", 2)),
+    "max_size": int(os.getenv("DB_POOL_MAX_SIZE", 10)),
+    # Через сколько секунд простоя соединение закрывается
+    "max_inactive_connection_lifetime": float(
+        os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", 300)
+    ),
+    "command_timeout": float(os.getenv("DB_COMMAND_TIMEOUT", 10)),
+    "statement_cache_size": int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100)),
+    # Таймаут установки соединения: при падении БД не ждать минуту
+    "timeout": float(os.getenv("DB_CONNECT_TIMEOUT", 5)),
+}
+
+# Устойчивость к сбоям БД
+DB_STARTUP_TIMEOUT = float(os.getenv("DB_STARTUP_TIMEOUT", 60))  # Ожидание БД при запуске, сек
+DB_BREAKER_THRESHOLD = int(os.getenv("DB_BREAKER_THRESHOLD", 3))  # Ошибок связи подряд
+DB_RECONNECT_BASE = float(os.getenv("DB_RECONNECT_BASE", 0.5))  # Первая пауза, далее x2, сек
+DB_RECONNECT_MAX = float(os.getenv("DB_RECONNECT_MAX", 10))  # Предел паузы, сек
+DB_DEFERRED_MAX = int(os.getenv("DB_DEFERRED_MAX", 50000))  # Отложенных записей в памяти
+DB_SNAPSHOT_INTERVAL = float(os.getenv("DB_SNAPSHOT_INTERVAL", 600))  # Снимок users, сек (0 - выкл)
+
+# Журналирование
+LOG_DIR = os.getenv("LOG_DIR", "logs")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()  # json или text для файлов
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 20 * 1024 * 1024))  # Ротация по размеру
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN")  # Ротация по времени, например midnight
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 10))
+LOG_LIBRARY_LEVEL = os.getenv("LOG_LIBRARY_LEVEL", "DEBUG").upper()
+LOG_LIBRARY_RATE = float(os.getenv("LOG_LIBRARY_RATE", 20))  # Записей в секунду на логгер
+
 TOKEN = os.getenv("TOKEN")
+
+# Сборка альбомов (медиагрупп)
+MEDIA_GROUP_MIN_WAIT = float(os.getenv("MEDIA_GROUP_MIN_WAIT", 0.3))  # Пауза после части, сек
+MEDIA_GROUP_MAX_WAIT = float(os.getenv("MEDIA_GROUP_MAX_WAIT", 1.5))
+MEDIA_GROUP_MAX_PENDING = int(os.getenv("MEDIA_GROUP_MAX_PENDING", 1000))  # Альбомов в сборке
+MEDIA_GROUP_MAX_AGE = float(os.getenv("MEDIA_GROUP_MAX_AGE", 120))  # Срок жизни альбома, сек
+# local - альбомы собираются в памяти процесса, postgres - общая сборка
+# в БД для нескольких экземпляров бота за одним webhook
+MEDIA_GROUP_COORDINATION = os.getenv("MEDIA_GROUP_COORDINATION", "local").lower()
+# Имя экземпляра в отметках о захвате альбома
+REPLICA_ID = os.getenv("REPLICA_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+# Пересылка: copy - копированием на стороне Telegram (copy_message/copy_messages),
+# rebuild - заново через send_* по типу содержимого
+FORWARD_MODE = os.getenv("FORWARD_MODE", "copy").lower()
+
+# Очередь исходящих сообщений (outbox) и ее фоновые отправители
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", 4))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 20))  # Сообщений за выборку
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 8))
+OUTBOX_RETRY_BASE = float(os.getenv("OUTBOX_RETRY_BASE", 1))  # Первая пауза, далее x2, сек
+OUTBOX_RETRY_MAX = float(os.getenv("OUTBOX_RETRY_MAX", 300))  # Предел паузы, сек
+OUTBOX_LEASE = float(os.getenv("OUTBOX_LEASE", 300))  # Захват сообщения отправителем, сек
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", 1))  # Опрос очереди, сек
+OUTBOX_RETENTION = float(os.getenv("OUTBOX_RETENTION", 86400))  # Окно идемпотентности, сек
+
+# Запас заранее созданных топиков для /start (0 - выключено)
+TOPIC_POOL_SIZE = int(os.getenv("TOPIC_POOL_SIZE", 0))
+TOPIC_POOL_RATE = float(os.getenv("TOPIC_POOL_RATE", 10))  # Новых топиков в минуту
+
+# Секционирование bot_messages / message_map по месяцам
+MESSAGE_HOT_DAYS = int(os.getenv("MESSAGE_HOT_DAYS", 31))  # Окно поиска в свежих секциях
+MESSAGE_PARTITIONS_AHEAD = int(os.getenv("MESSAGE_PARTITIONS_AHEAD", 3))  # Секций вперед
+MESSAGE_RETENTION_MONTHS = int(os.getenv("MESSAGE_RETENTION_MONTHS", 12))  # 0 - хранить все
+MESSAGE_RETENTION_ACTION = os.getenv("MESSAGE_RETENTION_ACTION", "archive").lower()
+PARTITION_MAINTENANCE_INTERVAL = float(
+    os.getenv("PARTITION_MAINTENANCE_INTERVAL", 6 * 3600)
+)  # Проверка секций, сек
+
+# Как часто сохранять состояние бота (bot_data) в PostgreSQL, сек
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", 1))
+
+# Параллельная обработка обновлений (порядок внутри диалога сохраняется)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", 16))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", 256))  # Глубина очереди полосы
+
+# Плавная остановка: сколько всего ждать обработки, альбомов, отправки и записи
+# в БД, сек. Должно быть меньше срока до SIGKILL (stop_grace_period)
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 25))
+
+# Лимиты исходящих сообщений (значения по умолчанию - лимиты Telegram)
+RATE_LIMIT_OVERALL = float(os.getenv("RATE_LIMIT_OVERALL", 30))  # Всего, в секунду
+RATE_LIMIT_GROUP = float(os.getenv("RATE_LIMIT_GROUP", 20))  # На группу, в минуту
+RATE_LIMIT_PRIVATE = float(os.getenv("RATE_LIMIT_PRIVATE", 1))  # На личный чат, в секунду
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", 5))  # Повторы при 429
+
+# Метрики Prometheus: http://METRICS_LISTEN:METRICS_PORT/metrics, 0 - выключено
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9108))
+
+# Способ получения обновлений: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Публичный адрес, например https://bot.example.com
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Проверяется в X-Telegram-Bot-Api-Secret-Token
+# Polling: продолжает со смещения, сохраненного в БД
+POLL_TIMEOUT = int(os.getenv("POLL_TIMEOUT", 30))  # Long polling getUpdates, сек
+POLL_BATCH_SIZE = min(100, int(os.getenv("POLL_BATCH_SIZE", 100)))  # Обновлений за getUpdates
+UPDATE_OFFSET_INTERVAL = float(os.getenv("UPDATE_OFFSET_INTERVAL", 1))  # Сохранение смещения, сек
 GROUP_CHAT_ID = int(os.getenv("GROUP_CHAT_ID"))
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50 МБ для документов
 MAX_VOICE_SIZE = 20 * 1024 * 1024  # 20 МБ для голосовых/видеокружков
 
+# Кеш пользователей перед БД
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))  # Максимум записей
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 300))  # Время жизни записи, сек
+USER_CACHE_WARMUP = int(os.getenv("USER_CACHE_WARMUP", 0))  # Прогрев при старте, 0 - выкл
+
+# Горячий слой индекса связей сообщений (группа <-> личный чат)
+LINK_CACHE_SIZE = int(os.getenv("LINK_CACHE_SIZE", 50000))
+LINK_CACHE_TTL = float(os.getenv("LINK_CACHE_TTL", 86400))
+
+# Отложенная пакетная запись bot_messages / message_map
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", 100))  # Сброс по размеру пачки
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", 0.5))  # Сброс по времени, сек
+
+# Архив переписки (таблица messages): пакетная запись через COPY
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 500))  # Сброс по размеру пачки
+ARCHIVE_FLUSH_INTERVAL = float(os.getenv("ARCHIVE_FLUSH_INTERVAL", 2))  # Сброс по времени, сек
+ARCHIVE_MAX_PENDING = int(os.getenv("ARCHIVE_MAX_PENDING", 50000))  # Сверх этого - отброс
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", 5))  # Результатов /search на странице
+STATS_DAYS = int(os.getenv("STATS_DAYS", 7))  # Период сводки /stats, дней
+
 # ID группы для пересылки сообщений
 try:
     GROUP_CHAT_ID = int(os.getenv("GROUP_CHAT_ID"))
@@ -26,6 +149,21 @@ except (ValueError, TypeError):
 if not TOKEN:
     raise EnvironmentError("Не задан BOT_TOKEN в переменных окружения")
 
+if MESSAGE_RETENTION_ACTION not in ("archive", "drop"):
+    raise ValueError("MESSAGE_RETENTION_ACTION должен быть archive или drop")
+
+if FORWARD_MODE not in ("copy", "rebuild"):
+    raise ValueError("FORWARD_MODE должен быть copy или rebuild")
+
+if MEDIA_GROUP_COORDINATION not in ("local", "postgres"):
+    raise ValueError("MEDIA_GROUP_COORDINATION должен быть local или postgres")
+
+if BOT_MODE not in ("polling", "webhook"):
+    raise ValueError("BOT_MODE должен быть polling или webhook")
+
+if BOT_MODE == "webhook" and not (WEBHOOK_URL and WEBHOOK_SECRET):
+    raise EnvironmentError("Для режима webhook нужны WEBHOOK_URL и WEBHOOK_SECRET")
+
 if not all(DB_CONFIG.values()):
     missing = [k for k, v in DB_CONFIG.items() if not v]
     raise EnvironmentError(f"Не заданы параметры БД: {', '.join(missing)}")
@@ -0,0 +1,160 @@
+# handlers/content.py
+from typing import Any, Callable, Dict, Optional, Tuple
+from telegram import Message
+from globals.config import FORWARD_MODE, MAX_FILE_SIZE, MAX_VOICE_SIZE
+
+
+def _file_id(obj) -> str:
+    return obj.file_id
+
+
+def _photo_file_id(photo) -> str:
+    # Самое большое разрешение - последнее
+    return photo[-1].file_id
+
+
+def _location_args(message: Message, location) -> Dict[str, Any]:
+    args = {"latitude": location.latitude, "longitude": location.longitude}
+    if location.horizontal_accuracy:
+        args["horizontal_accuracy"] = location.horizontal_accuracy
+    if location.live_period:
+        args["live_period"] = location.live_period
+    return args
+
+
+def _audio_args(message: Message, audio) -> Dict[str, Any]:
+    args = {"audio": audio.file_id}
+    if audio.title:
+        args["title"] = audio.title
+    if audio.performer:
+        args["performer"] = audio.performer
+    return args
+
+
+class ContentType:
+    """Тип содержимого сообщения и способ его переотправки"""
+
+    __slots__ = ("name", "method", "caption", "max_size", "_args", "_file_id")
+
+    def __init__(
+        self,
+        name: str,
+        method: str,
+        caption: bool = False,
+        max_size: Optional[int] = None,
+        args: Optional[Callable[[Message, Any], Dict[str, Any]]] = None,
+        file_id: Callable[[Any], str] = _file_id,
+    ):
+        self.name = name
+        self.method = method
+        self.caption = caption  # Поддерживает ли метод подпись
+        self.max_size = max_size
+        self._args = args
+        self._file_id = file_id
+
+    def file_id(self, message: Message) -> str:
+        return self._file_id(getattr(message, self.name))
+
+    def too_big(self, message: Message) -> bool:
+        """Превышает ли файл допустимый размер."""
+        if self.max_size is None:
+            return False
+        size = getattr(getattr(message, self.name), "file_size", None) or 0
+        return size > self.max_size
+
+    def send_args(self, message: Message) -> Dict[str, Any]:
+        """Аргументы send_* без chat_id и параметров доставки."""
+        if self._args is not None:
+            args = self._args(message, getattr(message, self.name))
+        else:
+            args = {self.name: self._file_id(getattr(message, self.name))}
+        if self.caption and message.caption:
+            args["caption"] = message.caption
+        return args
+
+
+TEXT = ContentType(
+    "text", "send_message", args=lambda m, text: {"text": m.text or m.caption}
+)
+
+# Порядок важен: у анимации Telegram заполняет и поле document
+CONTENT_TYPES: Tuple[ContentType, ...] = (
+    ContentType("animation", "send_animation", caption=True),
+    ContentType("voice", "send_voice", caption=True, max_size=MAX_VOICE_SIZE),
+    ContentType("sticker", "send_sticker"),
+    ContentType("video_note", "send_video_note", max_size=MAX_VOICE_SIZE),
+    ContentType("location", "send_location", args=_location_args),
+    ContentType("photo", "send_photo", caption=True, file_id=_photo_file_id),
+    ContentType("video", "send_video", caption=True),
+    ContentType("audio", "send_audio", caption=True, args=_audio_args),
+    ContentType("document", "send_document", caption=True, max_size=MAX_FILE_SIZE),
+)
+
+
+def classify(message: Message) -> Optional[ContentType]:
+    """Определяет тип содержимого за один проход по полям сообщения."""
+    for content in CONTENT_TYPES:
+        if getattr(message, content.name):
+            return content
+    if message.text or message.caption:
+        return TEXT
+    return None
+
+
+def max_size_mb(content: ContentType) -> int:
+    return (content.max_size or MAX_FILE_SIZE) // (1024 * 1024)
+
+
+def archive_fields(
+    message: Message, content: Optional[ContentType]
+) -> Tuple[str, Optional[str], Optional[str]]:
+    """Тип, текст (или подпись) и file_id сообщения для архива переписки."""
+    if content is None:
+        return "other", message.text or message.caption, None
+    try:
+        file_id = content.file_id(message)
+    except AttributeError:
+        # Текст и геопозиция без файла
+        file_id = None
+    return content.name, message.text or message.caption, file_id
+
+
+def can_copy(message: Message) -> bool:
+    """Можно ли переслать сообщение копированием (copy_message)."""
+    return FORWARD_MODE == "copy" and not message.has_protected_content
+
+
+def forward_call(
+    message: Message,
+    content: Optional[ContentType],
+    chat_id: int,
+    from_chat_id: int,
+    message_thread_id: Optional[int] = None,
+    reply_to: Optional[int] = None,
+) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """Метод Bot API и аргументы для пересылки message в chat_id.
+
+    Копирование (copy_message) сохраняет форматирование, спойлеры и любые
+    типы сообщений; отправка по типу (send_*) прикладывается как запасной
+    путь _fallback на случай, если Telegram откажет в копировании.
+    None - сообщение нельзя переслать.
+    """
+    delivery: Dict[str, Any] = {"chat_id": chat_id}
+    if message_thread_id is not None:
+        delivery["message_thread_id"] = message_thread_id
+    if reply_to is not None:
+        delivery["reply_to_message_id"] = reply_to
+        delivery["allow_sending_without_reply"] = True
+
+    rebuild = None
+    if content is not None:
+        rebuild = {"method": content.method, "kwargs": {**delivery, **content.send_args(message)}}
+
+    if can_copy(message):
+        kwargs = {**delivery, "from_chat_id": from_chat_id, "message_id": message.message_id}
+        if rebuild is not None:
+            kwargs["_fallback"] = rebuild
+        return "copy_message", kwargs
+    if rebuild is None:
+        return None
+    return rebuild["method"], rebuild["kwargs"]
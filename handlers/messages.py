@@ -1,30 +1,41 @@
-from telegram import (
-    Update,
-    InputMediaPhoto,
-    InputMediaVideo,
-    InputMediaDocument,
-    InputMediaAudio,
-    InputMediaAnimation,
-)
-from telegram.ext import MessageHandler, filters, CallbackContext, JobQueue
+from telegram import Bot, Update
+from telegram.ext import MessageHandler, filters, CallbackContext
 from database import db
-from globals.config import GROUP_CHAT_ID, MAX_FILE_SIZE, MAX_VOICE_SIZE
+from globals.config import (
+    FORWARD_MODE,
+    GROUP_CHAT_ID,
+    MEDIA_GROUP_COORDINATION,
+    MEDIA_GROUP_MAX_AGE,
+    MEDIA_GROUP_MAX_PENDING,
+    MEDIA_GROUP_MAX_WAIT,
+    MEDIA_GROUP_MIN_WAIT,
+    REPLICA_ID,
+)
+from handlers.content import (
+    archive_fields,
+    can_copy,
+    classify,
+    forward_call,
+    max_size_mb,
+)
 from loger.logger import logger
-from typing import Dict, List, Union
+from services.media_groups import (
+    MediaGroup,
+    MediaGroupAggregator,
+    SharedMediaGroupAggregator,
+)
+from services.metrics import FORWARD_ERRORS, track_handler
+from services.outbox import outbox
+from services.polling import update_ledger
+from datetime import datetime, timezone
 
 # from globals.storage import MAX_FILE_SIZE
-import time
 
-# Типы медиа для обработки
-MEDIA_TYPES = {
-    "photo": InputMediaPhoto,
-    "video": InputMediaVideo,
-    "document": InputMediaDocument,
-    "audio": InputMediaAudio,
-    "animation": InputMediaAnimation,
-}
+# Полоса outbox: сообщения одного топика уходят по порядку
+TOPIC_LANE = "{chat_id}:{thread_id}"
 
 
+@track_handler
 async def new_message_handler(update: Update, context: CallbackContext):
     """Универсальный обработчик входящих сообщений"""
     try:
@@ -50,7 +61,7 @@ async def new_message_handler(update: Update, context: CallbackContext):
 
         # Обработка медиагрупп
         if message.media_group_id:
-            await _handle_media_group(message, context, user, thread_id)
+            await _handle_media_group(message, context, user, thread_id, update.update_id)
             return
 
         # Обработка одиночных сообщений
@@ -61,239 +72,196 @@ async def new_message_handler(update: Update, context: CallbackContext):
         await update.message.reply_text("💥 Системная ошибка")
 
 
-async def _handle_media_group(message, context, user, thread_id):
-    """Обработчик медиагрупп с временным кешированием"""
-    media_group_id = f"{user.id}_{message.media_group_id}"
-    media_cache = context.bot_data.setdefault("media_groups", {})
-
-    if media_group_id not in media_cache:
-        media_cache[media_group_id] = {
-            "messages": [],
-            "user_id": user.id,
-            "thread_id": thread_id,
-            "created": time.time(),
-            "caption": message.caption or "",
-        }
-        # Запускаем обработку через 1 секунду
-        context.job_queue.run_once(
-            process_media_group, 1, name=media_group_id, data=media_group_id
-        )
-
-    media_cache[media_group_id]["messages"].append(message)
+async def _handle_media_group(message, context, user, thread_id, update_id):
+    """Обработчик медиагрупп: части альбома собираются агрегатором"""
+    await media_groups.add(message, context, user.id, thread_id, update_id)
 
 
-async def process_media_group(context: CallbackContext):
-    """Обработка собранных медиагрупп"""
-    media_group_id = context.job.data
-    media_data = context.bot_data["media_groups"].get(media_group_id)
-
-    if not media_data or time.time() - media_data["created"] > 120:
-        return
-
+async def process_media_group(context: CallbackContext, media_group: MediaGroup):
+    """Постановка собранной медиагруппы в очередь отправки"""
     try:
-        media = []
-        caption = media_data["caption"]
-
-        for idx, msg in enumerate(media_data["messages"]):
-            media_type = next((t for t in MEDIA_TYPES if getattr(msg, t)), None)
-
-            if media_type:
-                file_id = _get_file_id(msg)
-                media_class = MEDIA_TYPES[media_type]
-
+        caption = media_group.caption
+        items = media_group.sorted_items()
+        media = [
+            {
+                "type": item.media_type,
+                "media": item.file_id,
                 # Добавляем подпись только к первому элементу
-                media.append(
-                    media_class(media=file_id, caption=caption if idx == 0 else None)
-                )
+                "caption": caption if idx == 0 else None,
+            }
+            for idx, item in enumerate(items)
+        ]
 
         if media:
-            sent_messages = await context.bot.send_media_group(
-                chat_id=GROUP_CHAT_ID,
-                media=media,
-                message_thread_id=media_data["thread_id"],
+            lane = TOPIC_LANE.format(chat_id=GROUP_CHAT_ID, thread_id=media_group.thread_id)
+            method, kwargs = "send_media_group", {
+                "chat_id": GROUP_CHAT_ID,
+                "media": media,
+                "message_thread_id": media_group.thread_id,
+            }
+            if FORWARD_MODE == "copy":
+                # Альбом копируется одним вызовом с подписями и форматированием
+                method, kwargs = "copy_messages", {
+                    "chat_id": GROUP_CHAT_ID,
+                    "from_chat_id": media_group.user_id,
+                    "message_ids": [item.order for item in items],
+                    "message_thread_id": media_group.thread_id,
+                    "_fallback": {"method": method, "kwargs": kwargs},
+                }
+            queued = await outbox.enqueue(
+                key=f"to_group:{media_group.key}",
+                lane=lane,
+                kind="to_group_album",
+                method=method,
+                kwargs=kwargs,
+                # Элементы альбома приходят в том же порядке, что и отправлены
+                effects={
+                    "user_id": media_group.user_id,
+                    "thread_id": media_group.thread_id,
+                    "direction": "to_group",
+                    "sources": [item.order for item in items],
+                },
             )
-
-            # Сохранение в БД
-            for sent_msg in sent_messages:
-                await db.save_bot_message(
-                    message_id=sent_msg.message_id,
-                    user_id=media_data["user_id"],
-                    thread_id=media_data["thread_id"],
-                )
-
-            logger.info(f"Медиагруппа из {len(media)} элементов отправлена")
+            if queued:
+                created_at = datetime.fromtimestamp(media_group.created, timezone.utc)
+                for item in items:
+                    db.archive_message(
+                        media_group.user_id,
+                        media_group.thread_id,
+                        "to_group",
+                        item.order,
+                        item.media_type,
+                        item.caption,
+                        item.file_id,
+                        created_at,
+                    )
+            logger.info(f"Медиагруппа из {len(media)} элементов поставлена в очередь")
 
     except Exception as e:
+        FORWARD_ERRORS.inc("to_group", "media_group")
         logger.error(f"Ошибка медиагруппы: {str(e)}", exc_info=True)
         await context.bot.send_message(
-            chat_id=media_data["user_id"], text="❌ Ошибка отправки медиагруппы"
+            chat_id=media_group.user_id, text="❌ Ошибка отправки медиагруппы"
         )
-    finally:
-        context.bot_data["media_groups"].pop(media_group_id, None)
 
 
-def _get_file_id(msg) -> Union[str, None]:
-    """Получение file_id из сообщения"""
-    for media_type in MEDIA_TYPES:
-        if media_obj := getattr(msg, media_type, None):
-            if media_type == "photo":
-                return media_obj[-1].file_id
-            return media_obj.file_id
-    return None
+async def _album_failed(bot: Bot, effects: dict, error: Exception):
+    """Альбом так и не удалось отправить: сообщаем пользователю"""
+    FORWARD_ERRORS.inc("to_group", "media_group")
+    await bot.send_message(chat_id=effects["user_id"], text="❌ Ошибка отправки медиагруппы")
+
+
+async def _message_failed(bot: Bot, effects: dict, error: Exception):
+    """Сообщение так и не удалось отправить: отвечаем пользователю на него"""
+    content = effects["content"]
+    FORWARD_ERRORS.inc("to_group", content)
+    if "file is too big" in str(error).lower() and effects["max_size_mb"]:
+        text = f"❌ Файл слишком большой (максимум {effects['max_size_mb']}MB)"
+    else:
+        text = f"❌ Ошибка: {str(error)}"
+    await bot.send_message(
+        chat_id=effects["user_id"],
+        text=text,
+        reply_to_message_id=effects["sources"][0],
+        allow_sending_without_reply=True,
+    )
+
+
+outbox.on_failure("to_group", _message_failed)
+outbox.on_failure("to_group_album", _album_failed)
+
+
+# Сборщик альбомов: части медиагруппы приходят отдельными обновлениями
+# (с несколькими экземплярами бота - через общую сборку в БД)
+if MEDIA_GROUP_COORDINATION == "postgres":
+    media_groups = SharedMediaGroupAggregator(
+        process_media_group,
+        db,
+        REPLICA_ID,
+        min_wait=MEDIA_GROUP_MIN_WAIT,
+        max_wait=MEDIA_GROUP_MAX_WAIT,
+        max_pending=MEDIA_GROUP_MAX_PENDING,
+        max_age=MEDIA_GROUP_MAX_AGE,
+    )
+else:
+    media_groups = MediaGroupAggregator(
+        process_media_group,
+        min_wait=MEDIA_GROUP_MIN_WAIT,
+        max_wait=MEDIA_GROUP_MAX_WAIT,
+        max_pending=MEDIA_GROUP_MAX_PENDING,
+        max_age=MEDIA_GROUP_MAX_AGE,
+        ledger=update_ledger,
+    )
 
 
 async def _handle_single_message(message, context, thread_id, user_id, log_extra):
     """Обработка одиночных сообщений всех типов"""
-    content_handlers = {
-        "animation": {
-            "method": "send_animation",
-            "args": lambda: {
-                "animation": message.animation.file_id,
-                "caption": message.caption,
-            },
-            "condition": bool(message.animation),
-        },
-        "voice": {
-            "method": "send_voice",
-            "args": lambda: {
-                "voice": message.voice.file_id,
-                "caption": message.caption,
-            },
-            "condition": bool(
-                message.voice and message.voice.file_size <= MAX_VOICE_SIZE
-            ),
-        },
-        "sticker": {
-            "method": "send_sticker",
-            "args": lambda: {"sticker": message.sticker.file_id},
-            "condition": bool(message.sticker),
-        },
-        "video_note": {
-            "method": "send_video_note",
-            "args": lambda: {"video_note": message.video_note.file_id},
-            "condition": bool(
-                message.video_note
-                and getattr(message.video_note, "file_size", 0) <= MAX_VOICE_SIZE
-            ),
-        },
-        "location": {
-            "method": "send_location",
-            "args": lambda: {
-                "latitude": message.location.latitude,
-                "longitude": message.location.longitude,
-                **(
-                    {"horizontal_accuracy": message.location.horizontal_accuracy}
-                    if message.location.horizontal_accuracy
-                    else {}
-                ),
-                **(
-                    {"live_period": message.location.live_period}
-                    if message.location.live_period
-                    else {}
-                ),
-            },
-            "condition": bool(message.location),
-        },
-        "photo": {
-            "method": "send_photo",
-            "args": lambda: {
-                "photo": message.photo[-1].file_id,
-                "caption": message.caption,
-            },
-            "condition": bool(message.photo),
-        },
-        "video": {
-            "method": "send_video",
-            "args": lambda: {
-                "video": message.video.file_id,
-                "caption": message.caption,
-            },
-            "condition": bool(message.video),
-        },
-        "audio": {
-            "method": "send_audio",
-            "args": lambda: {
-                "audio": message.audio.file_id,
-                "caption": message.caption,
-                "title": message.audio.title,
-                "performer": message.audio.performer,
-            },
-            "condition": bool(message.audio),
-        },
-        "document": {
-            "method": "send_document",
-            "args": lambda: {
-                "document": message.document.file_id,
-                "caption": message.caption,
+    content = classify(message)
+    if content is None and not can_copy(message):
+        await message.reply_text("❌ Неподдерживаемый тип сообщения")
+        logger.warning("Неподдерживаемый тип контента", extra=log_extra)
+        return
+
+    # Копирование идет на стороне Telegram и не ограничено размером файла
+    if content is not None and not can_copy(message) and content.too_big(message):
+        await message.reply_text(
+            f"❌ Файл слишком большой (максимум {max_size_mb(content)}MB)"
+        )
+        return
+
+    content_name = content.name if content else "other"
+    try:
+        # Ответ пользователя на сообщение администратора - ответ и в топике
+        reply_to = None
+        if message.reply_to_message:
+            reply_to = await db.get_group_message_mapping(
+                message.reply_to_message.message_id, user_id
+            )
+
+        method, kwargs = forward_call(
+            message,
+            content,
+            chat_id=GROUP_CHAT_ID,
+            from_chat_id=user_id,
+            message_thread_id=thread_id,
+            reply_to=reply_to,
+        )
+        # Отправку и запись связей выполнит outbox
+        queued = await outbox.enqueue(
+            key=f"to_group:{user_id}:{message.message_id}",
+            lane=TOPIC_LANE.format(chat_id=GROUP_CHAT_ID, thread_id=thread_id),
+            kind="to_group",
+            method=method,
+            kwargs=kwargs,
+            effects={
+                "user_id": user_id,
+                "thread_id": thread_id,
+                "direction": "to_group",
+                "sources": [message.message_id],
+                "content": content_name,
+                "max_size_mb": max_size_mb(content) if content else None,
             },
-            "condition": bool(
-                message.document and message.document.file_size <= MAX_FILE_SIZE
-            ),
-        },
-        "text": {
-            "method": "send_message",
-            "args": lambda: {"text": message.text or message.caption},
-            "condition": bool(
-                message.text
-                or (
-                    message.caption
-                    and not any(
-                        [
-                            message.animation,
-                            message.sticker,
-                            message.photo,
-                            message.video,
-                            message.audio,
-                            message.voice,
-                            message.video_note,
-                            message.location,
-                            message.document,
-                        ]
-                    )
-                )
-            ),
-        },
-    }
-
-    for media_type, handler in content_handlers.items():
-        if handler["condition"]:
-            try:
-                args = {
-                    k: v for k, v in handler["args"]().items() if v is not None
-                }  # Фильтрация None
-                sent_message = await getattr(context.bot, handler["method"])(
-                    chat_id=GROUP_CHAT_ID, message_thread_id=thread_id, **args
-                )
-
-                await db.save_bot_message(
-                    user_id=user_id,
-                    thread_id=thread_id,
-                    message_id=sent_message.message_id,
-                )
-                logger.info(
-                    f"Сообщение {media_type} отправлено (ID: {sent_message.message_id})",
-                    extra=log_extra,
-                )
-                return
-
-            except Exception as e:
-                logger.error(
-                    f"Ошибка отправки {media_type}: {str(e)}",
-                    exc_info=True,
-                    extra=log_extra,
-                )
-                if "file is too big" in str(e).lower():
-                    max_size = (
-                        MAX_VOICE_SIZE // (1024 * 1024)
-                        if media_type in ["voice", "video_note"]
-                        else MAX_FILE_SIZE // (1024 * 1024)
-                    )
-                    await message.reply_text(
-                        f"❌ Файл слишком большой (максимум {max_size}MB)"
-                    )
-                else:
-                    await message.reply_text(f"❌ Ошибка: {str(e)}")
-                return
+        )
+        # Повторно доставленное обновление в архив не попадает
+        if queued:
+            db.archive_message(
+                user_id,
+                thread_id,
+                "to_group",
+                message.message_id,
+                *archive_fields(message, content),
+                message.date,
+            )
+        logger.info(f"Сообщение {content_name} поставлено в очередь", extra=log_extra)
+
+    except Exception as e:
+        FORWARD_ERRORS.inc("to_group", content_name)
+        logger.error(
+            f"Ошибка отправки {content_name}: {str(e)}",
+            exc_info=True,
+            extra=log_extra,
+        )
+        await message.reply_text(f"❌ Ошибка: {str(e)}")
 
 
 # Регистрация обработчиков
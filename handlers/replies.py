@@ -1,10 +1,14 @@
-from telegram import Update, ReactionTypeEmoji
+from telegram import Bot, Update
 from telegram.ext import MessageHandler, filters, CallbackContext
 from database import db
 from loger.logger import logger
 from globals.config import GROUP_CHAT_ID
+from handlers.content import archive_fields, classify, forward_call
+from services.metrics import FORWARD_ERRORS, track_handler
+from services.outbox import outbox
 
 
+@track_handler
 async def handle_group_reply(update: Update, context: CallbackContext):
     """Обработчик ответов администраторов с сохранением связей сообщений"""
     try:
@@ -40,109 +44,82 @@ async def handle_group_reply(update: Update, context: CallbackContext):
             return
 
         user_id = user_data["user_id"]
-        message_map = context.bot_data.setdefault("message_map", {})
-        sent = False
-        sent_types = []
-
-        # Обработка текста
-        if update.message.text and not sent:
-            try:
-                sent_message = await context.bot.send_message(
-                    chat_id=user_id,
-                    text=update.message.text,
-                    reply_to_message_id=message_map.get(original_message.message_id),
-                )
-                sent = True
-                sent_types.append("текст")
-                logger.info("Текст отправлен")
-            except Exception as e:
-                logger.error(f"Ошибка отправки текста: {e}")
-                await update.message.reply_text("❌ Ошибка пересылки")
-                return
-
-        # Обработка медиаконтента
-        media_handlers = [
-            ("animation", "send_animation", update.message.animation),
-            (
-                "photo",
-                "send_photo",
-                update.message.photo[-1] if update.message.photo else None,
-            ),
-            ("video", "send_video", update.message.video),
-            ("audio", "send_audio", update.message.audio),
-            ("voice", "send_voice", update.message.voice),
-            ("document", "send_document", update.message.document),
-            ("sticker", "send_sticker", update.message.sticker),
-            ("video_note", "send_video_note", update.message.video_note),
-            ("location", "send_location", update.message.location),
-        ]
-
-        for media_type, method_name, media_obj in media_handlers:
-            if media_obj and not sent:
-                try:
-                    method = getattr(context.bot, method_name)
-                    kwargs = {
-                        "chat_id": user_id,
-                        media_type: media_obj.file_id,
-                        "reply_to_message_id": message_map.get(
-                            original_message.message_id
-                        ),
-                    }
-
-                    # Специальная обработка для геопозиции
-                    if media_type == "location":
-                        kwargs["latitude"] = media_obj.latitude
-                        kwargs["longitude"] = media_obj.longitude
-                        del kwargs["location"]
-
-                    # Добавление подписи для поддерживаемых типов
-                    if media_type not in {"sticker", "voice", "video_note", "location"}:
-                        kwargs["caption"] = update.message.caption
-
-                    sent_message = await method(**kwargs)
-                    sent = True
-                    sent_types.append(media_type)
-                    logger.info(f"Отправлен {media_type}")
-                    break
-                except Exception as e:
-                    logger.error(f"Ошибка отправки {media_type}: {e}")
-
-        # Сохранение связей сообщений
-        if sent:
-            # Сохраняем связь между групповым и личным сообщением
-            await db.add_message_mapping(
-                group_message_id=update.message.message_id,
-                user_message_id=sent_message.message_id,
-                user_id=user_id,
-            )
+        # Исходное сообщение пользователя, чтобы ответ пришел ответом на него
+        reply_to = await db.get_message_mapping(original_message.message_id, user_id)
+        content = classify(update.message)
+        call = forward_call(
+            update.message,
+            content,
+            chat_id=user_id,
+            from_chat_id=GROUP_CHAT_ID,
+            reply_to=reply_to,
+        )
+        if call is None:
+            await update.message.reply_text("❌ Неподдерживаемый тип сообщения")
+            logger.warning("Неподдерживаемый тип контента")
+            return
 
-            # Сохраняем сообщение бота для будущих ответов
-            await db.save_bot_message(
-                message_id=sent_message.message_id, user_id=user_id, thread_id=thread_id
+        content_name = content.name if content else "other"
+        method, kwargs = call
+        # Отправку пользователю и запись связей выполнит outbox
+        queued = await outbox.enqueue(
+            key=f"to_user:{update.message.message_id}",
+            lane=str(user_id),
+            kind="to_user",
+            method=method,
+            kwargs=kwargs,
+            effects={
+                "user_id": user_id,
+                "thread_id": thread_id,
+                "direction": "to_user",
+                "sources": [update.message.message_id],
+                "content": content_name,
+            },
+        )
+        if queued:
+            db.archive_message(
+                user_id,
+                thread_id,
+                "to_user",
+                update.message.message_id,
+                *archive_fields(update.message, content),
+                update.message.date,
+                admin_id=update.message.from_user.id,
             )
 
-            # Установка реакции и метрик
-            # try:
-            #    await update.message.set_reaction([ReactionTypeEmoji("✅")])
-            #    await db.execute(
-            #        "INSERT INTO metrics (name, value) VALUES ($1, 1) "
-            #        "ON CONFLICT (name) DO UPDATE SET value = metrics.value + 1",
-            #        "messages_sent"
-            #    )
-            # except Exception as e:
-            #    logger.warning(f"Ошибка реакции: {e}")
-
-            logger.info(f"Успешно отправлено: {', '.join(sent_types)}")
+        # Установка реакции и метрик
+        # try:
+        #    await update.message.set_reaction([ReactionTypeEmoji("✅")])
+        #    await db.execute(
+        #        "INSERT INTO metrics (name, value) VALUES ($1, 1) "
+        #        "ON CONFLICT (name) DO UPDATE SET value = metrics.value + 1",
+        #        "messages_sent"
+        #    )
+        # except Exception as e:
+        #    logger.warning(f"Ошибка реакции: {e}")
 
-        elif not sent:
-            await update.message.reply_text("❌ Неподдерживаемый тип сообщения")
-            logger.warning("Неподдерживаемый тип контента")
+        logger.info(f"Поставлено в очередь: {content_name}")
 
     except Exception as e:
         logger.critical(f"Критическая ошибка: {str(e)}", exc_info=True)
         await update.message.reply_text("💥 Системная ошибка")
 
 
+async def _reply_failed(bot: Bot, effects: dict, error: Exception):
+    """Ответ так и не удалось отправить: сообщаем администратору в топике"""
+    FORWARD_ERRORS.inc("to_user", effects["content"])
+    await bot.send_message(
+        chat_id=GROUP_CHAT_ID,
+        message_thread_id=effects["thread_id"],
+        text="❌ Ошибка пересылки",
+        reply_to_message_id=effects["sources"][0],
+        allow_sending_without_reply=True,
+    )
+
+
+outbox.on_failure("to_user", _reply_failed)
+
+
 def register_replies_handler(application):
     """Регистрация обработчика ответов"""
     application.add_handler(
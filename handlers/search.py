@@ -0,0 +1,113 @@
+# handlers/search.py
+from typing import Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Message, Update
+from telegram.ext import CallbackContext, CallbackQueryHandler, CommandHandler, filters
+from database import db
+from globals.config import GROUP_CHAT_ID, SEARCH_PAGE_SIZE
+from loger.logger import logger
+from services.metrics import track_handler
+
+USAGE_TEXT = (
+    "🔎 /search <запрос> - поиск по архиву переписки.\n"
+    "В топике ищет по этому диалогу, в общем чате - по всем.\n"
+    'Поддерживаются "точные фразы", OR и -исключения.'
+)
+
+DIRECTION_ICONS = {"to_group": "👤", "to_user": "🛟"}
+
+
+def _query(text: Optional[str]) -> str:
+    """Текст запроса из команды /search."""
+    parts = (text or "").split(maxsplit=1)
+    return parts[1].strip() if len(parts) > 1 else ""
+
+
+def _scope(message: Message) -> Optional[int]:
+    """Топик, в котором ищем (None - по всем диалогам)."""
+    return message.message_thread_id if message.is_topic_message else None
+
+
+def _render(query: str, rows) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    if not rows:
+        return f"🔎 По запросу «{query}» ничего не найдено", None
+
+    lines = [f"🔎 Результаты по запросу «{query}»:"]
+    for row in rows:
+        icon = DIRECTION_ICONS.get(row["direction"], "💬")
+        lines.append(
+            f"\n{icon} {row['created_at']:%d.%m.%Y %H:%M} · "
+            f"пользователь {row['user_id']} · топик {row['thread_id']}\n"
+            f"{row['snippet'] or '[' + row['message_type'] + ']'}"
+        )
+
+    keyboard = None
+    if len(rows) == SEARCH_PAGE_SIZE:
+        # Ключ последнего результата - начало следующей страницы
+        last = rows[-1]
+        button = InlineKeyboardButton(
+            "Дальше ▶", callback_data=f"search:{last['rank']!r}:{last['id']}"
+        )
+        keyboard = InlineKeyboardMarkup([[button]])
+    return "\n".join(lines), keyboard
+
+
+@track_handler
+async def search_command(update: Update, context: CallbackContext):
+    """Обработчик команды /search в группе поддержки"""
+    message = update.message
+    query = _query(message.text)
+    if not query:
+        await message.reply_text(USAGE_TEXT)
+        return
+
+    try:
+        rows = await db.search_messages(
+            query, thread_id=_scope(message), limit=SEARCH_PAGE_SIZE
+        )
+        text, keyboard = _render(query, rows)
+        await message.reply_text(text, reply_markup=keyboard)
+        logger.info(f"Поиск по архиву: найдено {len(rows)}")
+    except Exception as e:
+        logger.error(f"Ошибка поиска: {str(e)}", exc_info=True)
+        await message.reply_text("❌ Ошибка поиска")
+
+
+@track_handler
+async def search_page(update: Update, context: CallbackContext):
+    """Следующая страница результатов (кнопка «Дальше»)"""
+    callback = update.callback_query
+    # Результаты - ответ на команду, из нее и берем запрос и топик
+    command = callback.message.reply_to_message if callback.message else None
+    if command is None:
+        await callback.answer("Запрос устарел, повторите /search")
+        return
+
+    try:
+        _, rank, last_id = callback.data.split(":")
+        query = _query(command.text)
+        rows = await db.search_messages(
+            query,
+            thread_id=_scope(command),
+            limit=SEARCH_PAGE_SIZE,
+            after=(float(rank), int(last_id)),
+        )
+        if not rows:
+            await callback.answer("Больше результатов нет")
+            await callback.edit_message_reply_markup(reply_markup=None)
+            return
+        text, keyboard = _render(query, rows)
+        await callback.edit_message_text(text, reply_markup=keyboard)
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"Ошибка поиска: {str(e)}", exc_info=True)
+        await callback.answer("❌ Ошибка поиска")
+
+
+def register_search_handler(application):
+    """Регистрация /search (только в группе поддержки)"""
+    application.add_handler(
+        CommandHandler("search", search_command, filters=filters.Chat(GROUP_CHAT_ID))
+    )
+    application.add_handler(CallbackQueryHandler(search_page, pattern=r"^search:"))
+    logger.info("Обработчик /search зарегистрирован")
@@ -1,11 +1,39 @@
 # handlers/start.py
+import asyncio
+from typing import Dict
+
 from telegram import Update
 from telegram.ext import CommandHandler, CallbackContext
 from database import db
-from globals.config import GROUP_CHAT_ID
+from globals.config import GROUP_CHAT_ID, TOPIC_POOL_RATE, TOPIC_POOL_SIZE
 from loger.logger import logger
+from services.metrics import track_handler
+from services.topic_pool import TopicPool
+
+
+# Диалоги, создающиеся прямо сейчас: user_id -> задача (single-flight)
+_starting: Dict[int, asyncio.Future] = {}
 
+# Запас заранее созданных топиков (пополняется задачей из main)
+topic_pool = TopicPool(db, GROUP_CHAT_ID, size=TOPIC_POOL_SIZE, per_minute=TOPIC_POOL_RATE)
 
+
+async def _start_dialog(bot, user_id: int, username: str) -> bool:
+    """Создает топик и пользователя. Возвращает False, если диалог уже есть."""
+    if await db.get_user(user_id):
+        return False
+
+    thread_id = await topic_pool.assign(bot, name=f"Диалог с {username}")
+    try:
+        await db.create_user(user_id=user_id, username=username, thread_id=thread_id)
+    except Exception:
+        # Топик ни за кем не закреплен - отдаем его следующему /start
+        await topic_pool.release(thread_id)
+        raise
+    return True
+
+
+@track_handler
 async def start_command(update: Update, context: CallbackContext):
     user = update.effective_user
     user_id = user.id
@@ -13,22 +41,22 @@ async def start_command(update: Update, context: CallbackContext):
     log_extra = {"user_id": user_id}
 
     try:
-        # Проверка существующего пользователя
-        existing_user = await db.get_user(user_id)
-        if existing_user:
+        # Повторный /start, пока создается первый, ждет его, а не создает второй топик
+        task = _starting.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(_start_dialog(context.bot, user_id, username))
+            _starting[user_id] = task
+            task.add_done_callback(lambda _: _starting.pop(user_id, None))
+            created = await asyncio.shield(task)
+        else:
+            await asyncio.shield(task)
+            created = False
+
+        if not created:
             await update.message.reply_text("🚫 У вас уже есть активный диалог!")
             logger.info("Повторный /start", extra=log_extra)
             return
 
-        # Создание топика
-        chat = await context.bot.get_chat(GROUP_CHAT_ID)
-        topic = await chat.create_forum_topic(name=f"Диалог с {username}")
-
-        # Сохранение в базу
-        await db.create_user(
-            user_id=user_id, username=username, thread_id=topic.message_thread_id
-        )
-
         await update.message.reply_text("🎉 Диалог создан! Задавайте вопросы здесь.")
         logger.info("Новый пользователь", extra=log_extra)
 
@@ -0,0 +1,87 @@
+# handlers/stats.py
+from datetime import datetime, timezone
+from typing import Optional
+
+from telegram import Update
+from telegram.ext import CallbackContext, CommandHandler, filters
+from database import db
+from globals.config import GROUP_CHAT_ID, STATS_DAYS
+from loger.logger import logger
+from services.metrics import track_handler
+
+
+def _duration(seconds: Optional[float]) -> str:
+    """Длительность в виде «2 ч 15 мин»."""
+    if seconds is None:
+        return "—"
+    minutes = int(seconds // 60)
+    if minutes < 1:
+        return f"{int(seconds)} с"
+    if minutes < 60:
+        return f"{minutes} мин"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f"{hours} ч {minutes} мин"
+    days, hours = divmod(hours, 24)
+    return f"{days} д {hours} ч"
+
+
+def _average(total, count) -> Optional[float]:
+    return total / count if count else None
+
+
+def _period(title: str, row) -> str:
+    if row is None:
+        return f"{title}: сообщений не было"
+    return (
+        f"{title}: от пользователей {row['user_messages']}, "
+        f"ответов {row['admin_messages']}, диалогов {row['threads']}, "
+        f"первый ответ в среднем за "
+        f"{_duration(_average(row['response_seconds'], row['responses']))}"
+    )
+
+
+def render_stats(stats, now: datetime) -> str:
+    waiting = stats["waiting"]
+    lines = ["📊 Статистика поддержки", ""]
+    if waiting["threads"]:
+        lines.append(
+            f"⏳ Без ответа: {waiting['threads']} (дольше всех ждет "
+            f"{_duration((now - waiting['oldest']).total_seconds())})"
+        )
+    else:
+        lines.append("✅ Все диалоги отвечены")
+
+    # ROLLUP: строка за сегодня (today = true) и итог за период (today = NULL)
+    today = next((row for row in stats["totals"] if row["today"] is True), None)
+    total = next((row for row in stats["totals"] if row["today"] is None), None)
+    lines.append(_period("📅 Сегодня", today))
+    lines.append(_period(f"🗓 За {STATS_DAYS} дн.", total))
+
+    if stats["admins"]:
+        lines.extend(["", f"👮 Администраторы за {STATS_DAYS} дн.:"])
+        for row in stats["admins"]:
+            lines.append(
+                f"• {row['admin_id']}: ответов {row['replies']}, первый ответ за "
+                f"{_duration(_average(row['response_seconds'], row['responses']))}"
+            )
+    return "\n".join(lines)
+
+
+@track_handler
+async def stats_command(update: Update, context: CallbackContext):
+    """Обработчик команды /stats в группе поддержки"""
+    try:
+        stats = await db.support_stats(STATS_DAYS)
+        await update.message.reply_text(render_stats(stats, datetime.now(timezone.utc)))
+    except Exception as e:
+        logger.error(f"Ошибка статистики: {str(e)}", exc_info=True)
+        await update.message.reply_text("❌ Не удалось получить статистику")
+
+
+def register_stats_handler(application):
+    """Регистрация /stats (только в группе поддержки)"""
+    application.add_handler(
+        CommandHandler("stats", stats_command, filters=filters.Chat(GROUP_CHAT_ID))
+    )
+    logger.info("Обработчик /stats зарегистрирован")
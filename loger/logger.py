@@ -1,59 +1,194 @@
+import atexit
+import gzip
+import json
 import logging
-from pathlib import Path
+import logging.handlers
+import os
+import queue
+import shutil
 import sys
-import io
+import time
+from pathlib import Path
+from globals.config import (
+    LOG_BACKUP_COUNT,
+    LOG_DIR,
+    LOG_FORMAT,
+    LOG_LIBRARY_LEVEL,
+    LOG_LIBRARY_RATE,
+    LOG_MAX_BYTES,
+    LOG_ROTATE_WHEN,
+)
 
-# Принудительная настройка кодировки системы
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+# Принудительная настройка кодировки системы (без повторной обертки потока)
+if hasattr(sys.stdout, "reconfigure"):
+    sys.stdout.reconfigure(encoding="utf-8")
 
 # Создание директорий
-Path("logs").mkdir(exist_ok=True)
+Path(LOG_DIR).mkdir(exist_ok=True)
+
+# Стандартные атрибуты LogRecord: все остальное пришло через extra=...
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def _extra(record: logging.LogRecord) -> dict:
+    return {k: v for k, v in record.__dict__.items() if k not in _RECORD_ATTRS}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON, поля extra выводятся на верхнем уровне"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **_extra(record),
+        }
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Текстовый формат, поля extra дописываются в конец строки"""
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        line = super().formatMessage(record)
+        extra = _extra(record)
+        if extra:
+            line += " | " + " ".join(f"{k}={v}" for k, v in extra.items())
+        return line
+
+
+class RateLimitFilter(logging.Filter):
+    """Пропускает не более rate записей в секунду от каждого логгера.
+
+    О пропущенных записях сообщает одной строкой при следующей пропущенной.
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+        self._windows = {}  # имя логгера -> [начало окна, записей, пропущено]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate <= 0:
+            return True
+        now = time.monotonic()
+        window = self._windows.get(record.name)
+        if window is None or now - window[0] >= 1:
+            dropped = window[2] if window else 0
+            self._windows[record.name] = [now, 1, 0]
+            if dropped:
+                record.msg = f"[пропущено {dropped} записей] {record.msg}"
+            return True
+        if window[1] < self.rate:
+            window[1] += 1
+            return True
+        window[2] += 1
+        return False
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Готовит запись к передаче в поток записи, не теряя extra и трассировку"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+def _gzip_namer(name: str) -> str:
+    return name + ".gz"
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def _file_handler(filename: str, level: int) -> logging.Handler:
+    """Файловый обработчик с ротацией по размеру или времени и сжатием архивов.
+
+    Файл открывается при первой записи, а не при импорте модуля.
+    """
+    path = os.path.join(LOG_DIR, filename)
+    if LOG_ROTATE_WHEN:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            path,
+            when=LOG_ROTATE_WHEN,
+            backupCount=LOG_BACKUP_COUNT,
+            encoding="utf-8",
+            delay=True,
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            path,
+            maxBytes=LOG_MAX_BYTES,
+            backupCount=LOG_BACKUP_COUNT,
+            encoding="utf-8",
+            delay=True,
+        )
+    handler.namer = _gzip_namer
+    handler.rotator = _gzip_rotator
+    handler.setLevel(level)
+    handler.setFormatter(file_formatter)
+    return handler
 
 
 # Основной логгер
 logger = logging.getLogger("Bot")
 logger.setLevel(logging.DEBUG)
 
-# Форматтер с UTF-8
-formatter = logging.Formatter(
-    "%(asctime)s - %(name)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
+# Форматтеры с UTF-8
+DATEFMT = "%Y-%m-%d %H:%M:%S"
+formatter = TextFormatter(
+    "%(asctime)s - %(name)s - %(levelname)s - %(message)s", datefmt=DATEFMT
 )
+file_formatter = JsonFormatter(datefmt=DATEFMT) if LOG_FORMAT == "json" else formatter
 
-# Обработчики с UTF-8
-debug_handler = logging.FileHandler("logs/debug.log", encoding="utf-8")
-debug_handler.setLevel(logging.DEBUG)
-debug_handler.setFormatter(formatter)
-
-info_handler = logging.FileHandler("logs/info.log", encoding="utf-8")
-info_handler.setLevel(logging.INFO)
-info_handler.setFormatter(formatter)
+# Обработчики с UTF-8 - работают в отдельном потоке QueueListener
+debug_handler = _file_handler("debug.log", logging.DEBUG)
+info_handler = _file_handler("info.log", logging.INFO)
 
 console_handler = logging.StreamHandler(sys.stdout)
 console_handler.setLevel(logging.INFO)
 console_handler.setFormatter(formatter)
 
+# Цикл событий только кладет запись в очередь, весь ввод-вывод - в потоке
+log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+library_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+listeners = [
+    logging.handlers.QueueListener(
+        log_queue,
+        debug_handler,
+        info_handler,
+        console_handler,
+        respect_handler_level=True,
+    ),
+    # Библиотеки пишут только в debug.log
+    logging.handlers.QueueListener(
+        library_queue, debug_handler, respect_handler_level=True
+    ),
+]
+for listener in listeners:
+    listener.start()
+    atexit.register(listener.stop)
+
 # Добавление обработчиков
-logger.addHandler(debug_handler)
-logger.addHandler(info_handler)
-logger.addHandler(console_handler)
-
-# Настройка библиотек
-for lib in [
-    "telegram",
-    "telegram.ext",
-    "telegram.bot",
-    "httpcore",
-    "httpx",
-    "httpcore.http11",
-    "httpcore.connection",
-]:
+logger.addHandler(_QueueHandler(log_queue))
+
+# Настройка библиотек: не чаще LOG_LIBRARY_RATE записей в секунду от логгера
+library_handler = _QueueHandler(library_queue)
+library_handler.addFilter(RateLimitFilter(LOG_LIBRARY_RATE))
+for lib in ["telegram", "httpcore", "httpx"]:
     lib_logger = logging.getLogger(lib)
-    lib_logger.setLevel(logging.DEBUG)
-    lib_logger.addHandler(debug_handler)
+    lib_logger.setLevel(LOG_LIBRARY_LEVEL)
+    lib_logger.addHandler(library_handler)
     lib_logger.propagate = False
-
-handlers = [
-    logging.FileHandler("logs/debug.log", encoding="utf-8"),
-    logging.FileHandler("logs/info.log", encoding="utf-8"),
-    logging.StreamHandler(sys.stdout),
-]
@@ -1,76 +1,392 @@
 # main.py
-from telegram.ext import ApplicationBuilder, MessageHandler, filters
-from globals.config import TOKEN
-from handlers.start import register_start_handler
+from services.startup import startup  # первым: отсчет времени запуска
+from telegram.ext import ApplicationBuilder, MessageHandler, PersistenceInput, filters
+from telegram.request import HTTPXRequest
+from globals.config import (
+    BOT_MODE,
+    DB_SNAPSHOT_INTERVAL,
+    METRICS_LISTEN,
+    METRICS_PORT,
+    PARTITION_MAINTENANCE_INTERVAL,
+    PERSISTENCE_INTERVAL,
+    RATE_LIMIT_GROUP,
+    RATE_LIMIT_MAX_RETRIES,
+    RATE_LIMIT_OVERALL,
+    RATE_LIMIT_PRIVATE,
+    SHUTDOWN_TIMEOUT,
+    TOKEN,
+    UPDATE_CONCURRENCY,
+    UPDATE_OFFSET_INTERVAL,
+    UPDATE_QUEUE_SIZE,
+    USER_CACHE_WARMUP,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+)
+from handlers.start import register_start_handler, topic_pool
 from handlers.rules import register_rules_handler
 from handlers.replies import register_replies_handler
-from handlers.messages import new_message_handler
+from handlers.search import register_search_handler
+from handlers.stats import register_stats_handler
+from handlers.messages import media_groups, new_message_handler
 from handlers.unknown import register_unknown_handler
 from loger.logger import logger
 from database import db
+from services.metrics import (
+    DB_AVAILABLE,
+    DB_DEFERRED,
+    DB_POOL_CONNECTIONS,
+    DB_POOL_WAITING,
+    DB_WRITE_BUFFER,
+    MEDIA_GROUPS_PENDING,
+    SEND_QUEUE,
+    TOPIC_POOL,
+    UPDATES,
+    UPDATES_PENDING,
+    MetricsServer,
+    registry,
+)
+from services.outbox import outbox
+from services.persistence import PostgresPersistence
+from services.polling import poller, update_ledger
+from services.rate_limiter import SendScheduler
+from services.shutdown import MIN_STEP, ShutdownDrain
+from services.update_processor import OrderedUpdateProcessor
 import asyncio
+import certifi
+import contextlib
+import signal
+import ssl
 import sys
 
 
+def updates_idle(application) -> bool:
+    """Полученные обновления разобраны, обработчики завершились."""
+    stats = application.update_processor.stats()
+    return application.update_queue.empty() and not (
+        stats["running"] or stats["queued"] or stats["backlog"]
+    )
+
+
+def updates_left(application) -> int:
+    stats = application.update_processor.stats()
+    return (
+        application.update_queue.qsize()
+        + stats["running"]
+        + stats["queued"]
+        + stats["backlog"]
+    )
+
+
+def db_pending() -> int:
+    """Строки, еще не записанные в БД: буферы и отложенные записи."""
+    buffered = sum(stats["pending"] for stats in db.write_stats().values())
+    return buffered + db.resilience_stats()["pending"]
+
+
 async def shutdown():
-    """Корректное завершение работы"""
+    """Плавное завершение работы.
+
+    Прием обновлений прекращается, полученные дорабатываются, собираемые
+    альбомы уходят без ожидания паузы, затем дожидаемся отправки и записи
+    в БД - все в пределах SHUTDOWN_TIMEOUT. Неотправленное остается в
+    outbox и уйдет после запуска; в отчете видно, что брошено.
+    """
     logger.info("🛑 Завершение работы...")
+    drain = ShutdownDrain(SHUTDOWN_TIMEOUT)
+
+    # 1. Новые обновления больше не принимаем
+    if poller.running:
+        await drain.step("poller", poller.stop(), MIN_STEP)
+    if application and application.updater and application.updater.running:
+        await drain.step("updater", application.updater.stop(), MIN_STEP)
+
+    if application and application.running:
+        # 2. Дорабатываем полученные обновления
+        processed = application.update_processor.stats()["processed"]
+        await drain.wait("updates", lambda: updates_idle(application))
+        drain.count(
+            "updates",
+            flushed=application.update_processor.stats()["processed"] - processed,
+            abandoned=updates_left(application),
+        )
+
+        # 3. Альбомы в сборке ставим в очередь, не дожидаясь паузы
+        flushed = await drain.step("albums", media_groups.flush(application))
+        drain.count(
+            "albums",
+            flushed=flushed or 0,
+            abandoned=len(media_groups.groups(application.bot_data)),
+        )
+
+    # 4. Дожидаемся отправки всего, что можно отправить сейчас
+    sent = outbox.stats()["sent"]
+    await drain.wait("outbox", outbox.drained)
+    await drain.step("outbox_stop", outbox.stop(timeout=drain.remaining()), MIN_STEP)
+    stats = outbox.stats()
+    # Неотправленное не теряется: строки остаются в outbox до следующего запуска
+    drain.count("sent", flushed=stats["sent"] - sent, abandoned=stats["pending"])
+
+    # 5. Задачи по расписанию, затем последняя запись bot_data (stop() ее
+    # не делает - persistence сбрасывается только в shutdown()) и закрытие
+    # HTTP-клиентов бота. Пул БД еще открыт: persistence пишет через него
+    if application and application.running:
+        await drain.step("application", application.stop(), MIN_STEP)
+    if application and not application.running:
+        await drain.step("application_shutdown", application.shutdown(), MIN_STEP)
+
+    # 6. Смещение обновлений, буферы записи и отложенные записи, затем пул
+    if db.pool is not None:
+        if BOT_MODE == "polling":
+            await drain.step("offset", update_ledger.save(), MIN_STEP)
+        pending = db_pending()
+        await drain.step("db_flush", db.flush(), MIN_STEP)
+        await drain.step("db_close", db.close(), MIN_STEP)
+        left = db_pending()
+        drain.count("db_rows", flushed=pending - left, abandoned=left)
+
+    drain.report()
+    if metrics_server:
+        await metrics_server.stop()
+    logger.info("🛑 Бот остановлен")
+
+
+def http_requests():
+    """HTTP-клиенты бота (запросы и getUpdates) с общим SSL-контекстом.
+
+    По умолчанию каждый клиент заново загружает корневые сертификаты,
+    что заметно удлиняет запуск.
+    """
+    ssl_context = ssl.create_default_context(cafile=certifi.where())
+    return (
+        HTTPXRequest(connection_pool_size=256, httpx_kwargs={"verify": ssl_context}),
+        HTTPXRequest(connection_pool_size=1, httpx_kwargs={"verify": ssl_context}),
+    )
+
+
+async def partition_maintenance(context):
+    """Плановое обслуживание секций таблиц сообщений"""
     try:
-        if hasattr(application, "updater") and application.updater.running:
-            await application.updater.stop()
+        result = await db.maintain_partitions()
     except Exception as e:
-        logger.error(f"Ошибка при остановке Updater: {str(e)}")
+        logger.error(f"Ошибка обслуживания секций: {e}")
+        return
+    for action, names in result.items():
+        if names:
+            logger.info(f"🗂 Секции ({action}): {', '.join(names)}")
 
+
+async def save_update_offset(context):
+    """Сохранение смещения обновлений: после перезапуска polling продолжит с него"""
     try:
-        if application:
-            await application.stop()
+        await update_ledger.save()
     except Exception as e:
-        logger.error(f"Ошибка при остановке Application: {str(e)}")
+        logger.warning(f"Смещение обновлений не сохранено: {e}")
+
 
+async def refresh_user_snapshot(context):
+    """Обновление снимка пользователей для работы без БД"""
     try:
-        # Предполагаем, что db имеет метод is_connected() или атрибут
-        if await db.is_connected():
-            await db.close()
-            logger.info("🛑 Бот остановлен")
+        count = await db.refresh_snapshot()
     except Exception as e:
-        logger.error(f"Ошибка закрытия БД: {str(e)}")
+        logger.warning(f"Снимок пользователей не обновлен: {e}")
+        return
+    logger.debug(f"Снимок пользователей обновлен: {count}")
+
+
+def build_application(requests=None):
+    """Создает Application и регистрирует обработчики.
+
+    requests - пара (request, get_updates_request) вместо HTTP-клиентов по умолчанию,
+    например заглушка Bot API в benchmarks.
+    """
+    request, get_updates_request = requests or http_requests()
+    application = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .request(request)
+        .get_updates_request(get_updates_request)
+        .concurrent_updates(
+            OrderedUpdateProcessor(
+                UPDATE_CONCURRENCY,
+                UPDATE_QUEUE_SIZE,
+                # В polling обработанное обновление сдвигает смещение getUpdates
+                on_processed=update_ledger.finish if BOT_MODE == "polling" else None,
+            )
+        )
+        # bot_data (альбомы в сборке) переживает перезапуск
+        .persistence(
+            PostgresPersistence(
+                db,
+                store_data=PersistenceInput(
+                    bot_data=True, chat_data=False, user_data=False, callback_data=False
+                ),
+                update_interval=PERSISTENCE_INTERVAL,
+            )
+        )
+        # Все исходящие запросы бота идут через общий планировщик отправки
+        .rate_limiter(
+            SendScheduler(
+                overall_per_second=RATE_LIMIT_OVERALL,
+                group_per_minute=RATE_LIMIT_GROUP,
+                private_per_second=RATE_LIMIT_PRIVATE,
+                max_retries=RATE_LIMIT_MAX_RETRIES,
+            )
+        )
+        .build()
+    )
+
+    # Регистрация обработчиков
+    register_start_handler(application)
+    register_rules_handler(application)
+    # Раньше ответов: команда в топике тоже считается ответом
+    register_search_handler(application)
+    register_stats_handler(application)
+    register_replies_handler(application)
+    application.add_handler(
+        MessageHandler(
+            filters.ChatType.PRIVATE & ~filters.COMMAND,
+            new_message_handler,
+        )
+    )
+    register_unknown_handler(application)
+
+    # Периодическая очистка застрявших альбомов
+    media_groups.start_sweeper(application.job_queue, interval=30)
+    # Фоновое пополнение запаса топиков для /start
+    topic_pool.start(application.job_queue)
+    # Будущие секции и срок хранения bot_messages / message_map
+    application.job_queue.run_repeating(
+        partition_maintenance,
+        interval=PARTITION_MAINTENANCE_INTERVAL,
+        first=60,
+        name="partition_maintenance",
+    )
+    if BOT_MODE == "polling":
+        application.job_queue.run_repeating(
+            save_update_offset,
+            interval=UPDATE_OFFSET_INTERVAL,
+            first=UPDATE_OFFSET_INTERVAL,
+            name="update_offset",
+        )
+    # Снимок пользователей: /start и пересылка продолжают работать без БД
+    if DB_SNAPSHOT_INTERVAL > 0:
+        application.job_queue.run_repeating(
+            refresh_user_snapshot,
+            interval=DB_SNAPSHOT_INTERVAL,
+            first=1,
+            name="user_snapshot",
+        )
+    return application
+
+
+def collect_metrics(application):
+    """Обновляет датчики состояния перед выдачей метрик"""
+    pool = db.pool_stats()
+    for state in ("in_use", "idle", "size"):
+        DB_POOL_CONNECTIONS.set(pool[state], state)
+    DB_POOL_WAITING.set(pool["waiting"])
+    for table, stats in db.write_stats().items():
+        DB_WRITE_BUFFER.set(stats["pending"], table)
+    resilience = db.resilience_stats()
+    DB_AVAILABLE.set(0 if resilience["open"] else 1)
+    DB_DEFERRED.set(resilience["pending"])
+    MEDIA_GROUPS_PENDING.set(len(media_groups.groups(application.bot_data)))
+    updates = application.update_processor.stats()
+    for state in ("running", "queued", "backlog"):
+        UPDATES.set(updates[state], state)
+    UPDATES_PENDING.set(poller.backlog())
+    SEND_QUEUE.set(application.bot.rate_limiter.stats()["queued"])
+    TOPIC_POOL.set(topic_pool.available)
+
+
+async def start_metrics(application):
+    """Запуск HTTP-точки /metrics (если METRICS_PORT не 0)"""
+    if not METRICS_PORT:
+        return None
+    registry.on_collect(lambda: collect_metrics(application))
+    server = MetricsServer(registry, METRICS_LISTEN, METRICS_PORT)
+    try:
+        await server.start()
+    except OSError as e:
+        # Занятый порт не должен мешать работе бота
+        logger.error(f"Не удалось запустить сервер метрик: {e}")
+        return None
+    return server
+
+
+async def start_updates(application):
+    """Запуск получения обновлений: long polling или webhook"""
+    if not application.updater:
+        return
+
+    if BOT_MODE == "webhook":
+        # Telegram сам доставляет обновления, секрет проверяется в заголовке запроса
+        await application.updater.start_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            # Накопившиеся за время простоя обновления Telegram доставит сам
+            drop_pending_updates=False,
+        )
+        logger.info(f"🌐 Webhook слушает {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}")
+    else:
+        # Свой опрос вместо Updater: продолжает с сохраненного смещения
+        await poller.start(application)
 
 
 async def main():
-    global application
+    global application, metrics_server
     application = None
+    metrics_server = None
+
+    # Без обработчика SIGTERM процесс завершается сразу, минуя shutdown()
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        with contextlib.suppress(NotImplementedError):
+            loop.add_signal_handler(signum, stopping.set)
 
     try:
-        # Инициализация БД (убедитесь, что внутри методов нет логов)
-        await db.connect()
-        logger.info("✅ База данных подключена")
-        await db.create_tables()
-        logger.info("✅ Таблицы созданы")
-
-        application = ApplicationBuilder().token(TOKEN).build()
-
-        # Регистрация обработчиков
-        register_start_handler(application)
-        register_rules_handler(application)
-        register_replies_handler(application)
-        application.add_handler(
-            MessageHandler(
-                filters.ChatType.PRIVATE & ~filters.COMMAND,
-                new_message_handler,
-            )
+        startup.mark("imports")
+        application = startup.timed_sync("build", build_application)
+        startup.watch_first_update(application)
+
+        # БД и Application.initialize() (getMe, загрузка состояния) идут параллельно:
+        # persistence сам дождется готовности БД
+        results = await asyncio.gather(
+            startup.timed("db", db.connect()),
+            startup.timed("initialize", application.initialize()),
+            return_exceptions=True,
         )
-        register_unknown_handler(application)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        logger.info("✅ База данных подключена")
+
+        if BOT_MODE == "polling":
+            offset = await startup.timed("offset", update_ledger.load())
+            logger.info(f"📍 Смещение обновлений: {offset}")
+
+        if USER_CACHE_WARMUP:
+            warmed = await startup.timed("warmup", db.warm_user_cache(USER_CACHE_WARMUP))
+            logger.info(f"🔥 Кеш пользователей прогрет: {warmed} записей")
 
         logger.info("🚀 Бот запущен")
 
-        # Запуск polling
-        await application.initialize()
-        await application.start()
-        if application.updater:
-            await application.updater.start_polling(drop_pending_updates=True)
+        await startup.timed("start", application.start())
+        media_groups.resume(application)
+        outbox.start(application)
+        metrics_server = await startup.timed("metrics", start_metrics(application))
+        await startup.timed("updates", start_updates(application))
+        startup.report()
 
-        # Ожидание бесконечно (прерывается Ctrl+C)
-        await asyncio.Event().wait()
+        # Ожидание до SIGTERM (остановка контейнера) или Ctrl+C
+        await stopping.wait()
 
     except (asyncio.CancelledError, KeyboardInterrupt):
         pass
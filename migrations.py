@@ -0,0 +1,490 @@
+# migrations.py
+import asyncio
+from typing import List, Tuple
+
+import asyncpg
+
+from loger.logger import logger
+
+# Ключ advisory-блокировки: миграции применяет только один процесс
+MIGRATION_LOCK_ID = 7_310_001
+
+# (версия, описание, SQL). Миграции только добавляются в конец списка
+MIGRATIONS: List[Tuple[int, str, str]] = [
+    (
+        1,
+        "Базовая схема",
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            username TEXT,
+            thread_id INT UNIQUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS message_map (
+            group_message_id INT,
+            user_message_id INT,
+            user_id BIGINT REFERENCES users(user_id),
+            PRIMARY KEY (group_message_id, user_id)
+        );
+
+        CREATE TABLE IF NOT EXISTS bot_messages (
+            message_id INT PRIMARY KEY,
+            user_id BIGINT REFERENCES users(user_id),
+            thread_id INT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS media_groups (
+            media_group_id TEXT PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+
+        CREATE TABLE IF NOT EXISTS messages (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            message_type VARCHAR(50) NOT NULL,
+            content TEXT,
+            file_id VARCHAR(255),
+            created_at TIMESTAMP DEFAULT NOW()
+        );
+        """,
+    ),
+    (
+        2,
+        "BIGINT для идентификаторов сообщений и TIMESTAMPTZ",
+        """
+        ALTER TABLE users
+            ALTER COLUMN thread_id TYPE BIGINT,
+            ALTER COLUMN created_at TYPE TIMESTAMPTZ;
+
+        ALTER TABLE message_map
+            ALTER COLUMN group_message_id TYPE BIGINT,
+            ALTER COLUMN user_message_id TYPE BIGINT;
+
+        ALTER TABLE bot_messages
+            ALTER COLUMN message_id TYPE BIGINT,
+            ALTER COLUMN thread_id TYPE BIGINT,
+            ALTER COLUMN created_at TYPE TIMESTAMPTZ;
+
+        ALTER TABLE media_groups ALTER COLUMN created_at TYPE TIMESTAMPTZ;
+
+        ALTER TABLE messages
+            ALTER COLUMN id TYPE BIGINT,
+            ALTER COLUMN created_at TYPE TIMESTAMPTZ;
+        """,
+    ),
+    (
+        3,
+        "Индексы для частых запросов",
+        """
+        -- JOIN в get_user_by_bot_message и выборки по пользователю
+        CREATE INDEX IF NOT EXISTS bot_messages_user_id_idx
+            ON bot_messages (user_id);
+
+        -- Поиск связи по личному сообщению пользователя
+        CREATE INDEX IF NOT EXISTS message_map_user_message_idx
+            ON message_map (user_id, user_message_id);
+
+        -- Выборки по времени: таблицы пишутся только в конец, BRIN компактнее B-tree
+        CREATE INDEX IF NOT EXISTS bot_messages_created_at_idx
+            ON bot_messages USING BRIN (created_at);
+        CREATE INDEX IF NOT EXISTS messages_created_at_idx
+            ON messages USING BRIN (created_at);
+        CREATE INDEX IF NOT EXISTS media_groups_created_at_idx
+            ON media_groups USING BRIN (created_at);
+        """,
+    ),
+    (
+        4,
+        "Хранилище состояния PTB",
+        """
+        CREATE TABLE IF NOT EXISTS ptb_persistence (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value BYTEA NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (kind, key)
+        );
+        """,
+    ),
+    (
+        5,
+        "Секционирование bot_messages и message_map по месяцам",
+        """
+        -- Прежние таблицы уступают имена секционированным
+        ALTER TABLE bot_messages RENAME TO bot_messages_legacy;
+        ALTER INDEX bot_messages_pkey RENAME TO bot_messages_legacy_pkey;
+        DROP INDEX IF EXISTS bot_messages_user_id_idx;
+        DROP INDEX IF EXISTS bot_messages_created_at_idx;
+
+        ALTER TABLE message_map RENAME TO message_map_legacy;
+        ALTER INDEX message_map_pkey RENAME TO message_map_legacy_pkey;
+        DROP INDEX IF EXISTS message_map_user_message_idx;
+
+        -- Ключ секционирования обязан входить в первичный ключ
+        CREATE TABLE bot_messages (
+            message_id BIGINT NOT NULL,
+            user_id BIGINT REFERENCES users(user_id),
+            thread_id BIGINT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (message_id, created_at)
+        ) PARTITION BY RANGE (created_at);
+
+        CREATE TABLE message_map (
+            group_message_id BIGINT NOT NULL,
+            user_message_id BIGINT,
+            user_id BIGINT NOT NULL REFERENCES users(user_id),
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (group_message_id, user_id, created_at)
+        ) PARTITION BY RANGE (created_at);
+
+        -- Секции по месяцам: текущий и months_ahead вперед (вызывается и из partitions.py)
+        CREATE OR REPLACE FUNCTION ensure_month_partitions(parent TEXT, months_ahead INT)
+        RETURNS INT LANGUAGE plpgsql AS $fn$
+        DECLARE
+            month_start TIMESTAMPTZ := date_trunc('month', now());
+            partition_name TEXT;
+            created INT := 0;
+        BEGIN
+            FOR i IN 0..months_ahead LOOP
+                partition_name := format(
+                    '%s_p%s', parent, to_char(month_start + make_interval(months => i), 'YYYYMM')
+                );
+                IF to_regclass(partition_name) IS NULL THEN
+                    EXECUTE format(
+                        'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                        partition_name,
+                        parent,
+                        month_start + make_interval(months => i),
+                        month_start + make_interval(months => i + 1)
+                    );
+                    created := created + 1;
+                END IF;
+            END LOOP;
+            RETURN created;
+        END
+        $fn$;
+
+        -- Вся прежняя история - в одну секцию до начала текущего месяца
+        DO $$
+        DECLARE
+            parent TEXT;
+        BEGIN
+            FOREACH parent IN ARRAY ARRAY['bot_messages', 'message_map'] LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (MINVALUE) TO (%L)',
+                    parent || '_p_legacy',
+                    parent,
+                    date_trunc('month', now())
+                );
+                PERFORM ensure_month_partitions(parent, 3);
+            END LOOP;
+        END
+        $$;
+
+        INSERT INTO bot_messages (message_id, user_id, thread_id, created_at)
+        SELECT message_id, user_id, thread_id, COALESCE(created_at, now())
+        FROM bot_messages_legacy;
+
+        -- У message_map не было времени: берем его у связанного сообщения бота
+        INSERT INTO message_map (group_message_id, user_message_id, user_id, created_at)
+        SELECT mm.group_message_id, mm.user_message_id, mm.user_id,
+               COALESCE(bg.created_at, bu.created_at, now())
+        FROM message_map_legacy mm
+        LEFT JOIN bot_messages_legacy bg ON bg.message_id = mm.group_message_id
+        LEFT JOIN bot_messages_legacy bu ON bu.message_id = mm.user_message_id;
+
+        DROP TABLE message_map_legacy;
+        DROP TABLE bot_messages_legacy;
+
+        -- Индексы создаются на каждой секции, в том числе будущих
+        CREATE INDEX bot_messages_user_id_idx ON bot_messages (user_id, created_at);
+        CREATE INDEX message_map_user_message_idx ON message_map (user_id, user_message_id);
+        """,
+    ),
+    (
+        6,
+        "Запас заранее созданных топиков",
+        """
+        CREATE TABLE IF NOT EXISTS topic_pool (
+            thread_id BIGINT PRIMARY KEY,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """,
+    ),
+    (
+        7,
+        "Общая сборка альбомов для нескольких экземпляров",
+        """
+        ALTER TABLE media_groups
+            ADD COLUMN IF NOT EXISTS user_id BIGINT,
+            ADD COLUMN IF NOT EXISTS thread_id BIGINT,
+            ADD COLUMN IF NOT EXISTS last_seen TIMESTAMPTZ NOT NULL DEFAULT now(),
+            ADD COLUMN IF NOT EXISTS claimed_by TEXT,
+            ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMPTZ,
+            ADD COLUMN IF NOT EXISTS sent_at TIMESTAMPTZ;
+
+        CREATE TABLE IF NOT EXISTS media_group_items (
+            media_group_id TEXT NOT NULL
+                REFERENCES media_groups (media_group_id) ON DELETE CASCADE,
+            message_id BIGINT NOT NULL,
+            media_type TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            caption TEXT,
+            PRIMARY KEY (media_group_id, message_id)
+        );
+
+        -- Неотправленные альбомы ищет периодическая очистка
+        CREATE INDEX IF NOT EXISTS media_groups_pending_idx
+            ON media_groups (last_seen) WHERE sent_at IS NULL;
+        """,
+    ),
+    (
+        8,
+        "Очередь исходящих сообщений (outbox)",
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id BIGSERIAL PRIMARY KEY,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            -- Полоса доставки (диалог): внутри полосы порядок сохраняется
+            lane TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            method TEXT NOT NULL,
+            payload JSONB NOT NULL,
+            effects JSONB NOT NULL DEFAULT '{}',
+            attempts INT NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            locked_until TIMESTAMPTZ,
+            last_error TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            sent_at TIMESTAMPTZ,
+            failed_at TIMESTAMPTZ
+        );
+
+        -- Голова каждой полосы среди неотправленных
+        CREATE INDEX IF NOT EXISTS outbox_queue_idx
+            ON outbox (lane, id) WHERE sent_at IS NULL AND failed_at IS NULL;
+        CREATE INDEX IF NOT EXISTS outbox_created_at_idx
+            ON outbox USING BRIN (created_at);
+        """,
+    ),
+    (
+        9,
+        "Архив переписки с полнотекстовым поиском",
+        """
+        ALTER TABLE messages
+            ALTER COLUMN file_id TYPE TEXT,
+            ADD COLUMN IF NOT EXISTS thread_id BIGINT,
+            -- to_group - от пользователя, to_user - ответ администратора
+            ADD COLUMN IF NOT EXISTS direction TEXT,
+            ADD COLUMN IF NOT EXISTS message_id BIGINT,
+            ADD COLUMN IF NOT EXISTS search TSVECTOR GENERATED ALWAYS AS (
+                to_tsvector('russian', coalesce(content, ''))
+            ) STORED;
+
+        CREATE INDEX IF NOT EXISTS messages_search_idx ON messages USING GIN (search);
+        -- Поиск внутри одного диалога
+        CREATE INDEX IF NOT EXISTS messages_user_id_idx ON messages (user_id, id);
+        CREATE INDEX IF NOT EXISTS messages_thread_id_idx ON messages (thread_id, id);
+        """,
+    ),
+    (
+        10,
+        "Сводная статистика поддержки",
+        """
+        -- Автор ответа администратора (для пересчета статистики по администраторам)
+        ALTER TABLE messages ADD COLUMN IF NOT EXISTS admin_id BIGINT;
+
+        -- Состояние диалога: awaiting_since - первое сообщение пользователя,
+        -- оставшееся без ответа (NULL - ответ дан)
+        CREATE TABLE IF NOT EXISTS thread_stats (
+            thread_id BIGINT PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            awaiting_since TIMESTAMPTZ,
+            last_user_at TIMESTAMPTZ,
+            last_admin_at TIMESTAMPTZ
+        );
+        CREATE INDEX IF NOT EXISTS thread_stats_awaiting_idx
+            ON thread_stats (awaiting_since) WHERE awaiting_since IS NOT NULL;
+
+        -- Сообщения и первые ответы по диалогам за день (UTC)
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day DATE NOT NULL,
+            thread_id BIGINT NOT NULL,
+            user_messages INT NOT NULL DEFAULT 0,
+            admin_messages INT NOT NULL DEFAULT 0,
+            responses INT NOT NULL DEFAULT 0,
+            response_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, thread_id)
+        );
+
+        -- Нагрузка на администраторов за день
+        CREATE TABLE IF NOT EXISTS admin_daily_stats (
+            day DATE NOT NULL,
+            admin_id BIGINT NOT NULL,
+            replies INT NOT NULL DEFAULT 0,
+            responses INT NOT NULL DEFAULT 0,
+            response_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, admin_id)
+        );
+        """,
+    ),
+    (
+        11,
+        "Смещение обновлений и обработанные обновления",
+        """
+        -- Состояние бота: update_offset - update_id, до которого включительно
+        -- все полученные обновления обработаны
+        CREATE TABLE IF NOT EXISTS bot_state (
+            key TEXT PRIMARY KEY,
+            value BIGINT NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+
+        -- Обработанные обновления выше update_offset (обработка идет параллельно,
+        -- и следующие за незавершенным обновлением могут закончиться раньше)
+        CREATE TABLE IF NOT EXISTS processed_updates (
+            update_id BIGINT PRIMARY KEY
+        );
+        """,
+    ),
+    (
+        12,
+        "Уникальность message_id в секциях bot_messages",
+        """
+        -- После миграции 5 ключ bot_messages - (message_id, created_at), и
+        -- повторная запись того же сообщения (повтор после сбоя записи)
+        -- проходит мимо ON CONFLICT DO NOTHING с новым created_at. Уникальный
+        -- индекс без ключа секционирования PostgreSQL не поддерживает, поэтому
+        -- message_id уникален в пределах секции (месяца). Компромисс: повтор,
+        -- попавший в следующий месяц, останется дубликатом. Такие строки
+        -- совпадают по пользователю и топику, а get_user_by_bot_message берет
+        -- одну строку, так что на чтение они не влияют.
+        CREATE OR REPLACE FUNCTION ensure_month_partitions(parent TEXT, months_ahead INT)
+        RETURNS INT LANGUAGE plpgsql AS $fn$
+        DECLARE
+            month_start TIMESTAMPTZ := date_trunc('month', now());
+            partition_name TEXT;
+            created INT := 0;
+        BEGIN
+            FOR i IN 0..months_ahead LOOP
+                partition_name := format(
+                    '%s_p%s', parent, to_char(month_start + make_interval(months => i), 'YYYYMM')
+                );
+                IF to_regclass(partition_name) IS NULL THEN
+                    EXECUTE format(
+                        'CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                        partition_name,
+                        parent,
+                        month_start + make_interval(months => i),
+                        month_start + make_interval(months => i + 1)
+                    );
+                    IF parent = 'bot_messages' THEN
+                        EXECUTE format(
+                            'CREATE UNIQUE INDEX %I ON %I (message_id)',
+                            partition_name || '_message_id_key',
+                            partition_name
+                        );
+                    END IF;
+                    created := created + 1;
+                END IF;
+            END LOOP;
+            RETURN created;
+        END
+        $fn$;
+
+        -- Существующие секции: убираем повторы (остается первая запись) и
+        -- добавляем индекс
+        DO $$
+        DECLARE
+            partition_name TEXT;
+        BEGIN
+            FOR partition_name IN
+                SELECT c.relname
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'bot_messages'::regclass
+            LOOP
+                EXECUTE format(
+                    'DELETE FROM %I a USING %I b '
+                    'WHERE a.message_id = b.message_id AND a.created_at > b.created_at',
+                    partition_name,
+                    partition_name
+                );
+                EXECUTE format(
+                    'CREATE UNIQUE INDEX IF NOT EXISTS %I ON %I (message_id)',
+                    partition_name || '_message_id_key',
+                    partition_name
+                );
+            END LOOP;
+        END
+        $$;
+        """,
+    ),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def current_version(conn) -> int:
+    """Текущая версия схемы (0 - схема еще не создавалась)."""
+    try:
+        return await conn.fetchval("SELECT MAX(version) FROM schema_version") or 0
+    except asyncpg.UndefinedTableError:
+        return 0
+
+
+async def migrate(conn) -> int:
+    """Применяет недостающие миграции. Возвращает количество примененных.
+
+    Если схема актуальна, стоит один запрос к schema_version.
+    """
+    if await current_version(conn) >= LATEST_VERSION:
+        return 0
+
+    await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID)
+    try:
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INT PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+            """
+        )
+        # Перечитываем под блокировкой: другой процесс мог успеть раньше
+        version = await current_version(conn)
+        applied = 0
+        for number, description, sql in MIGRATIONS:
+            if number <= version:
+                continue
+            async with conn.transaction():
+                await conn.execute(sql)
+                await conn.execute(
+                    "INSERT INTO schema_version (version, description) VALUES ($1, $2)",
+                    number,
+                    description,
+                )
+            applied += 1
+            logger.info(f"✅ Миграция {number} применена: {description}")
+        return applied
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
+
+
+async def _main() -> None:
+    from globals.config import DB_CONFIG
+
+    conn = await asyncpg.connect(**DB_CONFIG)
+    try:
+        applied = await migrate(conn)
+        logger.info(f"Схема в версии {LATEST_VERSION}, применено миграций: {applied}")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
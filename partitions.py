@@ -0,0 +1,109 @@
+# partitions.py
+import asyncio
+from typing import Dict, List
+
+import asyncpg
+
+from loger.logger import logger
+
+# Ключ advisory-блокировки: секции обслуживает только один процесс за раз
+MAINTENANCE_LOCK_ID = 7_310_002
+
+# Таблицы, секционированные по месяцам (см. миграцию 5)
+PARTITIONED_TABLES = ("bot_messages", "message_map")
+
+ARCHIVE_SCHEMA = "archive"
+
+
+async def ensure_partitions(conn, months_ahead: int) -> int:
+    """Секции на текущий месяц и months_ahead вперед одним запросом. Возвращает число новых."""
+    calls = " + ".join(
+        f"ensure_month_partitions('{table}', $1)" for table in PARTITIONED_TABLES
+    )
+    return await conn.fetchval(f"SELECT {calls}", months_ahead)
+
+
+async def expired_partitions(conn, table: str, retention_months: int) -> List[str]:
+    """Секции table, целиком лежащие раньше окна хранения."""
+    rows = await conn.fetch(
+        r"""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = $1::text::regclass
+          AND (regexp_match(
+                  pg_get_expr(c.relpartbound, c.oid), 'TO \(''([^'']+)''\)'
+              ))[1]::timestamptz
+              <= date_trunc('month', now()) - make_interval(months => $2)
+        ORDER BY c.relname
+        """,
+        table,
+        retention_months,
+    )
+    return [row["relname"] for row in rows]
+
+
+async def retire_partition(conn, table: str, partition: str, action: str) -> None:
+    """Отсоединяет секцию и переносит ее в схему archive или удаляет."""
+    await conn.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{partition}"')
+    if action == "drop":
+        await conn.execute(f'DROP TABLE "{partition}"')
+    else:
+        await conn.execute(f'CREATE SCHEMA IF NOT EXISTS "{ARCHIVE_SCHEMA}"')
+        await conn.execute(f'ALTER TABLE "{partition}" SET SCHEMA "{ARCHIVE_SCHEMA}"')
+
+
+async def maintain(
+    conn, months_ahead: int, retention_months: int, action: str
+) -> Dict[str, List[str]]:
+    """Создает будущие секции и убирает устаревшие.
+
+    Возвращает {"created": [...таблицы с новыми секциями], action: [...секции]}.
+    Если обслуживание уже идет в другом процессе, ничего не делает.
+    """
+    result: Dict[str, List[str]] = {"created": [], action: []}
+    async with conn.transaction():
+        locked = await conn.fetchval(
+            "SELECT pg_try_advisory_xact_lock($1)", MAINTENANCE_LOCK_ID
+        )
+        if not locked:
+            return result
+
+        # Секции на текущий месяц и months_ahead вперед
+        for table in PARTITIONED_TABLES:
+            if await conn.fetchval(
+                "SELECT ensure_month_partitions($1, $2)", table, months_ahead
+            ):
+                result["created"].append(table)
+
+        if retention_months > 0:
+            for table in PARTITIONED_TABLES:
+                for partition in await expired_partitions(conn, table, retention_months):
+                    await retire_partition(conn, table, partition, action)
+                    result[action].append(partition)
+    return result
+
+
+async def _main() -> None:
+    from globals.config import (
+        DB_CONFIG,
+        MESSAGE_PARTITIONS_AHEAD,
+        MESSAGE_RETENTION_ACTION,
+        MESSAGE_RETENTION_MONTHS,
+    )
+
+    conn = await asyncpg.connect(**DB_CONFIG)
+    try:
+        result = await maintain(
+            conn,
+            MESSAGE_PARTITIONS_AHEAD,
+            MESSAGE_RETENTION_MONTHS,
+            MESSAGE_RETENTION_ACTION,
+        )
+        logger.info(f"Обслуживание секций: {result}")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,116 @@
+# rollups.py
+import asyncio
+from typing import Dict
+
+import asyncpg
+
+from loger.logger import logger
+
+# Ключ advisory-блокировки: сводки пересчитывает только один процесс за раз
+REBUILD_LOCK_ID = 7_310_003
+
+ROLLUP_TABLES = ("thread_stats", "daily_stats", "admin_daily_stats")
+
+# Сообщения архива с номером «ожидания» внутри диалога: ответ администратора
+# закрывает ожидание с тем же номером, следующее сообщение начинает новое
+_EVENTS = """
+    CREATE TEMP TABLE rollup_events ON COMMIT DROP AS
+    SELECT thread_id, user_id, direction, admin_id, created_at,
+           (created_at AT TIME ZONE 'UTC')::date AS day,
+           count(*) FILTER (WHERE direction = 'to_user') OVER (
+               PARTITION BY thread_id ORDER BY created_at, id
+               ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+           ) AS wait
+    FROM messages
+    WHERE thread_id IS NOT NULL;
+
+    CREATE TEMP TABLE rollup_waits ON COMMIT DROP AS
+    SELECT thread_id, wait, min(created_at) FILTER (WHERE direction = 'to_group') AS since
+    FROM rollup_events
+    GROUP BY thread_id, wait;
+
+    CREATE TEMP TABLE rollup_responses ON COMMIT DROP AS
+    SELECT e.thread_id, e.admin_id, e.day,
+           extract(epoch FROM e.created_at - w.since)::float8 AS seconds
+    FROM rollup_events e
+    JOIN rollup_waits w USING (thread_id, wait)
+    WHERE e.direction = 'to_user' AND w.since IS NOT NULL;
+"""
+
+_FILL = """
+    INSERT INTO thread_stats (thread_id, user_id, awaiting_since, last_user_at, last_admin_at)
+    SELECT e.thread_id,
+           max(e.user_id),
+           (SELECT w.since FROM rollup_waits w
+            WHERE w.thread_id = e.thread_id
+            ORDER BY w.wait DESC LIMIT 1),
+           max(e.created_at) FILTER (WHERE e.direction = 'to_group'),
+           max(e.created_at) FILTER (WHERE e.direction = 'to_user')
+    FROM rollup_events e
+    GROUP BY e.thread_id;
+
+    INSERT INTO daily_stats
+        (day, thread_id, user_messages, admin_messages, responses, response_seconds)
+    SELECT e.day, e.thread_id,
+           count(*) FILTER (WHERE e.direction = 'to_group'),
+           count(*) FILTER (WHERE e.direction = 'to_user'),
+           coalesce(r.responses, 0),
+           coalesce(r.seconds, 0)
+    FROM rollup_events e
+    LEFT JOIN (
+        SELECT day, thread_id, count(*) AS responses, sum(seconds) AS seconds
+        FROM rollup_responses GROUP BY day, thread_id
+    ) r USING (day, thread_id)
+    GROUP BY e.day, e.thread_id, r.responses, r.seconds;
+
+    INSERT INTO admin_daily_stats (day, admin_id, replies, responses, response_seconds)
+    SELECT e.day, e.admin_id, count(*), coalesce(r.responses, 0), coalesce(r.seconds, 0)
+    FROM rollup_events e
+    LEFT JOIN (
+        SELECT day, admin_id, count(*) AS responses, sum(seconds) AS seconds
+        FROM rollup_responses GROUP BY day, admin_id
+    ) r USING (day, admin_id)
+    WHERE e.direction = 'to_user' AND e.admin_id IS NOT NULL
+    GROUP BY e.day, e.admin_id, r.responses, r.seconds;
+"""
+
+
+async def rebuild(conn) -> Dict[str, int]:
+    """Пересчитывает сводные таблицы статистики по архиву переписки (messages).
+
+    Все выполняется одной транзакцией: /stats видит либо старые сводки, либо
+    новые. Запись событий работающим ботом на это время ждет блокировки.
+    Возвращает число строк в каждой сводной таблице.
+    """
+    await conn.execute("SELECT pg_advisory_lock($1)", REBUILD_LOCK_ID)
+    try:
+        async with conn.transaction():
+            await conn.execute(
+                f"LOCK TABLE {', '.join(ROLLUP_TABLES)} IN SHARE ROW EXCLUSIVE MODE"
+            )
+            await conn.execute(_EVENTS)
+            # DELETE, а не TRUNCATE: читатели до фиксации видят прежние сводки
+            for table in ROLLUP_TABLES:
+                await conn.execute(f"DELETE FROM {table}")
+            await conn.execute(_FILL)
+            return {
+                table: await conn.fetchval(f"SELECT count(*) FROM {table}")
+                for table in ROLLUP_TABLES
+            }
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", REBUILD_LOCK_ID)
+
+
+async def _main() -> None:
+    from globals.config import DB_CONFIG
+
+    conn = await asyncpg.connect(**DB_CONFIG)
+    try:
+        counts = await rebuild(conn)
+        logger.info(f"📊 Сводная статистика пересчитана: {counts}")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,2 @@
+# services/__init__.py
+# Инфраструктурные компоненты бота: обработка обновлений, отправка, фоновые задачи
@@ -0,0 +1,474 @@
+# services/media_groups.py
+import contextlib
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from telegram import Message
+from telegram.ext import CallbackContext, Job, JobQueue
+
+from handlers.content import classify
+from loger.logger import logger
+
+# Telegram не присылает в альбоме больше 10 элементов
+MAX_ALBUM_SIZE = 10
+
+# Типы медиа, которые могут входить в альбом
+ALBUM_MEDIA_TYPES = ("photo", "video", "document", "audio", "animation")
+
+
+class MediaItem:
+    """Компактная запись одного элемента альбома"""
+
+    __slots__ = ("media_type", "file_id", "caption", "order")
+
+    def __init__(self, media_type: str, file_id: str, caption: Optional[str], order: int):
+        self.media_type = media_type
+        self.file_id = file_id
+        self.caption = caption
+        self.order = order
+
+    @classmethod
+    def from_message(cls, message: Message) -> Optional["MediaItem"]:
+        content = classify(message)
+        if content is None or content.name not in ALBUM_MEDIA_TYPES:
+            return None
+        return cls(
+            content.name, content.file_id(message), message.caption, message.message_id
+        )
+
+
+class MediaGroup:
+    """Собираемый альбом одного пользователя"""
+
+    __slots__ = ("key", "user_id", "thread_id", "items", "created", "last_seen")
+
+    def __init__(self, key: str, user_id: int, thread_id: int):
+        self.key = key
+        self.user_id = user_id
+        self.thread_id = thread_id
+        self.items: List[MediaItem] = []
+        self.created = self.last_seen = time.time()
+
+    @property
+    def caption(self) -> Optional[str]:
+        """Подпись альбома - первая непустая подпись элемента."""
+        return next((item.caption for item in self.sorted_items() if item.caption), None)
+
+    def sorted_items(self) -> List[MediaItem]:
+        return sorted(self.items, key=lambda item: item.order)
+
+
+class MediaGroupAggregator:
+    """Собирает части альбомов и передает альбом на отправку целиком.
+
+    Альбом отправляется сразу, как только набралось 10 элементов, иначе -
+    после паузы без новых элементов. Пауза подстраивается под наблюдаемый
+    интервал между частями альбомов. Собираемые альбомы хранятся в
+    bot_data["media_groups"]; их число ограничено max_pending, а застрявшие
+    альбомы убирает периодическая очистка.
+
+    bot_data сохраняется в хранилище периодически, поэтому обновления с
+    частями альбома придерживаются в ledger (учет polling) до передачи
+    альбома в send: после падения Telegram выдаст их снова.
+    """
+
+    # Во сколько раз пауза больше среднего интервала между частями альбома
+    GAP_FACTOR = 3.0
+    # Вес нового наблюдения в скользящем среднем интервала
+    GAP_SMOOTHING = 0.2
+
+    def __init__(
+        self,
+        send: Callable[[CallbackContext, MediaGroup], Awaitable[None]],
+        min_wait: float,
+        max_wait: float,
+        max_pending: int,
+        max_age: float,
+        ledger=None,
+    ):
+        self.send = send
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.max_pending = max_pending
+        self.max_age = max_age
+        self.ledger = ledger
+        self._gap = max_wait / self.GAP_FACTOR
+        self._jobs: Dict[str, Job] = {}
+        self._stats = {
+            "sent_full": 0,
+            "sent_idle": 0,
+            "evicted": 0,
+            "expired": 0,
+            "flushed": 0,
+        }
+
+    @staticmethod
+    def groups(bot_data: dict) -> Dict[str, MediaGroup]:
+        return bot_data.setdefault("media_groups", {})
+
+    def idle_timeout(self) -> float:
+        return min(self.max_wait, max(self.min_wait, self._gap * self.GAP_FACTOR))
+
+    def stats(self, bot_data: dict) -> Dict[str, float]:
+        return {
+            **self._stats,
+            "pending": len(self.groups(bot_data)),
+            "idle_timeout": self.idle_timeout(),
+        }
+
+    async def add(
+        self,
+        message: Message,
+        context: CallbackContext,
+        user_id: int,
+        thread_id: int,
+        update_id: Optional[int] = None,
+    ) -> None:
+        """Добавляет часть альбома и (пере)планирует его отправку."""
+        item = MediaItem.from_message(message)
+        if item is None:
+            logger.warning(f"Неподдерживаемый элемент медиагруппы {message.media_group_id}")
+            return
+
+        groups = self.groups(context.bot_data)
+        key = f"{user_id}_{message.media_group_id}"
+        group = groups.get(key)
+        now = time.time()
+        if group is None:
+            if len(groups) >= self.max_pending:
+                self._evict_oldest(context)
+            group = groups[key] = MediaGroup(key, user_id, thread_id)
+        elif any(existing.order == item.order for existing in group.items):
+            # Повторная выдача части, уже восстановленной из хранилища
+            return
+        else:
+            gap = now - group.last_seen
+            self._gap += self.GAP_SMOOTHING * (min(gap, self.max_wait) - self._gap)
+        group.last_seen = now
+        group.items.append(item)
+        if self.ledger is not None and update_id is not None:
+            self.ledger.hold(update_id, key)
+
+        if len(group.items) >= MAX_ALBUM_SIZE:
+            self._stats["sent_full"] += 1
+            self.schedule(context.job_queue, key, 0)
+        else:
+            self.schedule(context.job_queue, key, self.idle_timeout())
+
+    def schedule(self, job_queue: JobQueue, key: str, delay: float) -> None:
+        """Планирует отправку альбома через delay секунд, отменяя прежний таймер."""
+        self._cancel(key)
+        self._jobs[key] = job_queue.run_once(self._on_timer, delay, name=key, data=key)
+
+    def _cancel(self, key: str) -> None:
+        job = self._jobs.pop(key, None)
+        if job is not None and not job.removed:
+            # Одноразовая задача, которая уже выполняется, снята планировщиком сама
+            with contextlib.suppress(LookupError):
+                job.schedule_removal()
+
+    async def _on_timer(self, context: CallbackContext) -> None:
+        group = self.pop(context.bot_data, context.job.data)
+        if group is None:
+            return
+        if len(group.items) < MAX_ALBUM_SIZE:
+            self._stats["sent_idle"] += 1
+        await self._send(context, group)
+
+    async def _send(self, context: CallbackContext, group: MediaGroup) -> None:
+        """Передает альбом в send и отпускает обновления с его частями."""
+        try:
+            await self.send(context, group)
+        finally:
+            self._release(group.key)
+
+    def _release(self, key: str) -> None:
+        if self.ledger is not None:
+            self.ledger.release(key)
+
+    def pop(self, bot_data: dict, key: str) -> Optional[MediaGroup]:
+        """Забирает альбом на отправку."""
+        self._cancel(key)
+        return self.groups(bot_data).pop(key, None)
+
+    def _evict_oldest(self, context: CallbackContext) -> None:
+        """При переполнении отправляет самый старый альбом немедленно."""
+        groups = self.groups(context.bot_data)
+        oldest = min(groups.values(), key=lambda group: group.created)
+        self._stats["evicted"] += 1
+        logger.warning(f"Лимит медиагрупп: досрочная отправка {oldest.key}")
+        self.pop(context.bot_data, oldest.key)
+        context.application.create_task(self._send(context, oldest))
+
+    def resume(self, application) -> int:
+        """Планирует отправку альбомов, восстановленных из хранилища после перезапуска."""
+        groups = self.groups(application.bot_data)
+        for key in groups:
+            self.schedule(application.job_queue, key, self.min_wait)
+        if groups:
+            logger.info(f"♻️ Восстановлено медиагрупп в сборке: {len(groups)}")
+        return len(groups)
+
+    async def flush(self, application) -> int:
+        """Отправляет все собираемые альбомы, не дожидаясь паузы (при остановке)."""
+        context = application.context_types.context(application)
+        groups = self.groups(application.bot_data)
+        flushed = 0
+        for key in list(groups):
+            group = self.pop(application.bot_data, key)
+            if group is not None:
+                await self._send(context, group)
+                flushed += 1
+        self._stats["flushed"] += flushed
+        return flushed
+
+    def start_sweeper(self, job_queue: JobQueue, interval: float) -> None:
+        job_queue.run_repeating(self._sweep, interval, name="media_groups_sweeper")
+
+    async def _sweep(self, context: CallbackContext) -> None:
+        """Удаляет застрявшие альбомы и планирует отправку альбомов без таймера."""
+        groups = self.groups(context.bot_data)
+        now = time.time()
+        for key, group in list(groups.items()):
+            if now - group.created > self.max_age:
+                self._stats["expired"] += 1
+                logger.warning(f"Медиагруппа {key} устарела и удалена")
+                self.pop(context.bot_data, key)
+                self._release(key)
+            elif key not in self._jobs:
+                self.schedule(context.job_queue, key, 0)
+
+
+class SharedMediaGroupAggregator(MediaGroupAggregator):
+    """Сборка альбомов в PostgreSQL для нескольких экземпляров бота.
+
+    Части одного альбома могут прийти на разные экземпляры: каждая часть
+    одним запросом пишется в media_group_items и продлевает сборку в
+    media_groups. Каждый экземпляр, получивший часть, ставит свой таймер
+    паузы; по таймеру альбом захватывается UPDATE ... RETURNING, который
+    удается только одному экземпляру и только если ни на один экземпляр
+    не приходили части в течение паузы. Захват рассылается через
+    NOTIFY media_groups, и остальные экземпляры снимают свои таймеры.
+
+    Альбомы остановившихся экземпляров досылает периодическая очистка.
+    Если экземпляр упал между отправкой и отметкой sent_at, альбом
+    будет отправлен повторно после истечения захвата (lease).
+    """
+
+    CHANNEL = "media_groups"
+    # Альбомов, досылаемых за один проход очистки
+    STALE_BATCH = 20
+
+    def __init__(
+        self,
+        send: Callable[[CallbackContext, MediaGroup], Awaitable[None]],
+        database,
+        replica_id: str,
+        min_wait: float,
+        max_wait: float,
+        max_pending: int,
+        max_age: float,
+    ):
+        super().__init__(send, min_wait, max_wait, max_pending, max_age)
+        self._db = database
+        self.replica_id = replica_id
+        # Захват дольше этого срока без отметки sent_at считается брошенным
+        self.lease = max_age / 2
+        # Альбомы с таймером на этом экземпляре: ключ -> время последней части
+        self._pending: Dict[str, float] = {}
+        # Захваченные альбомы (этим или другим экземпляром): ключ -> время захвата.
+        # Таймер, уже сработавший во время захвата, не должен ставиться заново
+        self._claimed: Dict[str, float] = {}
+        # Альбомы, запрос захвата которых выполняется прямо сейчас
+        self._claiming: Set[str] = set()
+        self._listener = None
+        self._stats.update({"claimed_elsewhere": 0, "late": 0, "duplicate": 0, "stale": 0})
+
+    def groups(self, bot_data: dict) -> Dict[str, float]:
+        return self._pending
+
+    async def add(
+        self,
+        message: Message,
+        context: CallbackContext,
+        user_id: int,
+        thread_id: int,
+        update_id: Optional[int] = None,
+    ) -> None:
+        """Пишет часть альбома в общую сборку и (пере)планирует захват.
+
+        Часть записана в БД до завершения обработки, придерживать обновление
+        не нужно.
+        """
+        item = MediaItem.from_message(message)
+        if item is None:
+            logger.warning(f"Неподдерживаемый элемент медиагруппы {message.media_group_id}")
+            return
+
+        base_key = key = f"{user_id}_{message.media_group_id}"
+        # Часть, опоздавшая к захвату альбома, начинает следующее поколение
+        # альбома - как и в локальной сборке, поздние части уходят вместе
+        for generation in range(2, MAX_ALBUM_SIZE + 2):
+            result = await self._store(key, user_id, thread_id, item)
+            if result["accepted"]:
+                break
+            if result["known"]:
+                # Повторная доставка части, альбом уже отправляется
+                self._stats["duplicate"] += 1
+                return
+            self._stats["late"] += 1
+            key = f"{base_key}_{generation}"
+        else:
+            return
+
+        now = time.time()
+        last_seen = self._pending.get(key)
+        if last_seen is not None:
+            gap = now - last_seen
+            self._gap += self.GAP_SMOOTHING * (min(gap, self.max_wait) - self._gap)
+        self._pending[key] = now
+
+        if result["items"] >= MAX_ALBUM_SIZE:
+            self._stats["sent_full"] += 1
+            self.schedule(context.job_queue, key, 0)
+        else:
+            self.schedule(context.job_queue, key, self.idle_timeout())
+
+    async def _store(self, key: str, user_id: int, thread_id: int, item: MediaItem):
+        return await self._db.add_media_group_item(
+            key,
+            user_id,
+            thread_id,
+            item.order,
+            item.media_type,
+            item.file_id,
+            item.caption,
+        )
+
+    def schedule(self, job_queue: JobQueue, key: str, delay: float) -> None:
+        """Планирует захват альбома через delay секунд после паузы той же длины."""
+        self._cancel(key)
+        if key in self._claimed:
+            self._pending.pop(key, None)
+            return
+        self._jobs[key] = job_queue.run_once(
+            self._on_timer, delay, name=key, data=(key, delay)
+        )
+
+    def pop(self, bot_data: dict, key: str) -> None:
+        self._cancel(key)
+        self._pending.pop(key, None)
+
+    def _mark_claimed(self, key: str) -> None:
+        self._claimed[key] = time.time()
+        self.pop({}, key)
+
+    async def _on_timer(self, context: CallbackContext) -> None:
+        key, idle = context.job.data
+        if self._jobs.get(key) is context.job:
+            del self._jobs[key]
+        await self._claim(context, key, idle)
+
+    async def _claim(self, context: CallbackContext, key: str, idle: float) -> bool:
+        """Захватывает альбом после паузы idle и отправляет его. True - отправлен."""
+        if key in self._claimed:
+            return False
+        if key in self._claiming:
+            # Захват этого альбома уже идет - решение примет он
+            self.schedule(context.job_queue, key, idle)
+            return False
+
+        self._claiming.add(key)
+        try:
+            claim = await self._db.claim_media_group(key, self.replica_id, idle, self.lease)
+        except Exception as e:
+            # Альбом дошлет периодическая очистка
+            logger.error(f"Не удалось захватить медиагруппу {key}: {e}")
+            self._pending.pop(key, None)
+            return False
+        finally:
+            self._claiming.discard(key)
+
+        if claim is not None and claim["claimed"]:
+            # Таймер, поставленный частью, пришедшей во время захвата, больше не нужен
+            self._mark_claimed(key)
+            if idle > 0:
+                self._stats["sent_idle"] += 1
+            await self._deliver(context, key, claim["user_id"], claim["thread_id"])
+            return True
+        if claim is not None and claim["wait"] is not None:
+            # Новая часть пришла на другой экземпляр - ждем остаток паузы
+            self.schedule(context.job_queue, key, max(claim["wait"], 0.05))
+            return False
+        # Альбом захватил другой экземпляр
+        self._stats["claimed_elsewhere"] += 1
+        self._mark_claimed(key)
+        return False
+
+    async def _deliver(
+        self, context: CallbackContext, key: str, user_id: int, thread_id: int
+    ) -> None:
+        """Отправляет захваченный альбом и отмечает его отправленным."""
+        group = MediaGroup(key, user_id, thread_id)
+        group.items = [
+            MediaItem(row["media_type"], row["file_id"], row["caption"], row["message_id"])
+            for row in await self._db.get_media_group_items(key)
+        ]
+        await self.send(context, group)
+        await self._db.mark_media_group_sent(key, self.replica_id)
+
+    def _on_notify(self, connection, pid: int, channel: str, key: str) -> None:
+        """Альбом захвачен (возможно, другим экземпляром): свой таймер не нужен."""
+        self._mark_claimed(key)
+
+    def resume(self, application) -> int:
+        """Сборка хранится в БД: недосланные альбомы подберет очистка."""
+        return 0
+
+    async def flush(self, application) -> int:
+        """Захватывает и отправляет альбомы этого экземпляра без ожидания паузы.
+
+        Альбом, часть которого только что пришла на другой экземпляр,
+        остается ему.
+        """
+        context = application.context_types.context(application)
+        flushed = 0
+        for key in list(self._pending):
+            self._cancel(key)
+            if await self._claim(context, key, 0):
+                flushed += 1
+        self._stats["flushed"] += flushed
+        return flushed
+
+    def start_sweeper(self, job_queue: JobQueue, interval: float) -> None:
+        job_queue.run_repeating(
+            self._sweep, interval, first=1, name="media_groups_sweeper"
+        )
+
+    async def _sweep(self, context: CallbackContext) -> None:
+        """Подписка на захваты, досылка брошенных альбомов и удаление старых."""
+        try:
+            if self._listener is None or self._listener.is_closed():
+                self._listener = await self._db.listen(self.CHANNEL, self._on_notify)
+
+            # Альбом без захвата дольше нескольких пауз - его экземпляр остановился
+            for row in await self._db.claim_stale_media_groups(
+                self.replica_id, self.max_wait * 2, self.lease, self.STALE_BATCH
+            ):
+                self._stats["stale"] += 1
+                logger.warning(f"Досылка брошенной медиагруппы {row['media_group_id']}")
+                await self._deliver(
+                    context, row["media_group_id"], row["user_id"], row["thread_id"]
+                )
+
+            horizon = time.time() - self.max_age
+            for key, claimed_at in list(self._claimed.items()):
+                if claimed_at < horizon:
+                    del self._claimed[key]
+
+            sent, expired = await self._db.delete_old_media_groups(self.max_age)
+            if expired:
+                self._stats["expired"] += expired
+                logger.warning(f"Удалено устаревших медиагрупп: {expired}")
+        except Exception as e:
+            logger.error(f"Ошибка очистки медиагрупп: {e}")
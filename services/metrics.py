@@ -0,0 +1,323 @@
+# services/metrics.py
+# Метрики в текстовом формате Prometheus и HTTP-точка /metrics для их сбора
+import asyncio
+import functools
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from loger.logger import logger
+
+# Границы корзин гистограмм задержки, сек
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+Labels = Tuple[str, ...]
+Sample = Tuple[str, Sequence[str], Labels, float]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Общая часть метрик: имя, описание и имена меток."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def samples(self) -> Iterator[Sample]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Монотонно растущий счетчик."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Iterator[Sample]:
+        for labels, value in self._values.items():
+            yield self.name, self.labelnames, labels, value
+
+
+class Gauge(Metric):
+    """Текущее значение; обычно выставляется сборщиком перед выдачей метрик."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def samples(self) -> Iterator[Sample]:
+        for labels, value in self._values.items():
+            yield self.name, self.labelnames, labels, value
+
+
+class Histogram(Metric):
+    """Гистограмма с фиксированными корзинами.
+
+    В горячем пути хранятся только попадания в корзину и сумма,
+    накопительные значения считаются при выдаче метрик.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # Метки -> [попадания по корзинам (+Inf последней), сумма]
+        self._series: Dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self) -> Iterator[Sample]:
+        names = self.labelnames + ("le",)
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", names, labels + (_format_value(bound),), cumulative
+            yield f"{self.name}_count", self.labelnames, labels, cumulative
+            yield f"{self.name}_sum", self.labelnames, labels, total
+
+
+class Registry:
+    """Набор метрик и сборщиков, обновляющих датчики перед выдачей."""
+
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        self._collectors: List[Callable[[], None]] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames))
+
+    def on_collect(self, collector: Callable[[], None]) -> None:
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        """Текст в формате Prometheus (text/plain; version=0.0.4)."""
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.error(f"Ошибка сбора метрик: {e}")
+
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labelnames, labels, value in metric.samples():
+                lines.append(
+                    f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}"
+                )
+        lines.append("")
+        return "\n".join(lines)
+
+
+registry = Registry()
+
+# Обработчики обновлений
+HANDLER_LATENCY = registry.histogram(
+    "bot_handler_duration_seconds", "Время работы обработчика", ["handler"]
+)
+HANDLER_ERRORS = registry.counter(
+    "bot_handler_errors_total", "Необработанные исключения в обработчиках", ["handler"]
+)
+
+# Методы Database и фоновая запись буферов
+DB_LATENCY = registry.histogram(
+    "bot_db_duration_seconds", "Время выполнения методов Database", ["method"]
+)
+DB_ERRORS = registry.counter(
+    "bot_db_errors_total", "Ошибки методов Database", ["method"]
+)
+DB_POOL_CONNECTIONS = registry.gauge(
+    "bot_db_pool_connections", "Соединения пула asyncpg", ["state"]
+)
+DB_POOL_WAITING = registry.gauge(
+    "bot_db_pool_waiting", "Запросы, ожидающие свободное соединение"
+)
+DB_WRITE_BUFFER = registry.gauge(
+    "bot_db_write_buffer_rows", "Строки, ожидающие пакетной записи", ["table"]
+)
+DB_AVAILABLE = registry.gauge(
+    "bot_db_available", "1 - цепь к БД замкнута, 0 - работа без БД"
+)
+DB_DEFERRED = registry.gauge(
+    "bot_db_deferred_writes", "Записи, отложенные до восстановления связи с БД"
+)
+
+# Запросы к Bot API
+API_LATENCY = registry.histogram(
+    "bot_api_duration_seconds", "Время запроса к Bot API", ["method"]
+)
+API_ERRORS = registry.counter(
+    "bot_api_errors_total", "Ошибки запросов к Bot API", ["method", "error"]
+)
+SEND_QUEUE = registry.gauge(
+    "bot_send_queue", "Запросы, ожидающие своей очереди по лимитам Telegram"
+)
+
+# Пересылка сообщений
+FORWARD_ERRORS = registry.counter(
+    "bot_forward_errors_total",
+    "Ошибки пересылки по направлению и типу содержимого",
+    ["direction", "content_type"],
+)
+OUTBOX_RESULTS = registry.counter(
+    "bot_outbox_results_total",
+    "Попытки отправки из outbox: sent, retry, failed",
+    ["kind", "result"],
+)
+OUTBOX_IN_FLIGHT = registry.gauge(
+    "bot_outbox_in_flight", "Сообщения outbox, отправляемые этим экземпляром"
+)
+MEDIA_GROUPS_PENDING = registry.gauge(
+    "bot_media_groups_pending", "Альбомы в сборке"
+)
+TOPIC_POOL = registry.gauge(
+    "bot_topic_pool_available", "Заранее созданные топики в запасе"
+)
+UPDATES = registry.gauge(
+    "bot_updates", "Обновления в обработке", ["state"]
+)
+UPDATES_PENDING = registry.gauge(
+    "bot_updates_pending",
+    "Отставание polling: обновления, ждущие выдачи в Telegram или обработки",
+)
+
+
+def timed(histogram: Histogram, errors: Counter, name: Optional[str] = None):
+    """Декоратор корутины: время выполнения и число исключений по имени."""
+
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                errors.inc(label)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - started, label)
+
+        return wrapper
+
+    return decorator
+
+
+def track_handler(func: Callable[..., Any]) -> Callable[..., Any]:
+    return timed(HANDLER_LATENCY, HANDLER_ERRORS)(func)
+
+
+def track_query(func: Callable[..., Any]) -> Callable[..., Any]:
+    return timed(DB_LATENCY, DB_ERRORS)(func)
+
+
+class MetricsServer:
+    """Минимальный HTTP-сервер в цикле событий бота: GET /metrics."""
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+    READ_TIMEOUT = 5
+
+    def __init__(self, registry: Registry, host: str, port: int):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info(f"📈 Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            request = await asyncio.wait_for(
+                reader.readuntil(b"\r\n\r\n"), self.READ_TIMEOUT
+            )
+            method, path, *_ = request.split(b"\r\n", 1)[0].decode("latin-1").split(" ")
+            if method == "GET" and path.split("?", 1)[0] == "/metrics":
+                status, body = "200 OK", self.registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: {self.CONTENT_TYPE}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (
+            asyncio.TimeoutError,
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            ConnectionError,
+            ValueError,
+        ):
+            # Обрыв соединения или неполный запрос - отвечать некому
+            pass
+        finally:
+            writer.close()
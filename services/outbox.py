@@ -0,0 +1,454 @@
+# services/outbox.py
+import asyncio
+import contextlib
+import json
+import random
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from telegram import (
+    Bot,
+    InputMediaAnimation,
+    InputMediaAudio,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaVideo,
+)
+from telegram.error import BadRequest, Forbidden, RetryAfter
+from telegram.ext import CallbackContext
+
+from database import DatabaseUnavailable, db
+from globals.config import (
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_LEASE,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_POLL_INTERVAL,
+    OUTBOX_RETENTION,
+    OUTBOX_RETRY_BASE,
+    OUTBOX_RETRY_MAX,
+    OUTBOX_WORKERS,
+)
+from loger.logger import logger
+from services.metrics import OUTBOX_IN_FLIGHT, OUTBOX_RESULTS
+
+# Элементы альбома хранятся в payload как {"type": ..., "media": file_id, "caption": ...}
+INPUT_MEDIA = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "document": InputMediaDocument,
+    "audio": InputMediaAudio,
+    "animation": InputMediaAnimation,
+}
+
+# Telegram копирует не больше 100 сообщений за вызов copy_messages
+MAX_COPY_BATCH = 100
+
+# Обработчик окончательной неудачи: (bot, effects, ошибка)
+FailureCallback = Callable[[Bot, Dict[str, Any], Exception], Awaitable[None]]
+
+
+class Outbox:
+    """Надежная очередь исходящих сообщений в PostgreSQL.
+
+    Обработчики ставят отправку в таблицу outbox (метод Bot API и его
+    аргументы в JSON) и сразу возвращаются. Фоновые отправители забирают
+    пачку сообщений, отправляют их и отмечают результат:
+
+    - успех записывается одной командой вместе с последствиями отправки
+      (bot_messages, message_map), поэтому связи появляются только у
+      действительно отправленных сообщений;
+    - RetryAfter и сетевые ошибки откладывают повтор (retry_after или
+      экспоненциальная пауза), после max_attempts попыток - неудача;
+    - BadRequest/Forbidden - сразу неудача, вызывается обработчик,
+      зарегистрированный для вида сообщения (on_failure).
+
+    Если в аргументах есть _fallback ({"method", "kwargs"}), то при
+    BadRequest (например, копирование сообщения запрещено) сообщение
+    отправляется им. Накопившиеся в полосе копии без ответа уходят одним
+    copy_messages (до 100 сообщений за вызов).
+
+    Пока БД недоступна, постановки и отметки об отправке откладываются
+    (Database.defer) и дописываются по порядку после восстановления связи.
+
+    Ключ идемпотентности отсекает повторную постановку того же сообщения
+    (повторная доставка обновления, несколько экземпляров бота). Внутри
+    полосы (диалога) сообщения уходят по порядку и по одному.
+    """
+
+    def __init__(
+        self,
+        database,
+        workers: int,
+        batch_size: int,
+        max_attempts: int,
+        retry_base: float,
+        retry_max: float,
+        lease: float,
+        poll_interval: float,
+        retention: float,
+    ):
+        self._db = database
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._bot: Optional[Bot] = None
+        self._on_failure: Dict[str, FailureCallback] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._in_flight: Set[int] = set()
+        # Поставлено этим экземпляром и еще не завершено
+        self._pending: Set[str] = set()
+        # Из них ждут повтора после ошибки отправки
+        self._retrying: Set[str] = set()
+        self._stats = {
+            "enqueued": 0,
+            "duplicate": 0,
+            "sent": 0,
+            "batched": 0,
+            "deferred": 0,
+            "retried": 0,
+            "failed": 0,
+        }
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            **self._stats,
+            "in_flight": len(self._in_flight),
+            "pending": len(self._pending),
+            "retrying": len(self._retrying),
+        }
+
+    def idle(self) -> bool:
+        """Все поставленные этим экземпляром сообщения завершены."""
+        return not self._pending and not self._in_flight
+
+    def drained(self) -> bool:
+        """Отправлять сейчас нечего: незавершенные сообщения ждут повтора.
+
+        При остановке дальше ждать не нужно - они остаются в outbox.
+        """
+        return not self._in_flight and self._pending <= self._retrying
+
+    def on_failure(self, kind: str, callback: FailureCallback) -> None:
+        """Регистрирует обработчик окончательной неудачи для вида сообщений."""
+        self._on_failure[kind] = callback
+
+    async def enqueue(
+        self,
+        key: str,
+        lane: str,
+        kind: str,
+        method: str,
+        kwargs: Dict[str, Any],
+        effects: Optional[Dict[str, Any]] = None,
+    ) -> bool:
+        """Ставит вызов bot.<method>(**kwargs) в очередь. False - уже поставлен.
+
+        effects - что записать при успехе: user_id, thread_id, direction
+        (to_group / to_user) и sources - сообщения, на которые ссылается
+        отправленное (в порядке элементов альбома).
+        """
+        args = (key, lane, kind, method, json.dumps(kwargs), json.dumps(effects or {}))
+        if self._db.degraded:
+            return self._defer(args)
+        try:
+            inserted = await self._db.enqueue_outbox(*args)
+        except DatabaseUnavailable:
+            return self._defer(args)
+        if inserted:
+            self._stats["enqueued"] += 1
+            self._pending.add(key)
+            self._wakeup.set()
+        else:
+            self._stats["duplicate"] += 1
+        return inserted
+
+    def _defer(self, args: tuple) -> bool:
+        """Без БД постановка откладывается и выполнится после восстановления связи."""
+        key = args[0]
+
+        async def write():
+            if await self._db.enqueue_outbox(*args):
+                self._wakeup.set()
+            else:
+                self._pending.discard(key)
+                self._stats["duplicate"] += 1
+
+        # Переполнение очереди отложенных записей - ошибка для обработчика
+        self._db.defer(f"enqueue_outbox:{key}", write)
+        self._stats["enqueued"] += 1
+        self._stats["deferred"] += 1
+        self._pending.add(key)
+        return True
+
+    def start(self, application) -> None:
+        """Запускает отправителей и периодическую очистку завершенных строк."""
+        self._bot = application.bot
+        self._stopping = False
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"outbox_worker_{n}")
+            for n in range(self.workers)
+        ]
+        application.job_queue.run_repeating(
+            self._cleanup, interval=3600, first=60, name="outbox_cleanup"
+        )
+
+    async def stop(self, timeout: float = 10) -> None:
+        """Останавливает отправителей, давая текущим отправкам завершиться."""
+        self._stopping = True
+        self._wakeup.set()
+        if not self._tasks:
+            return
+        _, running = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in running:
+            task.cancel()
+        # Неотправленное останется в outbox и уйдет после запуска
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self) -> None:
+        while not self._stopping:
+            self._wakeup.clear()
+            rows = []
+            # Без БД и до записи отложенных постановок (порядок в полосах) не выбираем
+            if not self._db.degraded:
+                try:
+                    rows = await self._db.claim_outbox(self.batch_size, self.lease)
+                except DatabaseUnavailable:
+                    pass
+                except Exception as e:
+                    logger.error(f"Ошибка выборки outbox: {e}")
+            if not rows:
+                # Новые сообщения будят отправителя сразу, чужие - через опрос
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                continue
+            runs = await asyncio.gather(*(self._extend(row) for row in rows))
+            await asyncio.gather(*(self._deliver(run) for run in runs))
+
+    @staticmethod
+    def _batchable(row) -> bool:
+        """Копия без ответа: такие подряд идущие сообщения уходят одним copy_messages."""
+        return (
+            row["method"] == "copy_message"
+            and "reply_to_message_id" not in json.loads(row["payload"])
+        )
+
+    async def _extend(self, row) -> list:
+        """Дополняет голову полосы накопившимися за ней копиями (до 100 за вызов)."""
+        if row["queued"] < 2 or not self._batchable(row):
+            return [row]
+        try:
+            followers = await self._db.claim_outbox_run(
+                row["lane"], row["id"], MAX_COPY_BATCH - 1, self.lease
+            )
+        except Exception as e:
+            logger.error(f"Ошибка выборки серии outbox: {e}")
+            return [row]
+        run = [row]
+        last_message_id = json.loads(row["payload"])["message_id"]
+        for follower in sorted(followers, key=lambda r: r["id"]):
+            # copy_messages требует строго возрастающих идентификаторов
+            message_id = json.loads(follower["payload"])["message_id"]
+            if message_id <= last_message_id:
+                break
+            run.append(follower)
+            last_message_id = message_id
+        # Не вошедшие в серию сразу возвращаются в очередь
+        in_run = {r["id"] for r in run}
+        await self._release([f for f in followers if f["id"] not in in_run])
+        return run
+
+    async def _release(self, rows: list) -> None:
+        """Снимает захват со строк без отправки: их заберут в свою очередь."""
+        await self._db.release_outbox([row["id"] for row in rows])
+
+    async def _deliver(self, run: list) -> None:
+        """Отправляет одно сообщение или серию копий и записывает результат."""
+        ids = [row["id"] for row in run]
+        self._in_flight.update(ids)
+        self._retrying.difference_update(row["idempotency_key"] for row in run)
+        OUTBOX_IN_FLIGHT.set(len(self._in_flight))
+        try:
+            if len(run) == 1:
+                await self._send_one(run[0])
+            else:
+                await self._send_run(run)
+        except Exception as e:
+            # Строки вернутся в очередь после истечения захвата
+            logger.error(f"Ошибка записи результата outbox {ids}: {e}")
+        finally:
+            self._in_flight.difference_update(ids)
+            OUTBOX_IN_FLIGHT.set(len(self._in_flight))
+            # Полоса освободилась - следующее сообщение диалога можно забирать
+            self._wakeup.set()
+
+    async def _call(self, method: str, kwargs: Dict[str, Any]) -> List[int]:
+        """Вызывает bot.<method>(**kwargs) и возвращает идентификаторы сообщений."""
+        if "media" in kwargs:
+            kwargs["media"] = [
+                INPUT_MEDIA[item.pop("type")](**item) for item in kwargs["media"]
+            ]
+        result = await getattr(self._bot, method)(**kwargs)
+        messages = result if isinstance(result, (list, tuple)) else [result]
+        return [message.message_id for message in messages]
+
+    async def _send_one(self, row) -> bool:
+        """Отправляет одно сообщение. False - отложено, полоса не продвинулась."""
+        kwargs = json.loads(row["payload"])
+        fallback = kwargs.pop("_fallback", None)
+        effects = json.loads(row["effects"])
+        try:
+            try:
+                message_ids = await self._call(row["method"], kwargs)
+            except BadRequest as e:
+                # Копирование запрещено (или исходное сообщение удалено) -
+                # отправляем заново по типу содержимого
+                if fallback is None:
+                    raise
+                logger.info(f"Копирование outbox {row['id']} недоступно ({e}), отправка по типу")
+                message_ids = await self._call(fallback["method"], fallback["kwargs"])
+        except (BadRequest, Forbidden) as e:
+            await self._fail(row, effects, e)
+        except Exception as e:
+            return await self._retry_or_fail(row, effects, e)
+        else:
+            await self._complete(row, effects, message_ids)
+        return True
+
+    async def _send_run(self, run: list) -> None:
+        """Серия копий одной полосы - одним copy_messages."""
+        payloads = [json.loads(row["payload"]) for row in run]
+        head = payloads[0]
+        try:
+            message_ids = await self._call(
+                "copy_messages",
+                {
+                    "chat_id": head["chat_id"],
+                    "from_chat_id": head["from_chat_id"],
+                    "message_ids": [payload["message_id"] for payload in payloads],
+                    "message_thread_id": head.get("message_thread_id"),
+                },
+            )
+        except BadRequest:
+            # Разбираемся с каждым сообщением отдельно (с запасным путем);
+            # отложенное сообщение задерживает и всех за ним
+            for index, row in enumerate(run):
+                if not await self._send_one(row):
+                    await self._release(run[index + 1:])
+                    return
+            return
+        except Exception as e:
+            # Повтор по счетчику головы, остальные просто ждут ее в очереди
+            await self._retry_or_fail(run[0], json.loads(run[0]["effects"]), e)
+            await self._release(run[1:])
+            return
+
+        self._stats["batched"] += len(run)
+        if len(message_ids) == len(run):
+            for row, message_id in zip(run, message_ids):
+                await self._complete(row, json.loads(row["effects"]), [message_id])
+            return
+        # Telegram пропустил часть сообщений: копии записываются без связей
+        logger.warning(f"copy_messages вернул {len(message_ids)} из {len(run)} сообщений")
+        await self._complete(run[0], json.loads(run[0]["effects"]), message_ids)
+        for row in run[1:]:
+            await self._complete(row, json.loads(row["effects"]), [])
+
+    async def _retry_or_fail(self, row, effects: Dict[str, Any], error: Exception) -> bool:
+        """Откладывает повтор или, после max_attempts, завершает неудачей.
+
+        True - строка завершена (неудача), False - отложена.
+        """
+        if isinstance(error, RetryAfter):
+            await self._retry(row, float(error.retry_after), error)
+        elif row["attempts"] >= self.max_attempts:
+            await self._fail(row, effects, error)
+            return True
+        else:
+            await self._retry(row, self._backoff(row["attempts"]), error)
+        return False
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(self.retry_max, self.retry_base * 2 ** (attempts - 1))
+        # Разброс, чтобы повторы разных сообщений не совпадали
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _complete(self, row, effects: Dict[str, Any], message_ids: List[int]) -> None:
+        sources = effects.get("sources", [])
+        if len(sources) != len(message_ids):
+            # copy_messages пропускает недоступные сообщения - соответствие
+            # копий исходным потеряно, сохраняем сообщения бота без связей
+            sources = []
+        if effects.get("direction") == "to_group":
+            group_message_ids = message_ids
+            links = list(zip(message_ids, sources))
+        else:
+            # Копии в личном чате в bot_messages не пишутся: идентификаторы
+            # личного чата пересекаются с идентификаторами группы
+            group_message_ids = []
+            links = list(zip(sources, message_ids))
+        await self._db.complete_outbox(
+            row["id"],
+            effects.get("user_id"),
+            effects.get("thread_id"),
+            group_message_ids,
+            links,
+        )
+        self._finish(row, "sent")
+
+    async def _retry(self, row, delay: float, error: Exception) -> None:
+        logger.warning(
+            f"Повтор отправки outbox {row['id']} через {delay:.1f} с "
+            f"(попытка {row['attempts']}): {error}"
+        )
+        await self._db.retry_outbox(row["id"], delay, str(error))
+        if row["idempotency_key"] in self._pending:
+            self._retrying.add(row["idempotency_key"])
+        self._stats["retried"] += 1
+        OUTBOX_RESULTS.inc(row["kind"], "retry")
+
+    async def _fail(self, row, effects: Dict[str, Any], error: Exception) -> None:
+        logger.error(f"Отправка outbox {row['id']} ({row['kind']}) не удалась: {error}")
+        await self._db.fail_outbox(row["id"], str(error))
+        self._finish(row, "failed")
+        callback = self._on_failure.get(row["kind"])
+        if callback is not None:
+            try:
+                await callback(self._bot, effects, error)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика неудачи outbox: {e}")
+
+    def _finish(self, row, result: str) -> None:
+        self._stats[result] += 1
+        self._pending.discard(row["idempotency_key"])
+        self._retrying.discard(row["idempotency_key"])
+        OUTBOX_RESULTS.inc(row["kind"], result)
+
+    async def _cleanup(self, context: CallbackContext) -> None:
+        """Удаляет завершенные строки старше окна идемпотентности."""
+        try:
+            deleted = await self._db.delete_old_outbox(self.retention)
+            if deleted:
+                logger.info(f"🧹 Удалено завершенных сообщений outbox: {deleted}")
+        except Exception as e:
+            logger.error(f"Ошибка очистки outbox: {e}")
+
+
+# Глобальная очередь исходящих сообщений
+outbox = Outbox(
+    db,
+    workers=OUTBOX_WORKERS,
+    batch_size=OUTBOX_BATCH_SIZE,
+    max_attempts=OUTBOX_MAX_ATTEMPTS,
+    retry_base=OUTBOX_RETRY_BASE,
+    retry_max=OUTBOX_RETRY_MAX,
+    lease=OUTBOX_LEASE,
+    poll_interval=OUTBOX_POLL_INTERVAL,
+    retention=OUTBOX_RETENTION,
+)
@@ -0,0 +1,165 @@
+# services/persistence.py
+import asyncio
+import pickle
+from typing import Any, Dict, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from loger.logger import logger
+
+# Ключ строки состояния: (вид, ключ), например ("bot", "media_groups")
+StateKey = Tuple[str, str]
+
+
+class PostgresPersistence(BasePersistence):
+    """Хранение состояния PTB (bot_data, user_data, chat_data, разговоры) в PostgreSQL.
+
+    Каждый ключ верхнего уровня bot_data и каждый user/chat хранится отдельной
+    строкой таблицы ptb_persistence. PTB вызывает update_* раз в update_interval
+    для всего состояния, а в БД уходят только изменившиеся строки: одна пачка
+    executemany на цикл. Состояние читается из БД при первом обращении PTB
+    (в Application.initialize), одним запросом на все строки.
+    """
+
+    def __init__(
+        self,
+        database,
+        store_data: Optional[PersistenceInput] = None,
+        update_interval: float = 60,
+    ):
+        super().__init__(store_data=store_data, update_interval=update_interval)
+        self._db = database
+        self._rows: Optional[Dict[StateKey, Any]] = None
+        # Снимок того, что уже лежит в БД: для отслеживания изменений
+        self._stored: Dict[StateKey, bytes] = {}
+        self._dirty: Dict[StateKey, Optional[bytes]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def _load(self) -> Dict[StateKey, Any]:
+        """Читает все сохраненное состояние одним запросом (один раз)."""
+        if self._rows is None:
+            # Application.initialize() идет параллельно с подключением к БД
+            await self._db.wait_ready()
+            self._rows = {}
+            for record in await self._db.load_persistence():
+                key = (record["kind"], record["key"])
+                self._stored[key] = bytes(record["value"])
+                try:
+                    self._rows[key] = pickle.loads(record["value"])
+                except Exception as e:
+                    logger.error(f"Не удалось восстановить состояние {key}: {e}")
+            logger.info(f"♻️ Состояние восстановлено: {len(self._rows)} записей")
+        return self._rows
+
+    async def _of_kind(self, kind: str) -> Dict[str, Any]:
+        rows = await self._load()
+        return {key: value for (row_kind, key), value in rows.items() if row_kind == kind}
+
+    def _put(self, key: StateKey, value: Any) -> None:
+        """Помечает строку измененной, если ее содержимое отличается от сохраненного."""
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if self._stored.get(key) == data:
+            self._dirty.pop(key, None)
+            return
+        self._dirty[key] = data
+        self._schedule_flush()
+
+    def _delete(self, key: StateKey) -> None:
+        if key in self._stored or key in self._dirty:
+            self._dirty[key] = None
+            self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        # PTB обновляет все состояние одной пачкой вызовов update_*;
+        # запись откладывается до их завершения и делается одним запросом
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._deferred_flush())
+
+    async def _deferred_flush(self) -> None:
+        await asyncio.sleep(0)
+        try:
+            await self._write()
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения состояния: {e}")
+
+    async def _write(self) -> None:
+        async with self._lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, {}
+            upserts = [(kind, key, data) for (kind, key), data in dirty.items() if data is not None]
+            deletes = [(kind, key) for (kind, key), data in dirty.items() if data is None]
+            try:
+                await self._db.save_persistence(upserts, deletes)
+            except Exception:
+                # Вернем изменения, чтобы записать их в следующий раз
+                self._dirty = {**dirty, **self._dirty}
+                raise
+            for state_key, data in dirty.items():
+                if data is None:
+                    self._stored.pop(state_key, None)
+                else:
+                    self._stored[state_key] = data
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return dict(await self._of_kind("bot"))
+
+    async def get_user_data(self) -> Dict[int, Any]:
+        return {int(key): value for key, value in (await self._of_kind("user")).items()}
+
+    async def get_chat_data(self) -> Dict[int, Any]:
+        return {int(key): value for key, value in (await self._of_kind("chat")).items()}
+
+    async def get_callback_data(self) -> Optional[Any]:
+        return (await self._load()).get(("callback", ""))
+
+    async def get_conversations(self, name: str) -> Dict[Any, Any]:
+        return (await self._load()).get(("conversation", name), {})
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        current = set()
+        for key, value in data.items():
+            current.add(("bot", str(key)))
+            self._put(("bot", str(key)), value)
+        for state_key in list(self._stored):
+            if state_key[0] == "bot" and state_key not in current:
+                self._delete(state_key)
+
+    async def update_user_data(self, user_id: int, data: Any) -> None:
+        self._put(("user", str(user_id)), data)
+
+    async def update_chat_data(self, chat_id: int, data: Any) -> None:
+        self._put(("chat", str(chat_id)), data)
+
+    async def update_callback_data(self, data: Any) -> None:
+        self._put(("callback", ""), data)
+
+    async def update_conversation(self, name: str, key: Tuple, new_state: Optional[object]) -> None:
+        conversations = (await self._load()).setdefault(("conversation", name), {})
+        if new_state is None:
+            conversations.pop(key, None)
+        else:
+            conversations[key] = new_state
+        self._put(("conversation", name), conversations)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._delete(("user", str(user_id)))
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._delete(("chat", str(chat_id)))
+
+    async def refresh_user_data(self, user_id: int, user_data: Any) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Any) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Any) -> None:
+        pass
+
+    async def flush(self) -> None:
+        """Записывает все несохраненные изменения (вызывается при остановке)."""
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self._write()
@@ -0,0 +1,280 @@
+# services/polling.py
+import asyncio
+import contextlib
+import time
+from typing import Dict, Optional, Set
+
+from telegram import Update
+from telegram.error import Conflict, InvalidToken, NetworkError, RetryAfter
+
+from database import db
+from globals.config import POLL_BATCH_SIZE, POLL_TIMEOUT
+from loger.logger import logger
+
+# Пауза после сетевой ошибки getUpdates: от RETRY_BASE, удваивается до RETRY_MAX
+RETRY_BASE = 1.0
+RETRY_MAX = 30.0
+# Сколько ждать завершения обработки, если новых обновлений в окне нет, сек.
+PROGRESS_WAIT = 1.0
+
+
+class UpdateLedger:
+    """Учет обработанных обновлений: смещение для getUpdates и защита от повторов.
+
+    Обновления обрабатываются параллельно, поэтому обработанные идут не
+    подряд. watermark - update_id, до которого включительно все полученные
+    обновления обработаны; обработанные выше него хранятся отдельно. Оба
+    значения периодически сохраняются в БД (bot_state, processed_updates):
+    после перезапуска polling продолжает с watermark + 1, а уже обработанные
+    обновления из повторной выдачи пропускаются.
+
+    Обработанное обновление, чье содержимое пока живет только в памяти
+    (часть собираемого альбома), можно придержать - hold(): watermark не
+    перейдет через него до release(), и после падения Telegram выдаст его
+    снова.
+    """
+
+    def __init__(self, database):
+        self._db = database
+        self.watermark: Optional[int] = None
+        # Получено, но еще не обработано
+        self._in_flight: Set[int] = set()
+        # Обработано выше watermark
+        self._done: Set[int] = set()
+        # Придержанные обновления: ключ -> update_id, и все придержанные вместе
+        self._holds: Dict[str, Set[int]] = {}
+        self._held: Set[int] = set()
+        # Наибольший полученный update_id
+        self._fetched: Optional[int] = None
+        self._saved: Optional[tuple] = None
+        self.progress = asyncio.Event()
+        self._stats = {"processed": 0, "duplicate": 0}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    @property
+    def held(self) -> int:
+        return len(self._held)
+
+    @property
+    def fetched(self) -> Optional[int]:
+        return self._fetched
+
+    def stats(self):
+        return {
+            **self._stats,
+            "watermark": self.watermark,
+            "in_flight": len(self._in_flight),
+            "done": len(self._done),
+            "held": len(self._held),
+        }
+
+    async def load(self) -> Optional[int]:
+        """Читает сохраненное смещение. Возвращает watermark (None - еще не было)."""
+        watermark, processed = await self._db.load_update_offset()
+        self.watermark = self._fetched = watermark
+        self._done = {
+            update_id for update_id in processed if watermark is None or update_id > watermark
+        }
+        self._saved = (watermark, frozenset(self._done))
+        return watermark
+
+    def seen(self, update_id: int) -> bool:
+        """Обновление уже обработано (повторная выдача после сбоя)."""
+        return (
+            self.watermark is not None and update_id <= self.watermark
+        ) or update_id in self._done
+
+    def begin(self, update_id: int) -> bool:
+        """Отмечает полученное обновление. False - оно уже обработано, пропускаем."""
+        if self._fetched is None or update_id > self._fetched:
+            self._fetched = update_id
+        if self.seen(update_id):
+            self._stats["duplicate"] += 1
+            self._advance()
+            return False
+        self._in_flight.add(update_id)
+        return True
+
+    def finish(self, update: object) -> None:
+        """Обновление обработано (обработчики завершились, в том числе с ошибкой)."""
+        update_id = getattr(update, "update_id", None)
+        if update_id not in self._in_flight:
+            return
+        self._in_flight.discard(update_id)
+        self._stats["processed"] += 1
+        if update_id not in self._held:
+            self._done.add(update_id)
+            self._advance()
+        self.progress.set()
+
+    def hold(self, update_id: int, key: str) -> None:
+        """Не подтверждать обновление, пока не вызван release(key)."""
+        if update_id not in self._in_flight:
+            # Обновление не из polling (webhook) или уже обработано
+            return
+        self._holds.setdefault(key, set()).add(update_id)
+        self._held.add(update_id)
+
+    def release(self, key: str) -> None:
+        """Отпускает придержанные под ключом key обновления."""
+        update_ids = self._holds.pop(key, None)
+        if not update_ids:
+            return
+        self._held -= update_ids
+        # Еще обрабатываемые подтвердит finish()
+        self._done |= update_ids - self._in_flight
+        self._advance()
+        self.progress.set()
+
+    def _advance(self) -> None:
+        # Подтверждаем только до первого необработанного или придержанного
+        blocked = [min(ids) for ids in (self._in_flight, self._held) if ids]
+        limit = min(blocked) - 1 if blocked else self._fetched
+        if limit is None or (self.watermark is not None and limit <= self.watermark):
+            return
+        self.watermark = limit
+        self._done = {update_id for update_id in self._done if update_id > limit}
+
+    async def save(self) -> bool:
+        """Сохраняет смещение в БД, если оно изменилось. True - записано."""
+        if self.watermark is None:
+            return False
+        state = (self.watermark, frozenset(self._done))
+        if state == self._saved:
+            return False
+        await self._db.save_update_offset(*state)
+        self._saved = state
+        return True
+
+
+class UpdatePoller:
+    """Long polling getUpdates, подтверждающий только обработанные обновления.
+
+    В отличие от Updater.start_polling, offset запроса - watermark + 1, а не
+    следующий за последним полученным: Telegram хранит обновление, пока
+    оно не обработано, и после падения бота выдаст его снова. Уже
+    полученные обновления из повторной выдачи отсекаются по update_id.
+
+    Накопившиеся за время простоя обновления разбираются пачками по
+    batch_size без ожидания long polling; размер отставания виден в
+    backlog().
+    """
+
+    def __init__(self, ledger: UpdateLedger, batch_size: int, timeout: int):
+        self.ledger = ledger
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._application = None
+        self._task: Optional[asyncio.Task] = None
+        # Оценка числа обновлений, еще ждущих выдачи в Telegram
+        self._pending = 0
+        self._catchup: Optional[float] = None
+        self._caught_up = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def backlog(self) -> int:
+        """Обновления, ждущие выдачи в Telegram, и полученные, но не обработанные."""
+        return self._pending + self.ledger.in_flight
+
+    async def start(self, application) -> None:
+        """Снимает webhook (не сбрасывая накопленное) и запускает опрос."""
+        self._application = application
+        bot = application.bot
+        await bot.delete_webhook(drop_pending_updates=False)
+        info = await bot.get_webhook_info()
+        self._pending = info.pending_update_count
+        if self._pending:
+            self._catchup = time.perf_counter()
+            logger.info(
+                f"📥 Накопилось обновлений: {self._pending}, разбор после update_id "
+                f"{self.ledger.watermark}"
+            )
+        self._task = asyncio.create_task(self._run(), name="update_poller")
+
+    async def stop(self) -> None:
+        """Прекращает получение обновлений (полученные дорабатываются отдельно)."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        delay = RETRY_BASE
+        while True:
+            try:
+                fresh = await self._poll()
+            except RetryAfter as e:
+                await asyncio.sleep(float(e.retry_after))
+                continue
+            except InvalidToken:
+                logger.critical("Неверный токен бота, получение обновлений остановлено")
+                raise
+            except (Conflict, NetworkError) as e:
+                # Conflict - обновления забирает другой экземпляр бота
+                logger.warning(f"Ошибка getUpdates ({e}), повтор через {delay:.0f} с")
+                await asyncio.sleep(delay)
+                delay = min(RETRY_MAX, delay * 2)
+                continue
+            except Exception as e:
+                logger.error(f"Ошибка получения обновлений: {e}", exc_info=True)
+                await asyncio.sleep(delay)
+                delay = min(RETRY_MAX, delay * 2)
+                continue
+            delay = RETRY_BASE
+
+            if not fresh and (self.ledger.in_flight or self.ledger.held):
+                # Окно занято выданными ранее обновлениями: ждем их обработки
+                # или, для придержанных, отправки альбома
+                self.ledger.progress.clear()
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self.ledger.progress.wait(), PROGRESS_WAIT)
+
+    async def _poll(self) -> int:
+        """Один getUpdates. Возвращает число новых обновлений."""
+        ledger = self.ledger
+        offset = ledger.watermark + 1 if ledger.watermark is not None else None
+        # Пока есть необработанные, Telegram вернет их сразу - long polling не нужен
+        timeout = 0 if ledger.in_flight or self._pending else self.timeout
+        updates = await self._application.bot.get_updates(
+            offset=offset,
+            limit=self.batch_size,
+            timeout=timeout,
+            allowed_updates=Update.ALL_TYPES,
+        )
+
+        fetched = ledger.fetched
+        fresh = 0
+        for update in updates:
+            if fetched is not None and update.update_id <= fetched:
+                # Уже получено, обработка еще идет
+                continue
+            fresh += 1
+            if ledger.begin(update.update_id):
+                await self._application.update_queue.put(update)
+
+        if len(updates) < self.batch_size:
+            self._pending = 0
+        else:
+            self._pending = max(0, self._pending - fresh)
+        if self._catchup is not None:
+            self._caught_up += fresh
+            if not self._pending and not ledger.in_flight:
+                logger.info(
+                    f"✅ Накопившиеся обновления разобраны: {self._caught_up} за "
+                    f"{time.perf_counter() - self._catchup:.1f} с"
+                )
+                self._catchup = None
+        return fresh
+
+
+# Глобальный учет обновлений и опрос Telegram
+update_ledger = UpdateLedger(db)
+poller = UpdatePoller(update_ledger, batch_size=POLL_BATCH_SIZE, timeout=POLL_TIMEOUT)
@@ -0,0 +1,187 @@
+# services/rate_limiter.py
+import asyncio
+import time
+from typing import Any, Callable, Coroutine, Dict, Optional, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from loger.logger import logger
+from services.metrics import API_ERRORS, API_LATENCY
+
+
+class TokenBucket:
+    """Корзина токенов с резервированием: каждый вызов reserve() занимает токен
+    и возвращает, сколько секунд нужно подождать до его появления"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "paused_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.paused_until - now)
+
+    def pause(self, seconds: float) -> None:
+        """Блокирует корзину на время, указанное Telegram в retry_after."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def idle(self) -> bool:
+        now = time.monotonic()
+        refilled = self.tokens + (now - self.updated) * self.rate
+        return refilled >= self.capacity and self.paused_until <= now
+
+
+class SendScheduler(BaseRateLimiter[int]):
+    """Планировщик исходящих запросов к Bot API с учетом лимитов Telegram.
+
+    Все запросы бота с chat_id проходят через три корзины: общую на бота,
+    на групповой чат и на личный чат. Запрос ждет своей очереди вместо того,
+    чтобы получить 429, а если Telegram все же ответил RetryAfter, чат
+    ставится на паузу и запрос повторяется.
+    """
+
+    # Сколько корзин чатов держать до очистки простаивающих
+    _MAX_CHAT_BUCKETS = 10000
+
+    def __init__(
+        self,
+        overall_per_second: float,
+        group_per_minute: float,
+        private_per_second: float,
+        max_retries: int,
+    ):
+        self._overall = TokenBucket(overall_per_second, overall_per_second)
+        self._group_rate = group_per_minute / 60
+        self._group_capacity = max(1.0, group_per_minute / 4)
+        self._private_rate = private_per_second
+        self._private_capacity = max(1.0, private_per_second * 3)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._max_retries = max_retries
+        self._stats = {
+            "queued": 0,
+            "max_queued": 0,
+            "sent": 0,
+            "retries": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0,
+        }
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Глубина очереди отправки и время ожидания запросов."""
+        stats = self._stats
+        return {
+            "queued": stats["queued"],
+            "max_queued": stats["max_queued"],
+            "sent": stats["sent"],
+            "retries": stats["retries"],
+            "avg_wait_ms": stats["wait_total"] / stats["sent"] * 1000
+            if stats["sent"]
+            else 0.0,
+            "max_wait_ms": stats["wait_max"] * 1000,
+        }
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self._MAX_CHAT_BUCKETS:
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle()}
+            if chat_id < 0:
+                bucket = TokenBucket(self._group_rate, self._group_capacity)
+            else:
+                bucket = TokenBucket(self._private_rate, self._private_capacity)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _wait_turn(self, bucket: Optional[TokenBucket]) -> float:
+        started = time.monotonic()
+        # Сначала очередь чата, затем общая: токен общей корзины не должен
+        # простаивать, пока запрос ждет медленный чат
+        if bucket is not None:
+            delay = bucket.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        delay = self._overall.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return time.monotonic() - started
+
+    async def _call(
+        self,
+        endpoint: str,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, dict, list]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+    ) -> Union[bool, dict, list]:
+        """Выполняет запрос к Bot API, учитывая его время и ошибки в метриках."""
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception as e:
+            API_ERRORS.inc(endpoint, type(e).__name__)
+            raise
+        finally:
+            API_LATENCY.observe(time.perf_counter() - started, endpoint)
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, dict, list]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int],
+    ) -> Union[bool, dict, list]:
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            # getUpdates, getMe и т.п. - не лимитируются
+            return await self._call(endpoint, callback, args, kwargs)
+
+        try:
+            bucket = self._chat_bucket(int(chat_id))
+        except (TypeError, ValueError):
+            bucket = None  # @username канала
+
+        max_retries = rate_limit_args or self._max_retries
+        stats = self._stats
+        stats["queued"] += 1
+        stats["max_queued"] = max(stats["max_queued"], stats["queued"])
+        try:
+            for attempt in range(max_retries + 1):
+                waited = await self._wait_turn(bucket)
+                stats["wait_total"] += waited
+                stats["wait_max"] = max(stats["wait_max"], waited)
+                try:
+                    result = await self._call(endpoint, callback, args, kwargs)
+                    stats["sent"] += 1
+                    return result
+                except RetryAfter as e:
+                    if attempt == max_retries:
+                        logger.error(
+                            f"Лимит Telegram: {endpoint} не отправлен "
+                            f"после {max_retries} повторов"
+                        )
+                        raise
+                    stats["retries"] += 1
+                    retry_after = float(e.retry_after) + 0.1
+                    logger.warning(
+                        f"Лимит Telegram для чата {chat_id}: пауза {retry_after:.1f} с"
+                    )
+                    (bucket or self._overall).pause(retry_after)
+        finally:
+            stats["queued"] -= 1
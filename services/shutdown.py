@@ -0,0 +1,91 @@
+# services/shutdown.py
+# Плавная остановка: этапы дожимаются до общего срока, итог пишется в журнал
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from loger.logger import logger
+
+T = TypeVar("T")
+
+# Сколько дается завершающим этапам (сохранение состояния, закрытие пула),
+# даже если общий срок уже истек
+MIN_STEP = 1.0
+# Как часто проверять условие ожидания, сек.
+POLL_INTERVAL = 0.05
+
+
+class ShutdownDrain:
+    """Выполняет этапы остановки в пределах общего срока и собирает отчет.
+
+    flushed - что успели доделать (обработать, отправить, записать),
+    abandoned - что брошено по истечении срока или из-за ошибки.
+    """
+
+    def __init__(self, timeout: float):
+        self.started = time.perf_counter()
+        self.deadline = self.started + timeout
+        self.phases: Dict[str, float] = {}
+        self.flushed: Dict[str, int] = {}
+        self.abandoned: Dict[str, int] = {}
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.perf_counter())
+
+    async def step(
+        self, phase: str, awaitable: Awaitable[T], min_time: float = 0.0
+    ) -> Optional[T]:
+        """Выполняет этап, но не дольше оставшегося срока (и не меньше min_time).
+
+        Возвращает результат или None, если этап не успел или упал.
+        """
+        started = time.perf_counter()
+        try:
+            return await asyncio.wait_for(awaitable, max(self.remaining(), min_time))
+        except asyncio.TimeoutError:
+            logger.error(f"⏳ Остановка: этап {phase} не уложился в срок")
+        except Exception as e:
+            logger.error(f"Ошибка остановки ({phase}): {str(e)}")
+        finally:
+            self.phases[phase] = time.perf_counter() - started
+        return None
+
+    async def wait(self, phase: str, done: Callable[[], bool]) -> bool:
+        """Ждет выполнения условия до общего срока. False - срок истек."""
+        started = time.perf_counter()
+        try:
+            while not done():
+                if not self.remaining():
+                    logger.error(f"⏳ Остановка: не дождались этапа {phase}")
+                    return False
+                await asyncio.sleep(POLL_INTERVAL)
+            return True
+        finally:
+            self.phases[phase] = time.perf_counter() - started
+
+    def count(self, name: str, flushed: int = 0, abandoned: int = 0) -> None:
+        """Добавляет в отчет доделанное и брошенное."""
+        if flushed:
+            self.flushed[name] = self.flushed.get(name, 0) + flushed
+        if abandoned:
+            self.abandoned[name] = self.abandoned.get(name, 0) + abandoned
+
+    def report(self) -> Dict[str, Any]:
+        """Пишет итог остановки."""
+        total = time.perf_counter() - self.started
+        phases = ", ".join(f"{name} {took:.3f}с" for name, took in self.phases.items())
+        flushed = ", ".join(f"{name} {count}" for name, count in self.flushed.items())
+        extra = {
+            "shutdown_total": round(total, 4),
+            **{f"shutdown_{name}": round(took, 4) for name, took in self.phases.items()},
+            **{f"shutdown_flushed_{name}": count for name, count in self.flushed.items()},
+            **{f"shutdown_abandoned_{name}": count for name, count in self.abandoned.items()},
+        }
+        logger.info(
+            f"⏱ Остановка за {total:.3f}с ({phases}); доделано: {flushed or 'нечего'}",
+            extra=extra,
+        )
+        if self.abandoned:
+            abandoned = ", ".join(f"{name} {count}" for name, count in self.abandoned.items())
+            logger.warning(f"⚠️ Брошено при остановке: {abandoned}")
+        return extra
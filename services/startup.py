@@ -0,0 +1,88 @@
+# services/startup.py
+# Отчет о времени запуска: длительность этапов и время до первого обновления
+import time
+
+# Засекаем до импорта telegram, чтобы в отчет попало и время импортов
+STARTED = time.perf_counter()
+
+from typing import Awaitable, Callable, Dict, Optional, TypeVar  # noqa: E402
+
+from telegram import Update  # noqa: E402
+from telegram.ext import Application, ContextTypes, TypeHandler  # noqa: E402
+from loger.logger import logger  # noqa: E402
+
+T = TypeVar("T")
+
+# Группа обработчика-наблюдателя: выполняется раньше всех остальных
+FIRST_UPDATE_GROUP = -100
+
+
+class StartupReport:
+    """Собирает длительности этапов запуска.
+
+    Отсчет идет от импорта модуля, поэтому main импортирует его первым.
+    Этапы могут выполняться параллельно - каждый измеряется отдельно.
+    """
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = time.perf_counter() if started is None else started
+        self.phases: Dict[str, float] = {}
+        self.ready: Optional[float] = None
+        self.first_update: Optional[float] = None
+        self._handler: Optional[TypeHandler] = None
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def mark(self, phase: str) -> None:
+        """Фиксирует этап, закончившийся сейчас и начавшийся с момента старта."""
+        self.phases[phase] = self.elapsed()
+
+    async def timed(self, phase: str, awaitable: Awaitable[T]) -> T:
+        """Выполняет awaitable и записывает его длительность."""
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.phases[phase] = time.perf_counter() - started
+
+    def timed_sync(self, phase: str, func: Callable[[], T]) -> T:
+        """Синхронный вариант timed() для этапов без ожидания."""
+        started = time.perf_counter()
+        try:
+            return func()
+        finally:
+            self.phases[phase] = time.perf_counter() - started
+
+    def report(self) -> None:
+        """Пишет итог запуска: бот готов принимать обновления."""
+        self.ready = self.elapsed()
+        phases = ", ".join(f"{name} {took:.3f}с" for name, took in self.phases.items())
+        logger.info(
+            f"⏱ Запуск за {self.ready:.3f}с ({phases})",
+            extra={
+                "startup_total": round(self.ready, 4),
+                **{f"startup_{name}": round(took, 4) for name, took in self.phases.items()},
+            },
+        )
+
+    def watch_first_update(self, application: Application) -> None:
+        """Регистрирует обработчик, замеряющий время до первого обновления."""
+        self._handler = TypeHandler(Update, self._on_first_update)
+        application.add_handler(self._handler, group=FIRST_UPDATE_GROUP)
+
+    async def _on_first_update(
+        self, update: Update, context: ContextTypes.DEFAULT_TYPE
+    ) -> None:
+        if self.first_update is not None:
+            return
+        # Обработчик не снимаем: Application перебирает группы обработчиков
+        # между await, и удаление группы сорвало бы обработку обновления
+        self.first_update = self.elapsed()
+        logger.info(
+            f"⏱ Первое обновление через {self.first_update:.3f}с после старта",
+            extra={"startup_first_update": round(self.first_update, 4)},
+        )
+
+
+startup = StartupReport(STARTED)
@@ -0,0 +1,106 @@
+# services/topic_pool.py
+from typing import Optional
+
+from telegram import Bot
+from telegram.error import BadRequest
+from telegram.ext import CallbackContext, JobQueue
+
+from loger.logger import logger
+
+# Название заготовленного топика до выдачи пользователю
+POOL_TOPIC_NAME = "⏳ Свободный диалог"
+
+# Сколько заготовленных топиков пробовать, если их удалили вручную
+MAX_CLAIM_ATTEMPTS = 3
+
+
+class TopicPool:
+    """Запас заранее созданных топиков форума.
+
+    Топики создаются фоновой задачей не чаще per_minute в минуту и хранятся
+    в таблице topic_pool, поэтому запас переживает перезапуск. На /start
+    топик забирается из запаса и переименовывается - один дешевый
+    edit_forum_topic вместо создания. Если запас пуст или выключен (size=0),
+    топик создается сразу.
+    """
+
+    def __init__(self, database, chat_id: int, size: int, per_minute: float):
+        self._db = database
+        self.chat_id = chat_id
+        self.size = size
+        self.per_minute = per_minute
+        # Последнее известное число топиков в запасе (для метрик)
+        self.available = 0
+        self._stats = {"claimed": 0, "created": 0, "stale": 0, "released": 0}
+
+    def stats(self):
+        return {**self._stats, "available": self.available}
+
+    def start(self, job_queue: JobQueue) -> None:
+        """Запускает пополнение запаса: по одному топику за интервал."""
+        if self.size <= 0 or self.per_minute <= 0:
+            return
+        job_queue.run_repeating(
+            self._refill, 60 / self.per_minute, first=5, name="topic_pool_refill"
+        )
+
+    async def _refill(self, context: CallbackContext) -> None:
+        try:
+            self.available = await self._db.count_pooled_topics()
+            if self.available >= self.size:
+                return
+            topic = await context.bot.create_forum_topic(
+                chat_id=self.chat_id, name=POOL_TOPIC_NAME
+            )
+            await self._db.add_pooled_topic(topic.message_thread_id)
+            self.available += 1
+            self._stats["created"] += 1
+        except Exception as e:
+            logger.warning(f"Не удалось пополнить запас топиков: {e}")
+
+    async def assign(self, bot: Bot, name: str) -> int:
+        """Выдает топик с названием name: из запаса или новый. Возвращает thread_id."""
+        if self.size > 0:
+            for _ in range(MAX_CLAIM_ATTEMPTS):
+                thread_id = await self._claim()
+                if thread_id is None:
+                    break
+                try:
+                    await bot.edit_forum_topic(
+                        chat_id=self.chat_id, message_thread_id=thread_id, name=name
+                    )
+                    self._stats["claimed"] += 1
+                    return thread_id
+                except BadRequest as e:
+                    # Топик удалили вручную - берем следующий
+                    self._stats["stale"] += 1
+                    logger.warning(f"Заготовленный топик {thread_id} недоступен: {e}")
+                except Exception:
+                    # TimedOut, NetworkError, RetryAfter: топик цел, из запаса
+                    # он уже удален - возвращаем, иначе он потеряется
+                    await self.release(thread_id)
+                    raise
+
+        topic = await bot.create_forum_topic(chat_id=self.chat_id, name=name)
+        return topic.message_thread_id
+
+    async def release(self, thread_id: int) -> None:
+        """Возвращает выданный топик в запас (вызывающий не смог его закрепить).
+
+        Название не восстанавливается: при следующей выдаче топик все равно
+        переименовывается.
+        """
+        if self.size <= 0:
+            return
+        try:
+            await self._db.add_pooled_topic(thread_id)
+            self.available += 1
+            self._stats["released"] += 1
+        except Exception as e:
+            logger.error(f"❌ Топик {thread_id} не возвращен в запас: {e}")
+
+    async def _claim(self) -> Optional[int]:
+        thread_id = await self._db.claim_pooled_topic()
+        if thread_id is not None:
+            self.available = max(0, self.available - 1)
+        return thread_id
@@ -0,0 +1,185 @@
+# services/update_processor.py
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from globals.config import GROUP_CHAT_ID
+from loger.logger import logger
+
+# Ограничение базового класса не используется: допуск регулируют полосы ниже.
+# Если его сделать тесным, обновления пользователей заняли бы все места
+# раньше, чем до семафора дойдут ответы администраторов.
+_UNBOUNDED = 2**31
+
+
+def update_key(update: object) -> Hashable:
+    """Ключ упорядочивания: личный чат или тема форума в группе."""
+    if isinstance(update, Update) and update.effective_chat:
+        chat = update.effective_chat
+        message = update.effective_message
+        if chat.type != "private" and message and message.message_thread_id:
+            return ("thread", chat.id, message.message_thread_id)
+        return ("chat", chat.id)
+    # Обновления без чата порядка не требуют
+    return ("update", id(update))
+
+
+def is_priority(update: object) -> bool:
+    """Обновления из группы поддержки (ответы администраторов) идут вне очереди."""
+    return (
+        isinstance(update, Update)
+        and update.effective_chat is not None
+        and update.effective_chat.id == GROUP_CHAT_ID
+    )
+
+
+class PrioritySemaphore:
+    """Семафор с двумя полосами: освободившееся место сначала получает приоритетная"""
+
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters = {True: deque(), False: deque()}
+
+    @asynccontextmanager
+    async def acquire(self, priority: bool):
+        await self._acquire(priority)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, priority: bool) -> None:
+        if self._value > 0 and not (self._waiters[True] or self._waiters[False]):
+            self._value -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Место уже передано нам - возвращаем его следующему
+                self._release()
+            else:
+                self._waiters[priority].remove(future)
+            raise
+
+    def _release(self) -> None:
+        # Место передается ожидающему напрямую, минуя счетчик
+        for priority in (True, False):
+            waiters = self._waiters[priority]
+            while waiters:
+                future = waiters.popleft()
+                if not future.done():
+                    future.set_result(None)
+                    return
+        self._value += 1
+
+
+class OrderedUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений с сохранением порядка внутри диалога.
+
+    Обновления разных личных чатов и тем форума обрабатываются параллельно
+    (не более concurrency одновременно), обновления одного диалога - строго
+    по очереди. У каждой полосы (приоритетной и обычной) своя очередь глубиной
+    queue_size, поэтому поток сообщений пользователей не задерживает ответы
+    администраторов.
+
+    on_processed вызывается для каждого обновления после завершения его
+    обработчиков (например, чтобы сдвинуть смещение getUpdates).
+    """
+
+    def __init__(
+        self,
+        concurrency: int,
+        queue_size: int,
+        key: Callable[[object], Hashable] = update_key,
+        priority: Callable[[object], bool] = is_priority,
+        on_processed: Optional[Callable[[object], None]] = None,
+    ):
+        super().__init__(max_concurrent_updates=_UNBOUNDED)
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self._key = key
+        self._priority = priority
+        self._on_processed = on_processed
+        self._slots = PrioritySemaphore(concurrency)
+        self._lanes = {
+            True: asyncio.Semaphore(queue_size),
+            False: asyncio.Semaphore(queue_size),
+        }
+        # Замки диалогов живут, пока у диалога есть необработанные обновления
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+        self._refs: Dict[Hashable, int] = {}
+        self._stats = {
+            "running": 0,
+            "queued": 0,
+            "backlog": 0,
+            "max_queued": 0,
+            "processed": 0,
+        }
+
+    async def initialize(self) -> None:
+        logger.info(
+            f"Обработка обновлений: {self.concurrency} параллельно, "
+            f"очередь {self.queue_size} на полосу"
+        )
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, int]:
+        """running - выполняются, queued - допущены и ждут, backlog - ждут допуска,
+        processed - обработано с запуска.
+        """
+        return {**self._stats, "dialogs": len(self._locks)}
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        priority = self._priority(update)
+        stats = self._stats
+
+        stats["backlog"] += 1
+        try:
+            await self._lanes[priority].acquire()
+        finally:
+            stats["backlog"] -= 1
+
+        key = self._key(update)
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._refs[key] = self._refs.get(key, 0) + 1
+
+        stats["queued"] += 1
+        stats["max_queued"] = max(stats["max_queued"], stats["queued"])
+        started = False
+        try:
+            async with lock:
+                async with self._slots.acquire(priority):
+                    stats["queued"] -= 1
+                    stats["running"] += 1
+                    started = True
+                    try:
+                        await coroutine
+                    finally:
+                        stats["running"] -= 1
+                        stats["processed"] += 1
+                        if self._on_processed is not None:
+                            self._on_processed(update)
+        finally:
+            if not started:
+                stats["queued"] -= 1
+            self._release_key(key)
+            self._lanes[priority].release()
+
+    def _release_key(self, key: Hashable) -> None:
+        refs = self._refs[key] - 1
+        if refs:
+            self._refs[key] = refs
+        else:
+            del self._refs[key]
+            del self._locks[key]
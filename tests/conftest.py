@@ -0,0 +1,16 @@
+# tests/conftest.py
+import os
+import sys
+
+# Конфигурация читается при импорте модулей бота - для тестов хватает заглушек
+for name, value in {
+    "TOKEN": "123456:TEST",
+    "GROUP_CHAT_ID": "-1001",
+    "POSTGRES_DB": "test",
+    "POSTGRES_USER": "test",
+    "POSTGRES_PASSWORD": "test",
+    "POSTGRES_HOST": "localhost",
+}.items():
+    os.environ.setdefault(name, value)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
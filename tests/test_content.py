@@ -0,0 +1,109 @@
+# tests/test_content.py
+import pytest
+
+import handlers.content as content_module
+from benchmarks.content_router import SAMPLES, legacy_route, make
+from handlers.content import classify, forward_call
+
+GROUP_CHAT_ID = -1001
+USER_ID = 42
+THREAD_ID = 7
+
+
+@pytest.fixture
+def rebuild_mode(monkeypatch):
+    monkeypatch.setattr(content_module, "FORWARD_MODE", "rebuild")
+
+
+@pytest.fixture
+def copy_mode(monkeypatch):
+    monkeypatch.setattr(content_module, "FORWARD_MODE", "copy")
+
+
+@pytest.mark.parametrize("name", sorted(SAMPLES))
+def test_to_group_matches_legacy_route(rebuild_mode, name):
+    """Пользователь -> группа: метод и аргументы прежней логики плюс топик."""
+    message = make(SAMPLES[name])
+    method, args = legacy_route(message)
+
+    call = forward_call(
+        message,
+        classify(message),
+        chat_id=GROUP_CHAT_ID,
+        from_chat_id=USER_ID,
+        message_thread_id=THREAD_ID,
+    )
+
+    assert call == (
+        method,
+        {"chat_id": GROUP_CHAT_ID, "message_thread_id": THREAD_ID, **args},
+    )
+
+
+@pytest.mark.parametrize("name", sorted(SAMPLES))
+def test_to_user_matches_legacy_route(rebuild_mode, name):
+    """Группа -> пользователь: без топика, ответом на исходное сообщение."""
+    message = make(SAMPLES[name])
+    method, args = legacy_route(message)
+
+    call = forward_call(
+        message, classify(message), chat_id=USER_ID, from_chat_id=GROUP_CHAT_ID, reply_to=5
+    )
+
+    assert call == (
+        method,
+        {
+            "chat_id": USER_ID,
+            "reply_to_message_id": 5,
+            "allow_sending_without_reply": True,
+            **args,
+        },
+    )
+
+
+@pytest.mark.parametrize(
+    "chat_id, from_chat_id, thread_id",
+    [(GROUP_CHAT_ID, USER_ID, THREAD_ID), (USER_ID, GROUP_CHAT_ID, None)],
+    ids=["to_group", "to_user"],
+)
+def test_copy_keeps_rebuild_as_fallback(copy_mode, chat_id, from_chat_id, thread_id):
+    message = make(SAMPLES["photo"])
+
+    method, kwargs = forward_call(
+        message, classify(message), chat_id, from_chat_id, message_thread_id=thread_id
+    )
+
+    assert method == "copy_message"
+    assert kwargs["chat_id"] == chat_id
+    assert kwargs["from_chat_id"] == from_chat_id
+    assert kwargs["message_id"] == message.message_id
+    assert kwargs.get("message_thread_id") == thread_id
+    fallback = kwargs["_fallback"]
+    assert fallback["method"] == "send_photo"
+    assert fallback["kwargs"]["photo"] == "BIG"
+    assert "from_chat_id" not in fallback["kwargs"]
+
+
+def test_protected_content_is_rebuilt(copy_mode):
+    message = make({**SAMPLES["text"], "has_protected_content": True})
+
+    method, kwargs = forward_call(message, classify(message), USER_ID, GROUP_CHAT_ID)
+
+    assert method == "send_message"
+    assert kwargs == {"chat_id": USER_ID, "text": "Здравствуйте"}
+
+
+def test_unsupported_message_without_copy(rebuild_mode):
+    message = make({"contact": {"phone_number": "+7", "first_name": "A"}})
+
+    assert classify(message) is None
+    assert forward_call(message, None, USER_ID, GROUP_CHAT_ID) is None
+
+
+def test_too_big_voice():
+    message = make(
+        {"voice": {"file_id": "F", "file_unique_id": "U", "duration": 2, "file_size": 10**9}}
+    )
+
+    assert classify(message).too_big(message)
+    assert legacy_route(message) is None
@@ -0,0 +1,177 @@
+# tests/test_database.py
+import asyncio
+
+import pytest
+
+import database
+from database import _MISSING, CircuitBreaker, DatabaseUnavailable, LRUCache, ReplayQueue
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Управляемое time.monotonic модуля database."""
+    now = [1000.0]
+    monkeypatch.setattr(database.time, "monotonic", lambda: now[0])
+    return now
+
+
+class TestLRUCache:
+    def test_get_missing(self):
+        assert LRUCache(2, ttl=10).get("a") is _MISSING
+
+    def test_evicts_least_recently_used(self, clock):
+        cache = LRUCache(2, ttl=10)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1  # "a" становится самой свежей
+        cache.set("c", 3)
+
+        assert len(cache) == 2
+        assert cache.get("b") is _MISSING
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+
+    def test_expired_entry_is_still_available_as_stale(self, clock):
+        cache = LRUCache(2, ttl=10)
+        cache.set("a", 1)
+        clock[0] += 11
+
+        assert cache.get("a") is _MISSING
+        assert cache.stale("a") == 1
+        assert cache.stale("b") is _MISSING
+
+    def test_set_refreshes_ttl(self, clock):
+        cache = LRUCache(2, ttl=10)
+        cache.set("a", 1)
+        clock[0] += 8
+        cache.set("a", 2)
+        clock[0] += 8
+        assert cache.get("a") == 2
+
+    def test_cached_none_differs_from_missing(self):
+        cache = LRUCache(2, ttl=10)
+        cache.set("a", None)
+        assert cache.get("a") is None
+
+    def test_zero_size_disables_cache(self):
+        cache = LRUCache(0, ttl=10)
+        cache.set("a", 1)
+        assert len(cache) == 0
+
+    def test_pop_and_clear(self):
+        cache = LRUCache(3, ttl=10)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.pop("a")
+        cache.pop("missing")
+        assert cache.get("a") is _MISSING
+        cache.clear()
+        assert len(cache) == 0
+
+
+class TestCircuitBreaker:
+    def test_opens_after_threshold_failures(self, clock):
+        breaker = CircuitBreaker(threshold=3)
+        assert not breaker.failure()
+        assert not breaker.failure()
+        breaker.check()
+
+        assert breaker.failure()
+        assert breaker.is_open
+        # Повторные ошибки при разомкнутой цепи не размыкают ее заново
+        assert not breaker.failure()
+        assert breaker.stats["opened"] == 1
+
+        with pytest.raises(DatabaseUnavailable):
+            breaker.check()
+        assert breaker.stats["rejected"] == 1
+
+    def test_success_resets_failure_count(self):
+        breaker = CircuitBreaker(threshold=2)
+        breaker.failure()
+        breaker.success()
+        assert not breaker.failure()
+        assert not breaker.is_open
+
+    def test_close_reports_outage(self, clock):
+        breaker = CircuitBreaker(threshold=1)
+        breaker.failure()
+        clock[0] += 5
+
+        assert breaker.close() == 5
+        assert not breaker.is_open
+        assert breaker.failures == 0
+        breaker.check()
+
+    def test_close_when_closed(self):
+        assert CircuitBreaker(threshold=1).close() == 0.0
+
+
+class TestReplayQueue:
+    @staticmethod
+    def write(log, name, error=None):
+        async def run():
+            if error is not None:
+                raise error
+            log.append(name)
+
+        return run
+
+    def test_replays_in_order(self):
+        queue, log = ReplayQueue(max_size=10), []
+        for name in ("a", "b", "c"):
+            queue.add(name, self.write(log, name))
+
+        assert asyncio.run(queue.replay()) == 3
+        assert log == ["a", "b", "c"]
+        assert len(queue) == 0
+        assert queue.stats["replayed"] == 3
+
+    def test_rejects_when_full(self):
+        queue = ReplayQueue(max_size=1)
+        queue.add("a", self.write([], "a"))
+
+        with pytest.raises(DatabaseUnavailable):
+            queue.add("b", self.write([], "b"))
+        assert len(queue) == 1
+        assert queue.stats == {"deferred": 1, "replayed": 0, "rejected": 1, "failed": 0}
+
+    def test_stops_when_database_is_lost_again(self):
+        queue, log = ReplayQueue(max_size=10), []
+        queue.add("a", self.write(log, "a"))
+        queue.add("b", self.write(log, "b", DatabaseUnavailable("down")))
+        queue.add("c", self.write(log, "c"))
+
+        assert asyncio.run(queue.replay()) == 1
+        assert log == ["a"]
+        assert len(queue) == 2
+
+    def test_failed_write_is_dropped(self):
+        queue, log = ReplayQueue(max_size=10), []
+        queue.add("a", self.write(log, "a", ValueError("bad row")))
+        queue.add("b", self.write(log, "b"))
+
+        assert asyncio.run(queue.replay()) == 2
+        assert log == ["b"]
+        assert queue.stats["failed"] == 1
+        assert len(queue) == 0
+
+    def test_concurrent_replays_run_each_write_once(self):
+        queue, log = ReplayQueue(max_size=10), []
+
+        def slow_write(name):
+            async def run():
+                await asyncio.sleep(0.01)
+                log.append(name)
+
+            return run
+
+        for name in ("a", "b", "c"):
+            queue.add(name, slow_write(name))
+
+        async def replay_twice():
+            return await asyncio.gather(queue.replay(), queue.replay())
+
+        assert sorted(asyncio.run(replay_twice())) == [0, 3]
+        assert log == ["a", "b", "c"]
+        assert queue.stats["replayed"] == 3
@@ -0,0 +1,269 @@
+# tests/test_outbox.py
+import asyncio
+import json
+from types import SimpleNamespace
+
+from telegram.error import TimedOut
+
+from database import DatabaseUnavailable, ReplayQueue
+from services.outbox import Outbox
+
+
+class FakeDatabase:
+    def __init__(self, followers=(), degraded=False):
+        self.followers = list(followers)
+        self.degraded = degraded
+        self.claim_error = None
+        self.enqueue_error = None
+        self.inserted = True
+        self.completed = []
+        self.released = []
+        self.retried = []
+        self.failed = []
+        self.attempts = {}
+        self.replay = ReplayQueue(max_size=10)
+
+    async def claim_outbox_run(self, lane, head_id, limit, lease):
+        if self.claim_error is not None:
+            raise self.claim_error
+        # Захват засчитывает попытку, как и в БД
+        claimed = []
+        for follower in self.followers:
+            self.attempts[follower["id"]] = self.attempts.get(follower["id"], 0) + 1
+            claimed.append({**follower, "attempts": self.attempts[follower["id"]]})
+        return claimed
+
+    async def release_outbox(self, row_ids):
+        self.released.extend(row_ids)
+        for row_id in row_ids:
+            if row_id in self.attempts:
+                self.attempts[row_id] -= 1
+
+    async def retry_outbox(self, row_id, delay, error):
+        self.retried.append(row_id)
+
+    async def fail_outbox(self, row_id, error):
+        self.failed.append(row_id)
+
+    async def complete_outbox(self, row_id, user_id, thread_id, message_ids, links):
+        self.completed.append((row_id, user_id, thread_id, message_ids, links))
+
+    async def enqueue_outbox(self, *args):
+        if self.enqueue_error is not None:
+            raise self.enqueue_error
+        return self.inserted
+
+    def defer(self, name, write):
+        self.replay.add(name, write)
+
+
+class FakeBot:
+    def __init__(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.calls = []
+
+    async def copy_messages(self, **kwargs):
+        self.calls.append(("copy_messages", kwargs))
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def copy_row(row_id, message_id, queued=1, direction="to_group", reply_to=None):
+    payload = {"chat_id": -1001, "from_chat_id": 42, "message_id": message_id}
+    if reply_to is not None:
+        payload["reply_to_message_id"] = reply_to
+    return {
+        "id": row_id,
+        "lane": "-1001:7",
+        "kind": direction,
+        "method": "copy_message",
+        "payload": json.dumps(payload),
+        "effects": json.dumps(
+            {
+                "user_id": 42,
+                "thread_id": 7,
+                "direction": direction,
+                "sources": [message_id],
+            }
+        ),
+        "idempotency_key": f"{direction}:{row_id}",
+        "attempts": 1,
+        "queued": queued,
+    }
+
+
+def make_outbox(database):
+    return Outbox(
+        database,
+        workers=1,
+        batch_size=10,
+        max_attempts=3,
+        retry_base=1,
+        retry_max=10,
+        lease=30,
+        poll_interval=1,
+        retention=3600,
+    )
+
+
+class TestExtend:
+    def test_single_row(self):
+        outbox = make_outbox(FakeDatabase(followers=[copy_row(2, 11)]))
+        head = copy_row(1, 10, queued=1)
+        assert asyncio.run(outbox._extend(head)) == [head]
+
+    def test_reply_is_not_batched(self):
+        outbox = make_outbox(FakeDatabase(followers=[copy_row(2, 11)]))
+        head = copy_row(1, 10, queued=2, reply_to=3)
+        assert asyncio.run(outbox._extend(head)) == [head]
+
+    def test_run_stops_at_non_increasing_message_id(self):
+        # Порядок выдачи из БД не важен: серия собирается по id строки
+        followers = [copy_row(4, 12), copy_row(2, 11), copy_row(3, 9), copy_row(5, 13)]
+        database = FakeDatabase(followers=followers)
+        outbox = make_outbox(database)
+
+        run = asyncio.run(outbox._extend(copy_row(1, 10, queued=5)))
+
+        assert [row["id"] for row in run] == [1, 2]
+        assert sorted(database.released) == [3, 4, 5]
+
+    def test_released_follower_is_not_charged_an_attempt(self):
+        # Копия с меньшим message_id каждый раз отрезается от серии
+        database = FakeDatabase(followers=[copy_row(2, 9)])
+        outbox = make_outbox(database)
+        for _ in range(outbox.max_attempts + 2):
+            run = asyncio.run(outbox._extend(copy_row(1, 10, queued=2)))
+            assert [row["id"] for row in run] == [1]
+        assert database.attempts[2] == 0
+
+        # Первая настоящая попытка с сетевой ошибкой - повтор, а не неудача
+        row = {**copy_row(2, 9), "attempts": database.attempts[2] + 1}
+        assert not asyncio.run(outbox._retry_or_fail(row, {}, TimedOut()))
+        assert database.failed == []
+        assert database.retried == [2]
+
+    def test_claim_error_falls_back_to_head(self):
+        database = FakeDatabase()
+        database.claim_error = RuntimeError("boom")
+        head = copy_row(1, 10, queued=3)
+        assert asyncio.run(make_outbox(database)._extend(head)) == [head]
+
+
+class TestComplete:
+    def test_to_group_links_bot_message_to_source(self):
+        database = FakeDatabase()
+        row = copy_row(1, 10)
+        asyncio.run(make_outbox(database)._complete(row, json.loads(row["effects"]), [500]))
+        assert database.completed == [(1, 42, 7, [500], [(500, 10)])]
+
+    def test_to_user_links_source_to_bot_message(self):
+        database = FakeDatabase()
+        row = copy_row(1, 10, direction="to_user")
+        asyncio.run(make_outbox(database)._complete(row, json.loads(row["effects"]), [500]))
+        # Идентификатор из личного чата не попадает в сообщения бота группы
+        assert database.completed == [(1, 42, 7, [], [(10, 500)])]
+
+    def test_mismatched_sources_keep_messages_without_links(self):
+        database = FakeDatabase()
+        row = copy_row(1, 10)
+        asyncio.run(
+            make_outbox(database)._complete(row, json.loads(row["effects"]), [500, 501])
+        )
+        assert database.completed == [(1, 42, 7, [500, 501], [])]
+
+    def test_album_links_items_in_order(self):
+        database = FakeDatabase()
+        row = copy_row(1, 10)
+        effects = {**json.loads(row["effects"]), "sources": [10, 11, 12]}
+        asyncio.run(make_outbox(database)._complete(row, effects, [500, 501, 502]))
+        assert database.completed[0][4] == [(500, 10), (501, 11), (502, 12)]
+
+
+class TestSendRun:
+    def run(self, bot):
+        database = FakeDatabase()
+        outbox = make_outbox(database)
+        outbox._bot = bot
+        asyncio.run(outbox._send_run([copy_row(1, 10), copy_row(2, 11), copy_row(3, 12)]))
+        return database, outbox
+
+    def test_each_copy_is_linked_to_its_source(self):
+        ids = [SimpleNamespace(message_id=i) for i in (500, 501, 502)]
+        database, outbox = self.run(FakeBot(result=ids))
+
+        assert [entry[4] for entry in database.completed] == [
+            [(500, 10)],
+            [(501, 11)],
+            [(502, 12)],
+        ]
+        assert outbox.stats()["batched"] == 3
+
+    def test_partial_copy_drops_links(self):
+        ids = [SimpleNamespace(message_id=i) for i in (500, 502)]
+        database, _ = self.run(FakeBot(result=ids))
+
+        assert database.completed[0][3:] == ([500, 502], [])
+        assert [entry[3:] for entry in database.completed[1:]] == [([], []), ([], [])]
+
+    def test_network_error_retries_head_and_releases_rest(self):
+        database, outbox = self.run(FakeBot(error=TimedOut()))
+
+        assert database.retried == [1]
+        assert database.released == [2, 3]
+        assert outbox.stats()["retried"] == 1
+
+
+class TestPendingState:
+    def test_enqueue_tracks_pending_until_finished(self):
+        outbox = make_outbox(FakeDatabase())
+        assert asyncio.run(outbox.enqueue("k", "lane", "to_group", "send_message", {}))
+        assert not outbox.idle()
+        assert not outbox.drained()
+
+        outbox._finish({"idempotency_key": "k", "kind": "to_group"}, "sent")
+        assert outbox.idle()
+        assert outbox.drained()
+
+    def test_duplicate_is_not_pending(self):
+        database = FakeDatabase()
+        database.inserted = False
+        outbox = make_outbox(database)
+
+        assert not asyncio.run(outbox.enqueue("k", "lane", "to_group", "send_message", {}))
+        assert outbox.idle()
+        assert outbox.stats()["duplicate"] == 1
+
+    def test_retrying_rows_do_not_block_drain(self):
+        outbox = make_outbox(FakeDatabase())
+        asyncio.run(outbox.enqueue("to_group:1", "lane", "to_group", "send_message", {}))
+
+        asyncio.run(outbox._retry(copy_row(1, 10), 5, TimedOut()))
+        assert outbox.drained()
+        assert not outbox.idle()
+
+    def test_enqueue_is_deferred_in_degraded_mode(self):
+        database = FakeDatabase(degraded=True)
+        outbox = make_outbox(database)
+
+        assert asyncio.run(outbox.enqueue("k", "lane", "to_group", "send_message", {}))
+        assert len(database.replay) == 1
+        assert outbox.stats()["deferred"] == 1
+        assert not outbox.idle()
+
+    def test_enqueue_is_deferred_when_database_is_lost(self):
+        database = FakeDatabase()
+        database.enqueue_error = DatabaseUnavailable("down")
+        outbox = make_outbox(database)
+
+        assert asyncio.run(outbox.enqueue("k", "lane", "to_group", "send_message", {}))
+        assert len(database.replay) == 1
+
+        # После восстановления связи строка оказалась уже поставленной
+        database.enqueue_error = None
+        database.inserted = False
+        asyncio.run(database.replay.replay())
+        assert outbox.idle()
+        assert outbox.stats()["duplicate"] == 1
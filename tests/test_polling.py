@@ -0,0 +1,169 @@
+# tests/test_polling.py
+import asyncio
+import contextlib
+from types import SimpleNamespace
+
+from services.polling import UpdateLedger, UpdatePoller
+
+
+class FakeDatabase:
+    def __init__(self, offset=None, processed=()):
+        self.offset = offset
+        self.processed = list(processed)
+        self.saved = []
+
+    async def load_update_offset(self):
+        return self.offset, self.processed
+
+    async def save_update_offset(self, offset, processed):
+        self.saved.append((offset, sorted(processed)))
+
+
+def update(update_id):
+    return SimpleNamespace(update_id=update_id)
+
+
+def ledger_after(watermark, database=None):
+    ledger = UpdateLedger(database or FakeDatabase(offset=watermark))
+    asyncio.run(ledger.load())
+    return ledger
+
+
+def test_watermark_waits_for_oldest_in_flight():
+    ledger = ledger_after(10)
+    for update_id in (11, 12, 13):
+        assert ledger.begin(update_id)
+
+    ledger.finish(update(12))
+    ledger.finish(update(13))
+    assert ledger.watermark == 10
+    assert ledger.stats()["done"] == 2
+
+    ledger.finish(update(11))
+    assert ledger.watermark == 13
+    assert ledger.stats()["done"] == 0
+    assert ledger.in_flight == 0
+
+
+def test_processed_above_watermark_are_skipped_after_restart():
+    ledger = ledger_after(None, FakeDatabase(offset=10, processed=[9, 12]))
+
+    # 9 ниже watermark и отбрасывается при загрузке
+    assert ledger.stats()["done"] == 1
+    assert ledger.begin(11)
+    assert not ledger.begin(12)
+    assert ledger.stats()["duplicate"] == 1
+
+    ledger.finish(update(11))
+    assert ledger.watermark == 12
+
+
+def test_duplicate_advances_over_finished_tail():
+    ledger = ledger_after(10)
+    assert ledger.begin(11)
+    ledger.finish(update(11))
+    assert not ledger.begin(11)
+    assert ledger.watermark == 11
+
+
+def test_finish_ignores_unknown_updates():
+    ledger = ledger_after(10)
+    ledger.finish(update(50))
+    ledger.finish(object())
+    assert ledger.watermark == 10
+    assert ledger.stats()["processed"] == 0
+
+
+def test_held_update_blocks_watermark_until_release():
+    ledger = ledger_after(10)
+    for update_id in (11, 12, 13):
+        ledger.begin(update_id)
+    ledger.hold(11, "album")
+    ledger.hold(12, "album")
+
+    for update_id in (11, 12, 13):
+        ledger.finish(update(update_id))
+    assert ledger.watermark == 10
+    assert ledger.in_flight == 0
+    assert ledger.stats()["held"] == 2
+
+    ledger.release("album")
+    assert ledger.watermark == 13
+    assert ledger.stats()["held"] == 0
+
+
+def test_release_before_finish_leaves_update_to_finish():
+    ledger = ledger_after(10)
+    ledger.begin(11)
+    ledger.hold(11, "album")
+
+    ledger.release("album")
+    assert ledger.watermark == 10
+
+    ledger.finish(update(11))
+    assert ledger.watermark == 11
+
+
+def test_hold_ignores_updates_not_in_flight():
+    ledger = ledger_after(10)
+    ledger.hold(11, "album")
+    assert ledger.stats()["held"] == 0
+
+
+def test_save_writes_only_changes():
+    database = FakeDatabase(offset=10)
+    ledger = ledger_after(10, database)
+    assert not asyncio.run(ledger.save())
+
+    ledger.begin(11)
+    ledger.begin(12)
+    ledger.finish(update(12))
+    assert asyncio.run(ledger.save())
+    assert not asyncio.run(ledger.save())
+    assert database.saved == [(10, [12])]
+
+
+class FakeBot:
+    def __init__(self, updates):
+        self.updates = updates
+        self.calls = []
+
+    async def get_updates(self, offset=None, limit=None, timeout=None, allowed_updates=None):
+        self.calls.append(offset)
+        updates = [u for u in self.updates if offset is None or u.update_id >= offset]
+        # Long polling: пустой ответ приходит по истечении timeout
+        await asyncio.sleep(0 if updates else timeout / 1000)
+        return updates
+
+
+def test_poller_waits_while_only_held_updates_remain():
+    ledger = ledger_after(10)
+
+    async def scenario():
+        bot = FakeBot([update(11), update(12)])
+        queue = asyncio.Queue()
+        poller = UpdatePoller(ledger, batch_size=100, timeout=30)
+        poller._application = SimpleNamespace(bot=bot, update_queue=queue)
+
+        task = asyncio.create_task(poller._run())
+        for _ in range(2):
+            ledger.hold((await queue.get()).update_id, "album")
+        ledger.finish(update(11))
+        ledger.finish(update(12))
+        calls = len(bot.calls)
+
+        # Telegram снова отдает придержанные обновления - повторять запрос незачем
+        await asyncio.sleep(0.2)
+        assert ledger.in_flight == 0 and ledger.held == 2
+        assert len(bot.calls) <= calls + 1
+
+        bot.updates = []
+        ledger.release("album")
+        await asyncio.sleep(0.05)
+        assert bot.calls[-1] == 13
+
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
@@ -0,0 +1,118 @@
+# tests/test_search.py
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import handlers.search as search
+from handlers.search import _query, _render
+
+PAGE_SIZE = 3
+
+
+@pytest.fixture(autouse=True)
+def page_size(monkeypatch):
+    monkeypatch.setattr(search, "SEARCH_PAGE_SIZE", PAGE_SIZE)
+
+
+def result(row_id, rank, snippet="текст", direction="to_group"):
+    return {
+        "id": row_id,
+        "rank": rank,
+        "user_id": 42,
+        "thread_id": 7,
+        "direction": direction,
+        "message_type": "photo",
+        "snippet": snippet,
+        "created_at": datetime(2026, 1, 2, 3, 4, tzinfo=timezone.utc),
+    }
+
+
+def test_query():
+    assert _query("/search  оплата заказа ") == "оплата заказа"
+    assert _query("/search") == ""
+    assert _query(None) == ""
+
+
+def test_render_empty():
+    text, keyboard = _render("заказ", [])
+    assert "ничего не найдено" in text
+    assert keyboard is None
+
+
+def test_render_rows():
+    text, keyboard = _render(
+        "заказ", [result(1, 0.5), result(2, 0.4, snippet=None, direction="to_user")]
+    )
+    assert "👤 02.01.2026 03:04 · пользователь 42 · топик 7\nтекст" in text
+    assert "🛟" in text and "[photo]" in text
+    # Неполная страница - последняя
+    assert keyboard is None
+
+
+def test_full_page_links_to_next_page_by_last_key():
+    rows = [result(9, 0.9), result(8, 0.0607927), result(3, 0.0607927)]
+    _, keyboard = _render("заказ", rows)
+
+    button = keyboard.inline_keyboard[0][0]
+    assert button.callback_data == "search:0.0607927:3"
+    assert len(button.callback_data.encode()) <= 64
+
+
+class FakeDatabase:
+    def __init__(self, rows):
+        self.rows = rows
+        self.calls = []
+
+    async def search_messages(self, query, thread_id=None, limit=None, after=None):
+        self.calls.append((query, thread_id, limit, after))
+        return self.rows
+
+
+class FakeCallback:
+    def __init__(self, data, command_text, thread_id=None):
+        self.data = data
+        command = SimpleNamespace(
+            text=command_text,
+            is_topic_message=thread_id is not None,
+            message_thread_id=thread_id,
+        )
+        self.message = SimpleNamespace(reply_to_message=command)
+        self.answers = []
+        self.edits = []
+
+    async def answer(self, text=None):
+        self.answers.append(text)
+
+    async def edit_message_text(self, text, reply_markup=None):
+        self.edits.append((text, reply_markup))
+
+    async def edit_message_reply_markup(self, reply_markup=None):
+        self.edits.append((None, reply_markup))
+
+
+def turn_page(monkeypatch, rows, data):
+    database = FakeDatabase(rows)
+    monkeypatch.setattr(search, "db", database)
+    callback = FakeCallback(data, "/search заказ", thread_id=7)
+    asyncio.run(search.search_page(SimpleNamespace(callback_query=callback), None))
+    return database, callback
+
+
+def test_next_page_continues_after_last_key(monkeypatch):
+    _, keyboard = _render("заказ", [result(9, 0.9), result(8, 0.5), result(3, 0.25)])
+    data = keyboard.inline_keyboard[0][0].callback_data
+
+    database, callback = turn_page(monkeypatch, [result(2, 0.1)], data)
+
+    assert database.calls == [("заказ", 7, PAGE_SIZE, (0.25, 3))]
+    text, markup = callback.edits[0]
+    assert "топик 7" in text and markup is None
+
+
+def test_next_page_after_last_result(monkeypatch):
+    _, callback = turn_page(monkeypatch, [], "search:0.25:3")
+
+    assert callback.answers == ["Больше результатов нет"]
+    assert callback.edits == [(None, None)]